@@ -0,0 +1,282 @@
+"""Asynchronous RawFile I/O for asyncio applications.
+
+AsyncRawFile wraps a RawFile: its operations are coroutines executed by a
+shared I/O thread pool, so the event loop is never blocked and no thread is
+created per request:
+
+    async with await open_async( path, 'rb', read_ahead=256 * 1024 ) as f:
+        async for line in f:
+            ...
+
+The operations of a file are executed in the order they were requested by
+a single pool thread at a time (the file position is shared). At most
+max_outstanding operations are queued per file, further requests wait in
+the event loop. With read_ahead, the next read_ahead bytes are read in the
+background while the caller processes the data already returned.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import threading
+from rpybuiltin.builtin import RawFile, SEEK_CUR, SEEK_SET
+
+# Number of threads of the shared I/O pool
+IO_WORKERS = 4
+DEFAULT_MAX_OUTSTANDING = 16
+
+_lock = threading.Lock()
+_executor = None
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=IO_WORKERS )
+        return _executor
+
+async def open_async( path, mode='r', max_outstanding=DEFAULT_MAX_OUTSTANDING,
+                      read_ahead=0, executor=None, **options ):
+    """Opens a RawFile (options are passed to RawFile) in the I/O thread pool
+       and returns its AsyncRawFile.
+    """
+    if executor is None:
+        executor = _get_executor()
+    raw = await asyncio.wrap_future(
+        executor.submit( lambda: RawFile( path, mode, **options ) ) )
+    return AsyncRawFile( raw, max_outstanding, read_ahead, executor )
+
+
+class AsyncRawFile(object):
+    """Awaitable operations on a RawFile, see the module documentation.
+    """
+    def __init__( self, raw, max_outstanding=DEFAULT_MAX_OUTSTANDING,
+                  read_ahead=0, executor=None ):
+        if max_outstanding <= 0:
+            raise ValueError( 'Invalid number of outstanding requests: %r' % max_outstanding )
+        self.raw = raw
+        self.read_ahead = read_ahead
+        self._executor = executor if executor is not None else _get_executor()
+        self._outstanding = asyncio.Semaphore( max_outstanding )
+        self._state_lock = asyncio.Lock() # protects the read ahead state
+        self._jobs_lock = threading.Lock()
+        self._jobs = collections.deque() # [(concurrent.futures.Future, fn, args)]
+        self._running = False # a pool thread is executing the jobs
+        self._ahead = b'' # data read ahead
+        self._start = 0 # index of the first byte of _ahead not returned yet
+        self._prefetch = None # asyncio future of the next read ahead chunk
+        self._eof = False # the read ahead reached the end of the file
+
+    async def __aenter__( self ):
+        return self
+
+    async def __aexit__( self, exc_type, exc_val, exc_tb ):
+        await self.close()
+
+    def __aiter__( self ):
+        return self
+
+    async def __anext__( self ):
+        line = await self.readline()
+        if not line:
+            raise StopAsyncIteration
+        return line
+
+    # Job queue
+
+    def _submit( self, fn, *args ):
+        """Queues fn(*args) after the previous jobs of the file. Returns an
+           asyncio future of its result.
+        """
+        future = concurrent.futures.Future()
+        with self._jobs_lock:
+            self._jobs.append( (future, fn, args) )
+            start = not self._running
+            self._running = True
+        if start:
+            self._executor.submit( self._run_jobs )
+        return asyncio.wrap_future( future )
+
+    def _run_jobs( self ):
+        """Executes the queued jobs in order, in a pool thread."""
+        while True:
+            with self._jobs_lock:
+                if not self._jobs:
+                    self._running = False
+                    return
+                future, fn, args = self._jobs.popleft()
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn( *args )
+                except BaseException as e:
+                    future.set_exception( e )
+                else:
+                    future.set_result( result )
+
+    async def _call( self, fn, *args ):
+        async with self._outstanding:
+            return await self._submit( fn, *args )
+
+    # Read ahead
+
+    def _start_prefetch( self ):
+        if self.read_ahead > 0 and self._prefetch is None and not self._eof:
+            self._prefetch = self._submit( self.raw.read, self.read_ahead )
+
+    async def _fill( self, min_size=0 ):
+        """Appends the next read ahead chunk to the unread data, or reads
+           min_size bytes at once if no chunk is pending and min_size is
+           larger. Returns False at the end of the file.
+        """
+        if self._eof:
+            return False
+        if self._prefetch is None and min_size > self.read_ahead:
+            self._prefetch = self._submit( self.raw.read, min_size )
+        else:
+            self._start_prefetch()
+        data = await self._await_prefetch()
+        if not data:
+            self._eof = True
+            return False
+        if self._start < len(self._ahead):
+            data = self._ahead[self._start:] + data
+        self._ahead, self._start = data, 0
+        return True
+
+    async def _await_prefetch( self ):
+        """Returns the data of the pending read. The read already advances
+           the file position: if the caller is cancelled (e.g. by
+           asyncio.wait_for()), the read is left pending and its data are
+           returned to the next caller.
+        """
+        prefetch = self._prefetch
+        try:
+            data = await asyncio.shield( prefetch )
+        except asyncio.CancelledError:
+            if prefetch.cancelled():
+                self._prefetch = None
+            raise
+        except:
+            self._prefetch = None
+            raise
+        self._prefetch = None
+        return data
+
+    def _get_unread_size( self ):
+        return len(self._ahead) - self._start
+
+    async def _drop_read_ahead( self ):
+        """Rewinds the file position to the first byte not returned and
+           discards the read ahead data.
+        """
+        unread_size = self._get_unread_size()
+        if self._prefetch is not None:
+            unread_size += len(await self._await_prefetch())
+        self._ahead, self._start = b'', 0
+        self._eof = False
+        if unread_size: # the seek is done even if the caller is cancelled
+            await asyncio.shield( self._submit( self.raw.seek, -unread_size, SEEK_CUR ) )
+
+    def _take( self, size ):
+        end = min( len(self._ahead), self._start + size )
+        data = self._ahead[self._start:end]
+        self._start = end
+        self._start_prefetch()
+        return data
+
+    # RawFile interface
+
+    async def read( self, n=-1 ):
+        """Reads at most n bytes, until EOF if n is negative."""
+        if self.read_ahead <= 0:
+            return await self._call( self.raw.read, n )
+        async with self._outstanding, self._state_lock:
+            if n < 0: # the unread data are read again with the rest of the file
+                await self._drop_read_ahead()
+                self._prefetch = self._submit( self.raw.read )
+                return await self._await_prefetch()
+            while self._get_unread_size() < n and \
+                  await self._fill( n - self._get_unread_size() ):
+                pass
+            return self._take( n )
+
+    async def readinto( self, buffer ):
+        """Reads at most len(buffer) bytes into buffer. Returns the number of
+           bytes read, 0 at EOF. The buffer must not be used until the
+           operation completes.
+        """
+        if self.read_ahead <= 0:
+            return await self._call( self.raw.readinto, buffer )
+        view = memoryview( buffer ).cast( 'B' )
+        data = await self.read( len(view) )
+        view[:len(data)] = data
+        return len(data)
+
+    async def readline( self, limit=-1 ):
+        """Reads a line, including its trailing newline. If limit is not
+           negative, at most limit bytes are returned.
+        """
+        if self.read_ahead <= 0:
+            return await self._call( self.raw.readline, limit )
+        async with self._outstanding, self._state_lock:
+            scanned_size = 0
+            while True:
+                index = self._ahead.find( b'\n', self._start + scanned_size )
+                if index != -1:
+                    line_size = index + 1 - self._start
+                    break
+                scanned_size = self._get_unread_size()
+                if 0 <= limit <= scanned_size or not await self._fill():
+                    line_size = self._get_unread_size()
+                    break
+            if 0 <= limit < line_size:
+                line_size = limit
+            return self._take( line_size )
+
+    async def readlines( self, hint=0 ):
+        lines = []
+        total_size = 0
+        while hint <= 0 or total_size < hint:
+            line = await self.readline()
+            if not line:
+                break
+            lines.append( line )
+            total_size += len(line)
+        return lines
+
+    async def write( self, data ):
+        """Writes data, see RawFile.write(). The data must not be modified
+           until the operation completes.
+        """
+        return await self._call_after_reads( self.raw.write, data )
+
+    async def writelines( self, lines ):
+        return await self._call_after_reads( self.raw.writelines, list(lines) )
+
+    async def seek( self, offset, whence=SEEK_SET ):
+        return await self._call_after_reads( self.raw.seek, offset, whence )
+
+    async def tell( self ):
+        return await self._call_after_reads( self.raw.tell )
+
+    async def truncate( self, size=None ):
+        return await self._call_after_reads( self.raw.truncate, size )
+
+    async def flush( self ):
+        return await self._call_after_reads( self.raw.flush )
+
+    async def close( self ):
+        await self._call_after_reads( self.raw.close )
+
+    @property
+    def closed( self ):
+        return self.raw.closed
+
+    async def _call_after_reads( self, fn, *args ):
+        async with self._outstanding:
+            if self.read_ahead <= 0:
+                return await self._submit( fn, *args )
+            async with self._state_lock:
+                if not self.raw.closed:
+                    await self._drop_read_ahead()
+                return await self._submit( fn, *args )
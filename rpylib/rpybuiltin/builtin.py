@@ -4,7 +4,10 @@ Each global is annotated with relevant type information.
 """
 from __future__ import unicode_literals
 import ctypes
-import rpybuiltin._win32kernel as _win32kernel
+import errno
+import mmap
+import os
+import sys
 
 long = int # @todo introduce int64 type specification
 
@@ -12,16 +15,417 @@ SEEK_SET = 0
 SEEK_CUR = 1
 SEEK_END = 2
 
-_WIN32_SEEK = { SEEK_SET: _win32kernel.FILE_BEGIN,
-                SEEK_CUR: _win32kernel.FILE_CURRENT,
-                SEEK_END: _win32kernel.FILE_END }
+# Access pattern hints of a RawFile (posix_fadvise() advice)
+ACCESS_NORMAL = 'normal'
+ACCESS_SEQUENTIAL = 'sequential'
+ACCESS_RANDOM = 'random'
 
+# Durability policies of the data written to a RawFile
+SYNC_NEVER = 'never' # flush() only writes the buffered data
+SYNC_ON_FLUSH = 'flush' # flush() also syncs the file to disk
+SYNC_ON_WRITE = 'write' # each write system call is followed by a sync
 
-class RawFile(object):
+if sys.platform == 'win32':
+    import rpybuiltin._win32kernel as _win32kernel
+
+    _WIN32_SEEK = { SEEK_SET: _win32kernel.FILE_BEGIN,
+                    SEEK_CUR: _win32kernel.FILE_CURRENT,
+                    SEEK_END: _win32kernel.FILE_END }
+else:
+    _POSIX_ADVICE = { ACCESS_NORMAL: getattr( os, 'POSIX_FADV_NORMAL', None ),
+                      ACCESS_SEQUENTIAL: getattr( os, 'POSIX_FADV_SEQUENTIAL', None ),
+                      ACCESS_RANDOM: getattr( os, 'POSIX_FADV_RANDOM', None ) }
+    _MMAP_ADVICE = { ACCESS_NORMAL: getattr( mmap, 'MADV_NORMAL', None ),
+                     ACCESS_SEQUENTIAL: getattr( mmap, 'MADV_SEQUENTIAL', None ),
+                     ACCESS_RANDOM: getattr( mmap, 'MADV_RANDOM', None ) }
+
+# Largest number of bytes transferred by a single read/write system call on
+# Linux. Larger transfers are split.
+_MAX_IO_SIZE = 0x7ffff000
+# Default size of the buffer of BufferedReader
+DEFAULT_BUFFER_SIZE = 64 * 1024
+# Alignment of the offsets, sizes and buffers of the O_DIRECT reads
+DIRECT_IO_ALIGNMENT = 4096
+# Largest number of buffers of a vectored write (IOV_MAX)
+try:
+    _IOV_MAX = os.sysconf( 'SC_IOV_MAX' )
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 1024
+
+def _pread( fd, n, position ):
+    """Reads at most n bytes at position with pread() (python 3.3), or
+       lseek() + read() on older versions.
+    """
+    if hasattr( os, 'pread' ):
+        return os.pread( fd, n, position )
+    os.lseek( fd, position, SEEK_SET )
+    return os.read( fd, n )
+
+def _pread_into( fd, view, position ):
+    """Reads at most len(view) bytes at position into view (a writable
+       memoryview). Returns the number of bytes read, 0 at EOF.
+       Notes: preadv() (python 3.7) reads into view without copy, otherwise
+       the data read by _pread() is copied.
+    """
+    if hasattr( os, 'preadv' ):
+        return os.preadv( fd, [view], position )
+    data = _pread( fd, len(view), position )
+    view[:len(data)] = data
+    return len(data)
+
+def _pwrite_vectored( fd, views, position ):
+    """Writes the views at position. Returns the number of bytes written.
+       Without pwritev() (python 3.7), the views are joined in a single
+       pwrite() (python 3.3) or lseek() + write().
+    """
+    if hasattr( os, 'pwritev' ):
+        return os.pwritev( fd, views, position )
+    data = len(views) == 1 and views[0] or b''.join( views )
+    if hasattr( os, 'pwrite' ):
+        return os.pwrite( fd, data, position )
+    os.lseek( fd, position, SEEK_SET )
+    return os.write( fd, data )
+
+def _write_vectored( fd, views ):
+    """Writes the views at the position of the descriptor, see
+       _pwrite_vectored().
+    """
+    if hasattr( os, 'writev' ):
+        return os.writev( fd, views )
+    return os.write( fd, len(views) == 1 and views[0] or b''.join( views ) )
+
+
+class _RawFileBase(object):
+    """Methods of the RawFile interface implemented on top of read(),
+       seek(), _read_raw_into() and _write_raw_vectored().
+    """
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_val, exc_tb ): # context manager protocol
+        self.close()
+
+    def __del__( self ):
+        """Writes the pending data and closes a file that was not closed."""
+        try:
+            closed = self.closed
+        except AttributeError: # the file could not be opened
+            return
+        if not closed:
+            self.close()
+
+    _line_reader = None # BufferedReader used by readline(), see _get_line_reader()
+    _write_buffer = None # WriteBuffer of the pending writes, None if unbuffered
+    _sync = SYNC_ON_FLUSH
+
+    def _init_write_buffer( self, writable, write_buffer_size, line_buffering, sync ):
+        if sync not in (SYNC_NEVER, SYNC_ON_FLUSH, SYNC_ON_WRITE):
+            raise ValueError( 'Invalid sync policy: %r' % sync )
+        self._sync = sync
+        if writable and write_buffer_size > 0:
+            self._write_buffer = WriteBuffer( self, write_buffer_size, line_buffering )
+
+    def __iter__( self ):
+        return self.iter_lines()
+
+    def __next__( self ):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+    __next__.rpy_return_type = ('memoryview',)
+
+    def iter_lines( self, views=False ):
+        """Generator yielding the lines until EOF. Memory usage does not
+           depend on the size of the file: lines are read through the
+           buffer of the line reader. If views is True, the lines are
+           memoryviews of that buffer, only valid until the next line is
+           requested.
+        """
+        while True:
+            if views:
+                line = self._get_line_reader().readline_view()
+            else:
+                line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def iter_records( self, record_size ):
+        """Generator yielding the fixed size records until EOF as memoryviews
+           of the buffer of the line reader, only valid until the next record
+           is requested. The last record is shorter if the file size is not a
+           multiple of record_size.
+        """
+        if record_size <= 0:
+            raise ValueError( 'Invalid record size: %r' % record_size )
+        while True:
+            record = self._get_line_reader().read_view( record_size )
+            if not record:
+                return
+            yield record
+
+    def readline( self, limit=-1 ):
+        """Reads a line, including its trailing newline. If limit is not
+           negative, at most limit bytes are returned.
+        """
+        return self._get_line_reader().readline( limit )
+    readline.rpy_return_type = ('memoryview',)
+    readline.rpy_parameter_types = { 'limit': long }
+
+    def readlines( self, hint=0 ):
+        """Reads the lines until EOF, or until the total size of the lines
+           exceeds hint if it is positive.
+        """
+        return self._get_line_reader().readlines( hint )
+    readlines.rpy_parameter_types = { 'hint': long }
+
+    def write( self, data ):
+        """Writes data (a bytes-like object) at the current position (at the
+           end of the file in append mode). Small writes are buffered until
+           write_buffer_size bytes are pending. Returns len(data).
+        """
+        if self.closed:
+            raise ValueError( 'I/O operation on closed file' )
+        self._drop_line_reader()
+        if self._write_buffer is not None:
+            self._write_buffer.write( data )
+        else:
+            self._write_raw_vectored( [data] )
+        return len(data)
+    write.rpy_return_type = long
+    write.rpy_parameter_types = { 'data': ('memoryview',) }
+
+    def writelines( self, lines ):
+        """Writes the bytes-like objects of lines. Unbuffered files write
+           them with a single vectored write.
+        """
+        if self.closed:
+            raise ValueError( 'I/O operation on closed file' )
+        self._drop_line_reader()
+        if self._write_buffer is not None:
+            self._write_buffer.writelines( lines )
+        else:
+            self._write_raw_vectored( list(lines) )
+    writelines.rpy_return_type = type(None)
+    writelines.rpy_parameter_types = { 'lines': (list, ('memoryview',)) }
+
+    def readinto( self, buffer ):
+        """Reads at most len(buffer) bytes into buffer (a writable bytes-like
+           object) without intermediate copy. Returns the number of bytes
+           read, 0 at EOF.
+        """
+        if self.closed:
+            raise ValueError( 'I/O operation on closed file' )
+        self._sync_buffers()
+        view = memoryview( buffer ).cast( 'B' )
+        try:
+            return self._read_raw_into( view )
+        finally:
+            view.release()
+    readinto.rpy_return_type = long
+    readinto.rpy_parameter_types = { 'buffer': ('memoryview',) }
+
+    def _get_line_reader( self ):
+        """Returns the reader buffering the data ahead of the lines returned
+           by readline(). The other operations call _drop_line_reader() first.
+           The pending writes are written before the reader is created.
+        """
+        if self.closed:
+            raise ValueError( 'I/O operation on closed file' )
+        if self._line_reader is None:
+            self._flush_write_buffer()
+            self._line_reader = BufferedReader( self )
+        return self._line_reader
+
+    def _drop_line_reader( self ):
+        """Rewinds the file position to the first byte not returned by
+           readline() and discards the read ahead data.
+        """
+        reader = self._line_reader
+        if reader is not None:
+            self._line_reader = None
+            unread_size = reader.get_buffered_size()
+            if unread_size:
+                self.seek( -unread_size, SEEK_CUR )
+
+    def _flush_write_buffer( self ):
+        """Writes the pending data of the write buffer."""
+        if self._write_buffer is not None:
+            self._write_buffer.flush()
+
+    def _get_pending_write_size( self ):
+        if self._write_buffer is None:
+            return 0
+        return self._write_buffer.get_pending_size()
+
+    def _sync_buffers( self ):
+        """Writes the pending data and drops the line reader: called before
+           the operations using or changing the file position.
+        """
+        self._flush_write_buffer()
+        self._drop_line_reader()
+
+
+class WriteBuffer(object):
+    """Write-behind buffer of a raw file. Written data are kept until
+       buffer_size bytes are pending (or a newline is written if
+       line_buffering), then the pending chunks are written with one vectored
+       write (writev). Writes of at least buffer_size bytes are not copied:
+       they are written with the pending chunks.
+    """
+    def __init__( self, raw, buffer_size=DEFAULT_BUFFER_SIZE, line_buffering=False ):
+        self.raw = raw
+        self.buffer_size = buffer_size
+        self.line_buffering = line_buffering
+        self._chunks = []
+        self._size = 0 # total size of the pending chunks
+
+    def get_pending_size( self ):
+        """Returns the number of bytes written but not yet passed to the raw file."""
+        return self._size
+
+    def write( self, data ):
+        if len(data) >= self.buffer_size:
+            self._chunks.append( data )
+            self._size += len(data)
+            self.flush()
+            return
+        self._append( data )
+        if self._size >= self.buffer_size or (self.line_buffering and b'\n' in data):
+            self.flush()
+
+    def writelines( self, lines ):
+        flush = False
+        for line in lines:
+            self._append( line )
+            flush = flush or (self.line_buffering and b'\n' in line)
+        if flush or self._size >= self.buffer_size:
+            self.flush()
+
+    def _append( self, data ):
+        if not isinstance( data, bytes ): # the caller may modify it
+            data = bytes( data )
+        self._chunks.append( data )
+        self._size += len(data)
+
+    def flush( self ):
+        if self._chunks:
+            chunks = self._chunks
+            self._chunks, self._size = [], 0
+            self.raw._write_raw_vectored( chunks )
+
+
+class BufferedReader(object):
+    """Reads lines from a raw file with a reusable buffer. The buffer is
+       filled with one read per buffer_size bytes, newlines are searched with
+       bytearray.find() (memchr). Lines longer than the buffer grow it.
+       Notes: the position of the raw file is after the buffered data.
+    """
+    def __init__( self, raw, buffer_size=DEFAULT_BUFFER_SIZE ):
+        self.raw = raw
+        self._buffer = bytearray( buffer_size )
+        self._view = memoryview( self._buffer )
+        self._start = 0 # index of the first unread byte
+        self._end = 0 # index of the end of the buffered data
+
+    def get_buffered_size( self ):
+        """Returns the number of bytes read from the raw file but not returned."""
+        return self._end - self._start
+
+    def _refill( self, min_size=0 ):
+        """Moves the unread data to the start of the buffer and reads data
+           after it. The buffer is grown if it is full or smaller than
+           min_size. Returns the number of bytes read, 0 at EOF.
+        """
+        unread_size = self._end - self._start
+        buffer_size = len(self._buffer)
+        if unread_size == buffer_size or min_size > buffer_size:
+            # Notes: a new buffer, views returned on the previous one may be alive
+            buffer = bytearray( max( 2 * buffer_size, min_size ) )
+            buffer[:unread_size] = self._view[self._start:self._end]
+            self._buffer, self._view = buffer, memoryview( buffer )
+            self._start, self._end = 0, unread_size
+        elif self._start:
+            self._view[:unread_size] = self._view[self._start:self._end] # memmove
+            self._start, self._end = 0, unread_size
+        size = self.raw._read_raw_into( self._view[self._end:] )
+        self._end += size
+        return size
+
+    def _find_line_end( self, limit ):
+        """Returns the index of the end of the next line in the buffer,
+           refilling it as needed.
+        """
+        scanned_size = 0 # bytes of the line already searched for a newline
+        while True:
+            index = self._buffer.find( b'\n', self._start + scanned_size, self._end )
+            if index != -1:
+                line_end = index + 1
+                break
+            scanned_size = self._end - self._start
+            if 0 <= limit <= scanned_size or not self._refill(): # limit or EOF
+                line_end = self._end
+                break
+        if 0 <= limit < line_end - self._start:
+            line_end = self._start + limit
+        return line_end
+
+    def readline( self, limit=-1 ):
+        line_end = self._find_line_end( limit )
+        line = bytes( self._view[self._start:line_end] )
+        self._start = line_end
+        return line
+
+    def readline_view( self, limit=-1 ):
+        """Same as readline(), but returns a memoryview of the buffer, only
+           valid until the next read.
+        """
+        line_end = self._find_line_end( limit )
+        line = self._view[self._start:line_end]
+        self._start = line_end
+        return line
+
+    def read_view( self, size ):
+        """Returns a memoryview of the next size bytes of the buffer (less at
+           EOF), only valid until the next read.
+        """
+        while self._end - self._start < size:
+            if not self._refill( size ):
+                break
+        end = min( self._end, self._start + size )
+        data = self._view[self._start:end]
+        self._start = end
+        return data
+
+    def readlines( self, hint=0 ):
+        lines = []
+        total_size = 0
+        while hint <= 0 or total_size < hint:
+            line = self.readline()
+            if not line:
+                break
+            lines.append( line )
+            total_size += len(line)
+        return lines
+
+    def __iter__( self ):
+        return self
+
+    def __next__( self ):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+
+class Win32RawFile(_RawFileBase):
     """Implementation of the RawFile interface using WIN32 API.
        Notes: only support BINARY file and returns/accepts bytes on read/write.
     """
-    def __init__( self, path, mode='r', delete_on_close=False ):
+    def __init__( self, path, mode='r', delete_on_close=False,
+                  write_buffer_size=DEFAULT_BUFFER_SIZE, line_buffering=False,
+                  sync=SYNC_ON_FLUSH ):
         truncate = False
         if mode[0:1] == 'r':
             wmode = _win32kernel.FILE_GENERIC_READ
@@ -56,17 +460,15 @@ class RawFile(object):
                 flag_attributes, _win32kernel.HANDLE() ) )
         self.__seekable = True
         _win32kernel.check_valid_handle( self.__handle, IOError )
+        self._init_write_buffer( self.__writable, write_buffer_size, line_buffering, sync )
 
-    def __enter__( self ):
-        return self
-
-    def __exit__( self, exc_type, exc_val, exc_tb ): # context manager protocol
-        self.close()
-    
     def close( self ):
         if self.__handle != _win32kernel.INVALID_HANDLE_VALUE:
-            _win32kernel.CloseHandle( self.__handle )
-            self.__handle = _win32kernel.INVALID_HANDLE_VALUE
+            try:
+                self._flush_write_buffer()
+            finally:
+                _win32kernel.CloseHandle( self.__handle )
+                self.__handle = _win32kernel.INVALID_HANDLE_VALUE
     close.rpy_return_type = type(None)
 
     def __check_not_closed( self ):
@@ -79,12 +481,15 @@ class RawFile(object):
         return self.__handle == _win32kernel.INVALID_HANDLE_VALUE
 
     def flush( self ):
-        """Flush pending write to disk. If file is a pipe, wait for client to read all data.
+        """Writes the buffered data, then flush pending write to disk
+        (unless the sync policy is SYNC_NEVER). If file is a pipe, wait for
+        client to read all data.
         """
         self.__check_not_closed()
+        self._flush_write_buffer()
         # Notes: FlushFileBuffers will fail if file was not open with
         # GENERIC_WRITE access
-        if self.__writable: 
+        if self.__writable and self._sync == SYNC_ON_FLUSH:
             _win32kernel.check_io_succeed(
                 _win32kernel.FlushFileBuffers( self.__handle ) )
     flush.rpy_return_type = type(None)
@@ -108,6 +513,7 @@ class RawFile(object):
 
     def seek( self, offset, whence=SEEK_SET):
         self.__check_not_closed()
+        self._sync_buffers()
         seek_method = _WIN32_SEEK[whence]
         new_pos = _win32kernel.LARGE_INTEGER()
         _win32kernel.check_io_succeed(
@@ -132,10 +538,11 @@ class RawFile(object):
     def tell( self ):
         self.__check_not_closed()
         return self.seek( 0, whence=SEEK_CUR )
-    seekable.rpy_return_type = long
+    tell.rpy_return_type = long
 
     def truncate( self, size=None ):
         self.__check_not_closed()
+        self._sync_buffers()
         if size is not None:
             self.seek( size, whence=SEEK_SET )
         # Truncate file at current position
@@ -157,6 +564,7 @@ class RawFile(object):
         if n > 0x7fffffff:
             raise ValueError( "Can not read more than 0x7fffffff bytes at once." )
         self.__check_not_closed()
+        self._sync_buffers()
         buffer = ctypes.create_string_buffer( n )
         to_read = _win32kernel.DWORD( min(0x7fffffff, n) )
         bytes_read = _win32kernel.DWORD()
@@ -176,86 +584,435 @@ class RawFile(object):
     def readall( self ):
         """Reads all the data of the file until EOF."""
         self.__check_not_closed()
+        self._sync_buffers()
         size = _win32kernel.LARGE_INTEGER()
         _win32kernel.check_io_succeed(
             _win32kernel.GetFileSizeEx( self.__handle, ctypes.byref(size) ) )
         return self.read( size.value )
     readall.rpy_return_type = ('memoryview',)
 
-    def readline( self, sizehint=0 ):
-        if sizehint <= 0:
-            sizehint = 2048
-        data = self.read( sizehint )
-        index = data.find( b'\n' )
-        if index != -1:
-            offset = index + 1 - len(data)
-            if offset:
-                self.seek( offset, SEEK_CUR )
-            return data[:index+1]
-        if len(data) < sizehint: # eof found
+    def _read_raw_into( self, view ):
+        """Reads at most len(view) bytes into view (a writable memoryview).
+           Returns the number of bytes read, 0 at EOF.
+        """
+        self.__check_not_closed()
+        to_read = min( 0x7fffffff, len(view) )
+        buffer = (ctypes.c_char * to_read).from_buffer( view )
+        bytes_read = _win32kernel.DWORD()
+        if not _win32kernel.ReadFile( self.__handle, buffer,
+            _win32kernel.DWORD( to_read ),
+            ctypes.byref(bytes_read),
+            _win32kernel.LPOVERLAPPED() ):
+            if _win32kernel.GetLastError() != _win32kernel.ERROR_HANDLE_EOF:
+                raise _win32kernel.make_windows_error()
+        return bytes_read.value
+
+    def _write_raw_vectored( self, chunks ):
+        """Writes the bytes-like objects of chunks at the current position.
+           Notes: WriteFileGather only supports unbuffered page aligned
+           transfers, the chunks are joined and written with WriteFile.
+        """
+        self.__check_not_closed()
+        data = b''.join( chunks )
+        written = 0
+        while written < len(data):
+            to_write = min( 0x7fffffff, len(data) - written )
+            buffer = ctypes.c_char_p( data[written:written + to_write] )
+            bytes_written = _win32kernel.DWORD()
+            _win32kernel.check_io_succeed(
+                _win32kernel.WriteFile( self.__handle, buffer,
+                                        _win32kernel.DWORD( to_write ),
+                                        ctypes.byref( bytes_written ),
+                                        _win32kernel.LPOVERLAPPED() ) )
+            written += bytes_written.value
+        if self._sync == SYNC_ON_WRITE:
+            _win32kernel.check_io_succeed(
+                _win32kernel.FlushFileBuffers( self.__handle ) )
+
+
+class PosixRawFile(_RawFileBase):
+    """Implementation of the RawFile interface using POSIX file descriptors.
+       The file position is maintained by the object: reads and writes are
+       positional (pread/pwrite), so seek() and tell() do not issue system
+       calls.
+       Options:
+       - delete_on_close: the file is unlinked as soon as it is opened, it is
+         deleted when the descriptor is closed.
+       - access: ACCESS_SEQUENTIAL or ACCESS_RANDOM hint passed to
+         posix_fadvise() (read ahead window).
+       - direct: read with O_DIRECT, bypassing the page cache. Only supported
+         for read-only files.
+       - cloexec: the descriptor is not inherited by child processes
+         (O_CLOEXEC).
+       - mapped: the file is memory mapped when it is opened. read(),
+         readall(), readline() and readlines() return memoryview slices of
+         the mapping instead of copies, the access hint is passed to
+         madvise(). Only supported for read-only files. The size of the file
+         is the size at the time it was opened.
+       - write_buffer_size: size of the write-behind buffer (see
+         WriteBuffer), 0 to write each call with its own system call.
+       - line_buffering: the write buffer is flushed when a newline is
+         written.
+       - sync: SYNC_NEVER, SYNC_ON_FLUSH (flush() calls fsync()) or
+         SYNC_ON_WRITE (each write is followed by fdatasync()).
+       Notes: only support BINARY file and returns/accepts bytes on read/write.
+    """
+    def __init__( self, path, mode='r', delete_on_close=False, access=None,
+                  direct=False, cloexec=True, mapped=False,
+                  write_buffer_size=DEFAULT_BUFFER_SIZE, line_buffering=False,
+                  sync=SYNC_ON_FLUSH ):
+        if mode[0:1] == 'r':
+            flags = os.O_RDONLY
+            self.__readable, self.__writable, self.__seekable = True, False, True
+        elif mode[0:1] == 'w':
+            flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+            self.__readable, self.__writable, self.__seekable = False, True, True
+        elif mode[0:1] == 'a':
+            flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+            self.__readable, self.__writable, self.__seekable = False, True, False
+        else:
+            raise ValueError( 'Invalid mode: %r' % mode )
+        if mode[1:2] == '+': # open for updating
+            self.__readable, self.__writable = True, True
+            flags = (flags & ~os.O_WRONLY) | os.O_RDWR
+            if mode[0:1] == 'r': # Creates file if it does not exist
+                flags |= os.O_CREAT
+        if cloexec:
+            flags |= getattr( os, 'O_CLOEXEC', 0 )
+        if direct:
+            if self.__writable:
+                raise ValueError( 'Direct I/O is only supported for reading' )
+            if not hasattr( os, 'O_DIRECT' ):
+                raise ValueError( 'Direct I/O is not supported on this platform' )
+            flags |= os.O_DIRECT
+        if mapped and (self.__writable or direct):
+            raise ValueError( 'Memory mapping is only supported for reading' )
+        self._init_write_buffer( self.__writable, write_buffer_size, line_buffering, sync )
+        self.__direct = direct
+        self.__fd = os.open( path, flags, 0o666 )
+        self.__position = 0
+        if not self.__seekable: # O_APPEND: starts at the end of the file
+            self.__position = os.lseek( self.__fd, 0, SEEK_END )
+        self.__mapping = None
+        self.__mapped_view = None
+        if mapped:
+            self.__map()
+        if delete_on_close:
+            os.unlink( path )
+        if access is not None:
+            self.advise( access )
+
+    def __map( self ):
+        size = os.fstat( self.__fd ).st_size
+        if size: # an empty file can not be mapped
+            self.__mapping = mmap.mmap( self.__fd, size, access=mmap.ACCESS_READ )
+            self.__mapped_view = memoryview( self.__mapping )
+        else:
+            self.__mapped_view = memoryview( b'' )
+
+    def close( self ):
+        if self.__fd != -1:
+            try:
+                self._flush_write_buffer()
+            finally:
+                if self.__mapped_view is not None:
+                    self.__mapped_view.release()
+                    self.__mapped_view = None
+                if self.__mapping is not None:
+                    try:
+                        self.__mapping.close()
+                    except BufferError: # unmapped when the returned views are released
+                        pass
+                    self.__mapping = None
+                os.close( self.__fd )
+                self.__fd = -1
+    close.rpy_return_type = type(None)
+
+    def __check_not_closed( self ):
+        if self.__fd == -1:
+            raise ValueError( 'I/O operation on closed file' )
+    __check_not_closed.rpy_return_type = type(None)
+
+    @property
+    def closed( self ):
+        return self.__fd == -1
+
+    def advise( self, access, offset=0, length=0 ):
+        """Declares the access pattern of the range [offset, offset+length)
+           of the file (up to the end of the file if length is 0). Ignored
+           if posix_fadvise() (or madvise() for a mapped file) is not
+           supported.
+        """
+        self.__check_not_closed()
+        if self.__mapping is not None:
+            advice = _MMAP_ADVICE[access]
+            if advice is not None and hasattr( mmap.mmap, 'madvise' ): # python 3.8
+                start = offset - offset % mmap.PAGESIZE # must be page aligned
+                end = len(self.__mapping)
+                if length:
+                    end = min( end, offset + length )
+                if start < end:
+                    self.__mapping.madvise( advice, start, end - start )
+            return
+        advice = _POSIX_ADVICE[access]
+        if advice is not None:
+            os.posix_fadvise( self.__fd, offset, length, advice )
+    advise.rpy_return_type = type(None)
+    advise.rpy_parameter_types = {
+        'access': str,
+        'offset': long,
+        'length': long }
+
+    def flush( self ):
+        """Writes the buffered data, then flush pending write to disk
+        (unless the sync policy is SYNC_NEVER).
+        """
+        self.__check_not_closed()
+        self._flush_write_buffer()
+        if self.__writable and self._sync == SYNC_ON_FLUSH:
+            os.fsync( self.__fd )
+    flush.rpy_return_type = type(None)
+
+    def fileno( self ):
+        """Returns the file descriptor.
+        """
+        self.__check_not_closed()
+        return self.__fd
+    fileno.rpy_return_type = int
+
+    def isatty( self ):
+        self.__check_not_closed()
+        return os.isatty( self.__fd )
+    isatty.rpy_return_type = bool
+
+    def readable( self ):
+        self.__check_not_closed()
+        return self.__readable
+    readable.rpy_return_type = bool
+
+    def seek( self, offset, whence=SEEK_SET ):
+        self.__check_not_closed()
+        self._sync_buffers()
+        if whence == SEEK_SET:
+            position = offset
+        elif whence == SEEK_CUR:
+            position = self.__position + offset
+        elif whence == SEEK_END:
+            position = os.fstat( self.__fd ).st_size + offset
+        else:
+            raise ValueError( 'Invalid whence: %r' % whence )
+        if position < 0:
+            raise IOError( errno.EINVAL, os.strerror( errno.EINVAL ) )
+        self.__position = position
+        return position
+    seek.rpy_return_type = long
+    seek.rpy_parameter_types = {
+        'offset': long,
+        'whence': ('enum', {'SEEK_SET': SEEK_SET,
+                            'SEEK_CUR': SEEK_CUR,
+                            'SEEK_END': SEEK_END} )
+        }
+
+    def seekable( self ):
+        self.__check_not_closed()
+        return self.__seekable
+    seekable.rpy_return_type = bool
+
+    def tell( self ):
+        self.__check_not_closed()
+        if self._line_reader is not None:
+            return self.__position - self._line_reader.get_buffered_size()
+        if not self.__seekable: # O_APPEND: the position is the end of the file
+            self._flush_write_buffer()
+        return self.__position + self._get_pending_write_size()
+    tell.rpy_return_type = long
+
+    def truncate( self, size=None ):
+        self.__check_not_closed()
+        self._sync_buffers()
+        if size is not None:
+            self.seek( size, whence=SEEK_SET )
+        # Truncate file at current position
+        os.ftruncate( self.__fd, self.__position )
+    truncate.rpy_return_type = type(None)
+    truncate.rpy_parameter_types = {
+        'size': ('optional', long) # optional indicates that value may be None
+        }
+
+    def writable( self ):
+        self.__check_not_closed()
+        return self.__writable
+    writable.rpy_return_type = bool
+
+    def read( self, n=-1 ):
+        """Reads at most the specified number of bytes."""
+        if n < 0:
+            return self.readall()
+        self.__check_not_closed()
+        self._sync_buffers()
+        if self.__mapped_view is not None:
+            data = self.__mapped_view[self.__position:self.__position + n]
+            self.__position += len(data)
             return data
+        if self.__direct:
+            data = self.__read_direct( n )
+        elif n <= _MAX_IO_SIZE:
+            data = _pread( self.__fd, n, self.__position )
+        else:
+            view = memoryview( bytearray( n ) )
+            data = view[:self.__readinto( view, self.__position )]
+        self.__position += len(data)
+        return bytes( data )
+    read.rpy_return_type = ('memoryview',)
+    read.rpy_parameter_types = { 'n': long }
 
-        result = [data]
-        while True:
-            data = self.read( sizehint )
-            index = data.find( b'\n' )
-            if index != -1:
-                offset = index + 1 - len(data)
-                if offset:
-                    self.seek( offset, SEEK_CUR )
-                result.append( data[:index+1] )
-                break
-            elif len(data) < sizehint: # eof found
-                result.append( data )
-                break
-        return b''.join( result )
-    readline.rpy_return_type = ('memoryview',)
+    def readall( self ):
+        """Reads all the data of the file until EOF."""
+        self.__check_not_closed()
+        self._sync_buffers()
+        if self.__mapped_view is not None:
+            size = len(self.__mapped_view)
+        else:
+            size = os.fstat( self.__fd ).st_size
+        return self.read( max( 0, size - self.__position ) )
+    readall.rpy_return_type = ('memoryview',)
 
-    def readlines( self, sizehint=0 ):
-        if sizehint == 0:
-            data = self.readall()
+    def readline( self, limit=-1 ):
+        if self.__mapped_view is None:
+            return super(PosixRawFile, self).readline( limit )
+        self.__check_not_closed()
+        self._drop_line_reader()
+        view = self.__mapped_view
+        start = min( self.__position, len(view) )
+        if self.__mapping is not None:
+            end = self.__mapping.find( b'\n', start ) + 1 or len(view)
         else:
-            data = self.read( sizehint )
+            end = start
+        if 0 <= limit < end - start:
+            end = start + limit
+        self.__position = end
+        return view[start:end]
+    readline.rpy_return_type = ('memoryview',)
+    readline.rpy_parameter_types = { 'limit': long }
+
+    def readlines( self, hint=0 ):
+        if self.__mapped_view is None:
+            return super(PosixRawFile, self).readlines( hint )
         lines = []
-        index = 0
-        while index < len(data):
-            next_eol_index = data.find( b'\n', index )
-            if next_eol_index != -1:
-                lines.append( data[index:next_eol_index+1] )
-            elif len(data) < sizehint or sizehint == 0: # eof found
-                if index < len(data): # adds last trailing line without eol
-                    lines.append( data[index:] )
+        total_size = 0
+        while hint <= 0 or total_size < hint:
+            line = self.readline()
+            if not line:
                 break
-            else: # no eol found: restore position to last eol found
-                offset = index - len(data)
-                self.seek( offset, SEEK_CUR )
-                break
-            index = next_eol_index + 1
+            lines.append( line )
+            total_size += len(line)
         return lines
-                
-                
-        
-    
+    readlines.rpy_parameter_types = { 'hint': long }
+
+    def _read_raw_into( self, view ):
+        """Reads at most len(view) bytes into view (a writable memoryview).
+           Returns the number of bytes read, 0 at EOF.
+        """
+        self.__check_not_closed()
+        if self.__direct:
+            data = self.__read_direct( len(view) )
+            size = len(data)
+            view[:size] = data
+        else:
+            size = _pread_into( self.__fd, view[:_MAX_IO_SIZE], self.__position )
+        self.__position += size
+        return size
+
+    def _write_raw_vectored( self, chunks ):
+        """Writes the bytes-like objects of chunks at the current position
+           (at the end of the file in append mode) with pwritev()/writev(),
+           see _pwrite_vectored().
+           Partial writes are resumed.
+        """
+        self.__check_not_closed()
+        if len(chunks) > _IOV_MAX:
+            chunks = [b''.join( chunks )]
+        views = [memoryview( chunk ).cast( 'B' ) for chunk in chunks]
+        index = 0 # first view not completely written
+        while index < len(views):
+            if len(views[index]) > _MAX_IO_SIZE:
+                pending = [views[index][:_MAX_IO_SIZE]]
+            else:
+                pending = views[index:]
+            if self.__seekable:
+                written = _pwrite_vectored( self.__fd, pending, self.__position )
+                self.__position += written
+            else: # O_APPEND: pwrite() would also append on Linux
+                written = _write_vectored( self.__fd, pending )
+            while index < len(views) and written >= len(views[index]):
+                written -= len(views[index])
+                index += 1
+            if written:
+                views[index] = views[index][written:]
+        if not self.__seekable:
+            self.__position = os.fstat( self.__fd ).st_size
+        if self._sync == SYNC_ON_WRITE:
+            getattr( os, 'fdatasync', os.fsync )( self.__fd )
+
+    def __readinto( self, view, position ):
+        """Fills view with the data at position. Returns the number of bytes
+           read, less than len(view) at the end of the file.
+        """
+        size = 0
+        while size < len(view):
+            count = _pread_into( self.__fd, view[size:size+_MAX_IO_SIZE], position + size )
+            if count == 0: # eof
+                break
+            size += count
+        return size
+
+    def __read_direct( self, n ):
+        """Reads n bytes with O_DIRECT: the transfer is extended to aligned
+           boundaries in a page aligned buffer.
+        """
+        start = self.__position - self.__position % DIRECT_IO_ALIGNMENT
+        end = self.__position + n
+        end += -end % DIRECT_IO_ALIGNMENT
+        if end == start:
+            return b''
+        buffer = mmap.mmap( -1, end - start ) # page aligned
+        try:
+            view = memoryview( buffer )
+            try:
+                size = self.__readinto( view, start )
+                offset = self.__position - start
+                return bytes( view[offset:max( offset, min( size, offset + n ) )] )
+            finally:
+                view.release()
+        finally:
+            buffer.close()
+
+
+if sys.platform == 'win32':
+    RawFile = Win32RawFile
+else:
+    RawFile = PosixRawFile
+
 RawFile.rpy_native = True # Indicates that this class is not implemented in rpy
 
 class File(RawFile):
 
     def next( self ):
-        pass
+        return self.__next__()
     next.rpy_return_type = str
 
     def readline( self, limit=-1 ):
-        pass
-    readline.rpy_return_type = (list, str) # list of string
+        return super(File, self).readline( limit )
+    readline.rpy_return_type = str
     readline.rpy_parameter_types = {'limit': int}
 
     def readlines( self, hint=-1 ):
-        pass
-    readline.rpy_return_type = (list, str) # list of string
-    readline.rpy_parameter_types = {'limit': int}
+        return super(File, self).readlines( hint )
+    readlines.rpy_return_type = (list, str) # list of string
+    readlines.rpy_parameter_types = {'hint': int}
 
     def writelines( self, lines ):
-        pass
+        super(File, self).writelines( lines )
     writelines.rpy_parameter_types = {
         'lines': (list, str) # list of string
         }
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import os.path
+import tempfile
+import threading
+import unittest
+from rpybuiltin import asyncfile, builtin
+
+TEST_DATA_DIR = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'test_data' )
+
+PATH_256 = os.path.join( TEST_DATA_DIR, '256.data' )
+PATH_5LINES = os.path.join( TEST_DATA_DIR, '5lines.data' )
+
+DATA_256 = bytes( x for x in range(0,256) )
+
+
+class TestAsyncRawFile(unittest.TestCase):
+    def setUp( self ):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join( self.temp_dir, 'data' )
+
+    def tearDown( self ):
+        if os.path.exists( self.path ):
+            os.unlink( self.path )
+        os.rmdir( self.temp_dir )
+
+    def run_async( self, coroutine ):
+        return asyncio.run( coroutine )
+
+    def test_read( self ):
+        async def main( read_ahead ):
+            async with await asyncfile.open_async( PATH_256, 'rb', read_ahead=read_ahead ) as f:
+                head = await f.read( 10 )
+                buffer = bytearray( 20 )
+                size = await f.readinto( buffer )
+                position = await f.tell()
+                tail = await f.read()
+            return head, bytes( buffer[:size] ), position, tail
+        for read_ahead in (0, 7, 64):
+            self.assertEqual( (DATA_256[:10], DATA_256[10:30], 30, DATA_256[30:]),
+                              self.run_async( main( read_ahead ) ) )
+
+    def test_lines( self ):
+        async def main( read_ahead ):
+            async with await asyncfile.open_async( PATH_5LINES, 'rb', read_ahead=read_ahead ) as f:
+                first = await f.readline( 4 )
+                lines = [ line async for line in f ]
+            return [first] + lines
+        with open( PATH_5LINES, 'rb' ) as f:
+            expected = f.read().splitlines( True )
+        expected = [expected[0][:4], expected[0][4:]] + expected[1:]
+        for read_ahead in (0, 3, 1024):
+            self.assertEqual( expected, self.run_async( main( read_ahead ) ) )
+
+    def test_write_after_read_ahead( self ):
+        with open( self.path, 'wb' ) as f:
+            f.write( b'0123456789' )
+        async def main():
+            async with await asyncfile.open_async( self.path, 'r+b', read_ahead=4 ) as f:
+                self.assertEqual( b'01', await f.read( 2 ) )
+                await f.write( b'ab' ) # at the position of the caller, not of the read ahead
+                self.assertEqual( b'4567', await f.read( 4 ) )
+                await f.writelines( [b'c', b'd'] )
+        self.run_async( main() )
+        with open( self.path, 'rb' ) as f:
+            self.assertEqual( b'01ab4567cd', f.read() )
+
+    def test_concurrent_writes_are_ordered( self ):
+        async def main():
+            async with await asyncfile.open_async( self.path, 'wb', max_outstanding=4,
+                                                   write_buffer_size=0 ) as f:
+                await asyncio.gather( *[ f.write( b'%03d\n' % index )
+                                         for index in range(100) ] )
+        self.run_async( main() )
+        with open( self.path, 'rb' ) as f:
+            self.assertEqual( [ b'%03d\n' % index for index in range(100) ], f.readlines() )
+
+    def test_event_loop_not_blocked( self ):
+        release = threading.Event()
+        class SlowRawFile(object):
+            closed = False
+            def read( self, n=-1 ):
+                release.wait( 5 )
+                return b'data'
+        async def main():
+            f = asyncfile.AsyncRawFile( SlowRawFile() )
+            read = asyncio.ensure_future( f.read( 4 ) )
+            await asyncio.sleep( 0.01 ) # the loop runs while the read is blocked
+            self.assertFalse( read.done() )
+            release.set()
+            return await read
+        self.assertEqual( b'data', self.run_async( main() ) )
+
+    def test_cancelled_read( self ):
+        release = threading.Event()
+        class SlowRawFile(object):
+            closed = False
+            position = 0
+            def read( self, n=-1 ):
+                release.wait( 5 )
+                data = b'ab\ncd\n'[self.position:][:n]
+                self.position += len(data)
+                return data
+        async def main():
+            f = asyncfile.AsyncRawFile( SlowRawFile(), read_ahead=4 )
+            with self.assertRaises( asyncio.TimeoutError ):
+                await asyncio.wait_for( f.readline(), 0.01 )
+            release.set()
+            # The data of the read in progress when readline() was cancelled are kept
+            return [ line async for line in f ]
+        self.assertEqual( [b'ab\n', b'cd\n'], self.run_async( main() ) )
+
+    def test_errors( self ):
+        async def main():
+            f = await asyncfile.open_async( PATH_256, 'rb' )
+            await f.close()
+            self.assertTrue( f.closed )
+            with self.assertRaises( ValueError ):
+                await f.read( 1 )
+        self.run_async( main() )
+        self.assertRaises( ValueError, asyncfile.AsyncRawFile, None, max_outstanding=0 )
+
+
+if __name__ == '__main__':
+    unittest.main()
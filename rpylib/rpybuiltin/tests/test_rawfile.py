@@ -1,6 +1,11 @@
+import gc
 import unittest
 import os.path
 import os
+import sys
+import tempfile
+import types
+from rpybuiltin import builtin
 from rpybuiltin.builtin import open
 
 TEST_DATA_DIR = os.path.join( os.path.dirname(os.path.abspath(__file__)), 'test_data' )
@@ -130,3 +135,327 @@ class TestReadOnlyRawFile(unittest.TestCase):
             self.assertEqual( EXPECTED_5LINES[2], f.readline() )
             self.assertEqual( EXPECTED_5LINES[3], f.readline() )
             self.assertEqual( b'', f.readline() )
+
+    def test_readline_then_read( self ):
+        with open( PATH_5LINES, 'rb' ) as f:
+            self.assertEqual( EXPECTED_5LINES[0], f.readline() )
+            self.assertEqual( len(EXPECTED_5LINES[0]), f.tell() )
+            self.assertEqual( b''.join( EXPECTED_5LINES[1:] ), f.read() )
+            f.seek( 0 )
+            self.assertEqual( EXPECTED_5LINES[0][:4], f.readline( 4 ) )
+            self.assertEqual( EXPECTED_5LINES[0][4:], f.readline() )
+            self.assertEqual( EXPECTED_5LINES[1:3], f.readlines( 1 + len(EXPECTED_5LINES[1]) ) )
+
+    def test_iteration( self ):
+        with open( PATH_5LINES, 'rb' ) as f:
+            self.assertEqual( EXPECTED_5LINES, list(f) )
+
+    def test_file_iteration( self ):
+        with builtin.File( PATH_5LINES, 'rb' ) as f:
+            self.assertEqual( EXPECTED_5LINES[0], f.next() )
+            self.assertEqual( EXPECTED_5LINES[1:], list(f) )
+            f.seek( 0 )
+            self.assertEqual( EXPECTED_5LINES[0], f.readline() )
+            self.assertEqual( EXPECTED_5LINES[1:], f.readlines() )
+
+    def test_iter_line_views( self ):
+        with open( PATH_5LINES, 'rb' ) as f:
+            lines = []
+            for line in f.iter_lines( views=True ):
+                self.assertTrue( isinstance( line, memoryview ) )
+                lines.append( bytes( line ) )
+            self.assertEqual( EXPECTED_5LINES, lines )
+
+    def test_iter_records( self ):
+        with open( PATH_256, 'rb' ) as f:
+            records = [ bytes( record ) for record in f.iter_records( 100 ) ]
+        expected = bytes( x for x in range(0,256) )
+        self.assertEqual( [expected[:100], expected[100:200], expected[200:]], records )
+
+
+
+class CountingRawFile(object):
+    """Counts the reads of a BufferedReader."""
+    def __init__( self, data ):
+        self.data = data
+        self.position = 0
+        self.read_count = 0
+
+    def _read_raw_into( self, view ):
+        self.read_count += 1
+        chunk = self.data[self.position:self.position + len(view)]
+        view[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+class TestBufferedReader(unittest.TestCase):
+    def test_one_read_per_buffer( self ):
+        raw = CountingRawFile( b'ab\n' * 100 )
+        reader = builtin.BufferedReader( raw, buffer_size=30 )
+        self.assertEqual( [b'ab\n'] * 100, list(reader) )
+        self.assertEqual( 11, raw.read_count ) # 10 full buffers, then EOF
+
+    def test_bounded_buffer( self ):
+        raw = CountingRawFile( b''.join( b'line %d\n' % index for index in range(10000) ) )
+        reader = builtin.BufferedReader( raw, buffer_size=64 )
+        self.assertEqual( 10000, sum( 1 for line in reader ) )
+        self.assertEqual( 64, len(reader._buffer) )
+
+    def test_record_larger_than_buffer( self ):
+        reader = builtin.BufferedReader( CountingRawFile( b'0123456789' ), buffer_size=4 )
+        self.assertEqual( b'012345', reader.read_view( 6 ) )
+        self.assertEqual( b'6789', reader.read_view( 6 ) )
+        self.assertEqual( b'', reader.read_view( 6 ) )
+
+    def test_long_line( self ):
+        data = b'x' * 100 + b'\nend'
+        reader = builtin.BufferedReader( CountingRawFile( data ), buffer_size=16 )
+        self.assertEqual( data[:101], reader.readline() )
+        self.assertEqual( b'end', reader.readline() )
+        self.assertEqual( b'', reader.readline() )
+        self.assertEqual( 0, reader.get_buffered_size() )
+
+
+class CountingWriter(object):
+    """Records the vectored writes of a WriteBuffer."""
+    def __init__( self ):
+        self.writes = []
+
+    def _write_raw_vectored( self, chunks ):
+        self.writes.append( [ bytes( chunk ) for chunk in chunks ] )
+
+class TestWriteBuffer(unittest.TestCase):
+    def test_coalesce_small_writes( self ):
+        raw = CountingWriter()
+        buffer = builtin.WriteBuffer( raw, buffer_size=10 )
+        for index in range(7):
+            buffer.write( b'abc' )
+        self.assertEqual( [[b'abc'] * 4], raw.writes )
+        self.assertEqual( 9, buffer.get_pending_size() )
+        buffer.flush()
+        self.assertEqual( [b'abc'] * 3, raw.writes[1] )
+        self.assertEqual( 0, buffer.get_pending_size() )
+
+    def test_large_write_gathered( self ):
+        raw = CountingWriter()
+        buffer = builtin.WriteBuffer( raw, buffer_size=10 )
+        buffer.write( b'head' )
+        large = bytearray( b'x' * 20 )
+        buffer.write( large )
+        self.assertEqual( [[b'head', bytes( large )]], raw.writes )
+
+    def test_copy_mutable_data( self ):
+        raw = CountingWriter()
+        buffer = builtin.WriteBuffer( raw, buffer_size=10 )
+        data = bytearray( b'abc' )
+        buffer.write( data )
+        data[0] = ord( 'X' )
+        buffer.flush()
+        self.assertEqual( [[b'abc']], raw.writes )
+
+    def test_line_buffering( self ):
+        raw = CountingWriter()
+        buffer = builtin.WriteBuffer( raw, buffer_size=100, line_buffering=True )
+        buffer.write( b'partial' )
+        self.assertEqual( [], raw.writes )
+        buffer.writelines( [b' line\n', b'next'] )
+        self.assertEqual( [[b'partial', b' line\n', b'next']], raw.writes )
+
+
+
+@unittest.skipIf( sys.platform == 'win32', 'POSIX only' )
+class TestPosixRawFile(unittest.TestCase):
+    def setUp( self ):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join( self.temp_dir, 'data' )
+
+    def tearDown( self ):
+        if os.path.exists( self.path ):
+            os.unlink( self.path )
+        os.rmdir( self.temp_dir )
+
+    def test_write_read( self ):
+        with open( self.path, 'wb' ) as f:
+            self.assertEqual( 5, f.write( b'hello' ) )
+            f.seek( 1 )
+            f.write( b'E' )
+            self.assertEqual( 2, f.tell() )
+        with open( self.path, 'rb' ) as f:
+            self.assertEqual( b'hEllo', f.read() )
+        with open( self.path, 'ab' ) as f:
+            f.write( b' world' )
+            self.assertEqual( 11, f.tell() )
+        with open( self.path, 'r+b' ) as f:
+            f.truncate( 4 )
+            self.assertEqual( 4, f.tell() )
+            f.seek( 0 )
+            self.assertEqual( b'hEll', f.read() )
+
+    def test_append_position( self ):
+        with open( self.path, 'wb' ) as f:
+            f.write( b'hello\n' )
+        with builtin.RawFile( self.path, 'ab' ) as f:
+            self.assertEqual( 6, f.tell() )
+            f.write( b'world' )
+            self.assertEqual( 11, f.tell() )
+        with builtin.RawFile( self.path, 'a+b' ) as f:
+            self.assertEqual( 11, f.tell() )
+            self.assertEqual( b'', f.read() )
+            f.seek( 0 )
+            self.assertEqual( 0, f.tell() )
+            self.assertEqual( b'hello\nworld', f.read() )
+
+    def test_without_vectored_io( self ):
+        # preadv() and pwritev() require python 3.7, pread() and pwrite() 3.3
+        for missing in (('preadv', 'pwritev', 'writev'),
+                        ('preadv', 'pwritev', 'writev', 'pread', 'pwrite')):
+            old_os = os
+            builtin.os = types.ModuleType( 'os' )
+            builtin.os.__dict__.update( (name, value) for name, value in vars(old_os).items()
+                                        if name not in missing )
+            try:
+                self.test_write_read()
+                with builtin.RawFile( self.path, 'wb', write_buffer_size=0 ) as f:
+                    f.writelines( [b'ab', b'', b'cd\n'] )
+                with open( self.path, 'rb' ) as f:
+                    self.assertEqual( [b'abcd\n'], list(f) )
+            finally:
+                builtin.os = old_os
+
+    def test_delete_on_close( self ):
+        f = builtin.RawFile( self.path, 'w+', delete_on_close=True )
+        f.write( b'data' )
+        f.seek( 0 )
+        self.assertEqual( b'data', f.read() )
+        f.close()
+        self.assertTrue( not os.path.exists( self.path ) )
+
+    def test_access_hint( self ):
+        with builtin.RawFile( PATH_256, 'rb', access=builtin.ACCESS_SEQUENTIAL ) as f:
+            f.advise( builtin.ACCESS_RANDOM, 0, 128 )
+            self.assertEqual( 256, len(f.read()) )
+
+    def test_direct( self ):
+        data = bytes( x % 251 for x in range(0, 3 * builtin.DIRECT_IO_ALIGNMENT) )
+        with open( self.path, 'wb' ) as f:
+            f.write( data )
+        try:
+            f = builtin.RawFile( self.path, 'rb', direct=True )
+        except (OSError, ValueError): # not supported by the platform or file system
+            self.skipTest( 'O_DIRECT not supported' )
+        with f:
+            self.assertEqual( data[:10], f.read( 10 ) )
+            offset = builtin.DIRECT_IO_ALIGNMENT - 5 # unaligned
+            f.seek( offset )
+            self.assertEqual( data[offset:offset + 5000], f.read( 5000 ) )
+            self.assertEqual( data[offset + 5000:], f.read() )
+        self.assertRaises( ValueError, builtin.RawFile, self.path, 'r+b', direct=True )
+
+    def test_invalid_mode( self ):
+        self.assertRaises( ValueError, builtin.RawFile, PATH_ZERO, 'x' )
+
+    def test_buffered_write( self ):
+        with builtin.RawFile( self.path, 'w+b', write_buffer_size=16 ) as f:
+            f.write( b'0123' )
+            f.write( bytearray( b'4567' ) )
+            self.assertEqual( 8, f.tell() )
+            self.assertEqual( 0, os.path.getsize( self.path ) ) # pending
+            f.seek( 0 )
+            self.assertEqual( b'01234567', f.read() )
+            f.write( b'89' )
+        with open( self.path, 'rb' ) as f:
+            self.assertEqual( b'0123456789', f.read() )
+
+    def test_readline_after_write( self ):
+        with builtin.RawFile( self.path, 'wb' ) as f:
+            f.write( b'AAAA\nBBBB\n' )
+        with builtin.RawFile( self.path, 'r+b' ) as f:
+            f.write( b'xy' )
+            self.assertEqual( b'AA\n', f.readline() )
+            self.assertEqual( [b'BBBB\n'], list( f.iter_lines() ) )
+        with open( self.path, 'rb' ) as f:
+            self.assertEqual( b'xyAA\nBBBB\n', f.read() )
+
+    def test_write_without_close( self ):
+        f = builtin.RawFile( self.path, 'wb' )
+        f.write( b'hello' )
+        del f
+        gc.collect()
+        with open( self.path, 'rb' ) as f:
+            self.assertEqual( b'hello', f.read() )
+
+    def test_writelines( self ):
+        lines = [ b'record %d\n' % index for index in range(2000) ] # more than IOV_MAX
+        for write_buffer_size in (0, 64, builtin.DEFAULT_BUFFER_SIZE):
+            with builtin.RawFile( self.path, 'wb', write_buffer_size=write_buffer_size ) as f:
+                f.writelines( lines )
+            with open( self.path, 'rb' ) as f:
+                self.assertEqual( lines, f.readlines() )
+
+    def test_append_buffered( self ):
+        with open( self.path, 'wb' ) as f:
+            f.write( b'head' )
+        with builtin.RawFile( self.path, 'ab', sync=builtin.SYNC_ON_WRITE ) as f:
+            f.write( b'+tail' )
+            self.assertEqual( 9, f.tell() )
+        with open( self.path, 'rb' ) as f:
+            self.assertEqual( b'head+tail', f.read() )
+
+    def test_readinto( self ):
+        with open( self.path, 'w+b' ) as f:
+            f.write( b'abcdef' )
+            f.seek( 1 )
+            buffer = bytearray( 4 )
+            self.assertEqual( 4, f.readinto( buffer ) )
+            self.assertEqual( b'bcde', buffer )
+            self.assertEqual( 1, f.readinto( buffer ) )
+            self.assertEqual( b'fcde', buffer )
+            self.assertEqual( 0, f.readinto( buffer ) )
+
+    def test_sync_policy( self ):
+        with builtin.RawFile( self.path, 'wb', sync=builtin.SYNC_NEVER ) as f:
+            f.write( b'data' )
+            f.flush()
+            self.assertEqual( 4, os.path.getsize( self.path ) )
+        self.assertRaises( ValueError, builtin.RawFile, self.path, 'wb', sync='sometimes' )
+
+
+@unittest.skipIf( sys.platform == 'win32', 'POSIX only' )
+class TestMappedRawFile(unittest.TestCase):
+    def test_read( self ):
+        with builtin.RawFile( PATH_256, 'rb', mapped=True ) as f:
+            expected = bytes( x for x in range(0,256) )
+            data = f.read( 7 )
+            self.assertTrue( isinstance( data, memoryview ) )
+            self.assertEqual( expected[:7], data )
+            self.assertEqual( expected[7:], f.readall() )
+            self.assertEqual( b'', f.read() )
+            f.seek( 250 )
+            self.assertEqual( expected[250:], f.read( 100 ) )
+
+    def test_lines( self ):
+        with builtin.RawFile( PATH_5LINES, 'rb', mapped=True,
+                              access=builtin.ACCESS_SEQUENTIAL ) as f:
+            self.assertEqual( EXPECTED_5LINES[0], f.readline() )
+            self.assertEqual( EXPECTED_5LINES[1][:3], f.readline( 3 ) )
+            self.assertEqual( EXPECTED_5LINES[1][3:], f.readline() )
+            f.advise( builtin.ACCESS_RANDOM, f.tell() )
+            lines = f.readlines()
+            self.assertTrue( all( isinstance( line, memoryview ) for line in lines ) )
+            self.assertEqual( EXPECTED_5LINES[2:], lines )
+            self.assertEqual( b'', f.readline() )
+
+    def test_empty( self ):
+        with builtin.RawFile( PATH_EMPTY, 'rb', mapped=True ) as f:
+            self.assertEqual( b'', f.readall() )
+            self.assertEqual( b'', f.readline() )
+
+    def test_close_with_views( self ):
+        f = builtin.RawFile( PATH_256, 'rb', mapped=True )
+        data = f.read( 2 )
+        f.close()
+        self.assertEqual( b'\0\1', data ) # still mapped
+        self.assertRaises( ValueError, f.read )
+
+    def test_read_only( self ):
+        self.assertRaises( ValueError, builtin.RawFile, PATH_ZERO, 'r+b', mapped=True )
@@ -1,7 +1,17 @@
+import ctypes
+import threading
+
 def entry_point( f ):
     f.rpy_entry_point = True
     return f
 
+def fast_math( f ):
+    """Allows the code generator to ignore python floating point semantic
+       details, such as the sign of the modulo, to generate faster code.
+    """
+    f.rpy_fast_math = True
+    return f
+
 class CallableGraphAnnotator(object):
     def __init__( self, type_registry ):
         self.to_annotate = set()
@@ -11,6 +21,7 @@ class CallableGraphAnnotator(object):
         self.type_registry = type_registry
         self.entry_point = None
         self.current_callable = None
+        self.escape_analysis = None # See analyze_escapes()
         type_registry.set_callable_listener( self._on_callable_reference )
 
     def set_entry_point( self, py_func, call_args ):
@@ -21,6 +32,20 @@ class CallableGraphAnnotator(object):
         r_arg_types = [ self.type_registry.from_python_object(arg,
                                                               func_location)
                         for arg in call_args ]
+        self._set_entry_point_rtypes( py_func, r_arg_types, func_location )
+
+    def set_entry_point_types( self, py_func, py_arg_types ):
+        """Sets the python function object used as entry point with the python
+           types of its parameters (e.g. int, bool or a class).
+        """
+        from rpy.typeinference import FunctionLocationHelper
+        func_location = FunctionLocationHelper(py_func.__code__).get_location(0)
+        r_arg_types = [ self.type_registry.from_python_type(py_arg_type,
+                                                            func_location)
+                        for py_arg_type in py_arg_types ]
+        self._set_entry_point_rtypes( py_func, r_arg_types, func_location )
+
+    def _set_entry_point_rtypes( self, py_func, r_arg_types, func_location ):
         callable_type = self.type_registry.from_python_object( py_func, func_location )
         for index, r_arg_type in enumerate(r_arg_types):
             callable_type.record_arg_type( index, r_arg_type )
@@ -53,6 +78,14 @@ class CallableGraphAnnotator(object):
             annotator.explore_function_opcodes()
             annotator.report()
     
+    def analyze_escapes( self ):
+        """Runs the escape analysis on the annotated call graph. The code
+           generator uses it to choose where instances are allocated.
+        """
+        from rpy.escapeanalysis import EscapeAnalysis
+        self.escape_analysis = EscapeAnalysis( self.annotator_by_func.keys() )
+        self.escape_analysis.run()
+
     def _on_callable_reference( self, callable_type ):
         print( '===> Callable added:', callable_type )
         if callable_type not in self.annotator_by_callable:
@@ -70,7 +103,15 @@ def optimize( module ):
     """Run LLVM optimization passes on the provided ModuleGenerator code.
     """
     from llvm.passes import (PassManager,
-                             PASS_PROMOTE_MEMORY_TO_REGISTER)
+                             PASS_PROMOTE_MEMORY_TO_REGISTER,
+                             PASS_FUNCTION_INLINING,
+                             PASS_SCALAR_REPL_AGGREGATES,
+                             PASS_INSTRUCTION_COMBINING,
+                             PASS_CFG_SIMPLIFICATION,
+                             PASS_LOOP_ROTATE,
+                             PASS_LICM,
+                             PASS_IND_VAR_SIMPLIFY,
+                             PASS_LOOP_UNROLL)
     from llvm.ee import TargetData
     pm = PassManager.new()
     # Add the target data as the first "pass". This is mandatory.
@@ -80,6 +121,19 @@ def optimize( module ):
     # This pass convert memory access to local variable (allocated via alloca)
     # to register and generates the corresponding phi-nodes.
     passes.append( PASS_PROMOTE_MEMORY_TO_REGISTER )
+    # Inlining constructors exposes the non-escaping instances allocated on
+    # the stack to the scalar replacement of aggregates: their attributes
+    # become registers.
+    passes.append( PASS_FUNCTION_INLINING )
+    passes.append( PASS_SCALAR_REPL_AGGREGATES )
+    # Counted loops (for ... in range()) are put in canonical form so that
+    # invariants are hoisted and loops with a constant trip count unrolled.
+    passes.append( PASS_INSTRUCTION_COMBINING )
+    passes.append( PASS_CFG_SIMPLIFICATION )
+    passes.append( PASS_LOOP_ROTATE )
+    passes.append( PASS_LICM )
+    passes.append( PASS_IND_VAR_SIMPLIFY )
+    passes.append( PASS_LOOP_UNROLL )
     #passes = [PASS_AGGRESSIVE_DCE, PASS_FUNCTION_INLINING]
     for l_pass in passes:
         pm.add( l_pass )
@@ -88,21 +142,56 @@ def optimize( module ):
     pm.run( module.l_module )
 
 
-def run( py_main_func, *call_args ):
+# LLVM is not thread-safe: only one function is compiled at a time. The
+# machine code is generated at compile time, calls of compiled functions do
+# not take this lock (see CompiledFunction).
+_compile_lock = threading.RLock()
+
+def get_signature( call_args ):
+    """Returns the entry point signature (a tuple of python types) matching
+       the specified call arguments.
+       array.array and ctypes arrays arguments are passed as native lists
+       (see rpy.nativelist), bytearray and memoryview as bytes (see
+       rpy.nativebytes).
+    """
+    import array
+    from rpy.nativelist import get_array_signature_type, get_ctypes_array_signature_type
+    def get_arg_type( arg ):
+        if isinstance( arg, array.array ):
+            return get_array_signature_type( arg )
+        if isinstance( arg, ctypes.Array ):
+            return get_ctypes_array_signature_type( arg )
+        if isinstance( arg, (bytearray, memoryview) ):
+            return bytes
+        return type(arg)
+    return tuple( get_arg_type( arg ) for arg in call_args )
+
+def compile( py_main_func, arg_types ):
+    """Compiles py_main_func and its call graph for the specified entry point
+       parameter types (a sequence of python types).
+       Returns a CompiledFunction that can be called with python values.
+    """
+    with _compile_lock:
+        return _compile( py_main_func, arg_types )
+
+def _compile( py_main_func, arg_types ):
     from rpy.rtypes import ConstantTypeRegistry
     registry = ConstantTypeRegistry()
     # Annotates call graph types (local var, functions param/return...)
     print( '\nAnalysing call graph...\n%s' % ('='*70) )
     annotator = CallableGraphAnnotator( registry )
-    annotator.set_entry_point( py_main_func, call_args )
+    annotator.set_entry_point_types( py_main_func, arg_types )
     annotator.annotate_dependencies()
+    annotator.analyze_escapes()
     # Generate LLVM code
-    from rpy.codegenerator import ModuleGenerator, FunctionCodeGenerator, L_INT_TYPE, L_BOOL_TYPE
+    from rpy.codegenerator import ModuleGenerator, FunctionCodeGenerator
     module = ModuleGenerator( registry )
     l_func_entry, l_func_type = None, None
     # Declares all function in modules
     fn_code_generators = []
     for r_func_type, type_annotator in annotator.annotator_by_callable.items():
+        if r_func_type.is_constructor() and not r_func_type.call_count:
+            continue # class only referenced, e.g. by rpy.soa()
         py_func = r_func_type.get_function_object()
         print( '\nDeclaring function:\n%s\nPython: %s\nRType: %s' % ('-'*70, py_func, r_func_type) )
         func_generator = FunctionCodeGenerator( py_func, module,
@@ -119,38 +208,191 @@ def run( py_main_func, *call_args ):
         func_generator.generate_llvm_code()
         func_generator.report()
         if r_func_type.get_function_object() is py_main_func:
-            l_func_entry = func_generator.l_func
-            l_func_type = func_generator.l_func_type
+            l_func_entry = module.add_entry_point_thunk( func_generator.l_func,
+                                                         r_func_type )
+            l_func_type = l_func_entry.type.pointee
     print( 'Generated module code:' )
     print( '----------------------\n%s', module.l_module )
     optimize( module )
     print( 'Generated module code after optimization:' )
     print( '-----------------------------------------\n', module.l_module )
-    
-    # Execute generate code
-    # 1) Convert call args into generic value
-    print( 'Invoking function with %r' % (call_args,) )
-    from llvm.core import ModuleProvider, TYPE_VOID
-    from llvm.ee import ExecutionEngine, GenericValue
+
+    from llvm.core import ModuleProvider
+    from llvm.ee import ExecutionEngine
     module_provider = ModuleProvider.new( module.l_module )
     engine = ExecutionEngine.new( module_provider )
-    l_call_args = []
-    for py_call_arg, l_arg in zip( call_args, l_func_entry.args ):
-        if l_arg.type == L_INT_TYPE:
-            l_call_args.append( GenericValue.int_signed( L_INT_TYPE, py_call_arg ) )
-        elif l_arg.type == L_BOOL_TYPE:
-            l_call_args.append( GenericValue.int( L_BOOL_TYPE, py_call_arg ) )
-        else:
-            raise ValueError( 'Unsupported parameter "%s" of type: %r' % (py_call_arg, l_arg_type) )
-    # 2) run the functions
-    l_return_value = engine.run_function( l_func_entry, l_call_args )
-    # 3) convert LLVM return value into python type
-    if l_func_type.return_type == L_INT_TYPE:
-        return l_return_value.as_int_signed()
-    elif l_func_type.return_type == L_BOOL_TYPE:
-        return l_return_value.as_int() and True or False
-    elif l_func_type.return_type.kind == TYPE_VOID:
-        return None
-    print( 'Return:',  l_return_value )
-    raise ValueError( 'Unsupported return type "%s"' % l_func_entry.return_type )
-    
\ No newline at end of file
+    # The JIT lazily generates the machine code of a function on its first
+    # call: generates all of it while holding _compile_lock.
+    for l_function in module.l_module.functions:
+        if not l_function.is_declaration:
+            engine.get_pointer_to_function( l_function )
+    return CompiledFunction( py_main_func, module, engine,
+                             l_func_entry, l_func_type )
+
+def _release_handles( handles, completed ):
+    """Releases all the handles of the parameters passed by address, even if
+       one of them raises: the others still copy back their values. The first
+       exception is raised once all the handles are released.
+    """
+    error = None
+    for handle in handles:
+        try:
+            handle.release( completed )
+        except Exception as e:
+            if error is None:
+                error = e
+    if error is not None:
+        raise error
+
+class CompiledFunction(object):
+    """Native code generated for an entry point.
+       Calling it converts the python arguments into LLVM generic values,
+       executes the native code and converts back the returned value.
+       The calls of a compiled function are serialized: the deoptimization
+       flag and the current arena are globals of its module. Different
+       compiled functions run concurrently.
+    """
+    def __init__( self, py_func, module, engine, l_func, l_func_type ):
+        self.py_func = py_func
+        self.module = module
+        self.engine = engine
+        self.l_func = l_func
+        self.l_func_type = l_func_type
+        self.deoptimization_count = 0 # number of calls re-executed by CPython
+        # Serializes the native calls of the module, reentrant for the
+        # DetachedChunks garbage collected during a call
+        self._call_lock = threading.RLock()
+
+    def __call__( self, *call_args ):
+        # 1) Convert call args into generic value
+        from llvm.core import TYPE_VOID
+        from llvm.ee import GenericValue
+        from rpy.codegenerator import L_INT_TYPE, L_BOOL_TYPE, L_DOUBLE_TYPE, INT_MIN, INT_MAX
+        from rpy.arena import get_thread_arena_slot
+        l_call_args = []
+        handles = [] # parameters passed by address, released after the call
+        try:
+            for py_call_arg, l_arg, boundary in zip( call_args, self.l_func.args,
+                                                     self.module.entry_arg_boundaries ):
+                if boundary is not None:
+                    handle = boundary.acquire( py_call_arg )
+                    handles.append( handle )
+                    l_call_args.append( GenericValue.int( L_INT_TYPE, handle.address ) )
+                elif l_arg.type == L_INT_TYPE:
+                    if not INT_MIN <= py_call_arg <= INT_MAX: # big int
+                        l_call_args = None
+                        break
+                    l_call_args.append( GenericValue.int_signed( L_INT_TYPE, py_call_arg ) )
+                elif l_arg.type == L_BOOL_TYPE:
+                    l_call_args.append( GenericValue.int( L_BOOL_TYPE, py_call_arg ) )
+                elif l_arg.type == L_DOUBLE_TYPE:
+                    l_call_args.append( GenericValue.real( L_DOUBLE_TYPE, float(py_call_arg) ) )
+                else:
+                    raise ValueError( 'Unsupported parameter "%s" of type: %r' % (py_call_arg, l_arg.type) )
+        except:
+            _release_handles( handles, False )
+            raise
+        if l_call_args is None: # big int argument
+            _release_handles( handles, False )
+            return self._deoptimized_call( call_args )
+        # 2) run the functions, their machine code was generated by compile()
+        l_arena_slot = [GenericValue.int( L_INT_TYPE, get_thread_arena_slot() )]
+        with self._call_lock:
+            self.engine.run_function( self.module.l_reset_deoptimized, [] )
+            self.engine.run_function( self.module.arena.l_select, l_arena_slot )
+            l_return_value = self.engine.run_function( self.l_func, l_call_args )
+            l_deoptimized = self.engine.run_function( self.module.l_get_deoptimized, [] )
+            return_view = self.module.entry_return_view
+            return_converter = self.module.entry_return_converter
+            returns_address = return_view is not None or return_converter is not None
+            py_return_value, arena_detached = None, False
+            try:
+                _release_handles( handles, not l_deoptimized.as_int() )
+                if not l_deoptimized.as_int() and returns_address:
+                    py_return_value, arena_detached = self._convert_returned_address(
+                        l_return_value.as_int(), handles, l_arena_slot )
+            finally:
+                # Instances allocated by the call can not outlive it
+                if not arena_detached:
+                    self.engine.run_function( self.module.arena.l_release, l_arena_slot )
+        if l_deoptimized.as_int():
+            return self._deoptimized_call( call_args )
+        if returns_address:
+            return py_return_value
+        # 3) convert LLVM return value into python type
+        l_return_type = self.l_func_type.return_type
+        if l_return_type == L_INT_TYPE:
+            return l_return_value.as_int_signed()
+        elif l_return_type == L_BOOL_TYPE:
+            return l_return_value.as_int() and True or False
+        elif l_return_type == L_DOUBLE_TYPE:
+            return l_return_value.as_real( L_DOUBLE_TYPE )
+        elif l_return_type.kind == TYPE_VOID:
+            return None
+        print( 'Return:',  l_return_value )
+        raise ValueError( 'Unsupported return type "%s"' % l_return_type )
+
+    def _convert_returned_address( self, address, handles, l_arena_slot ):
+        """Converts a returned list, dict or instance. Lists and instances are
+           returned as views on the native memory: the chunks of the arena are
+           detached and freed once the view is garbage collected. Dicts are
+           copied before the arena is released.
+           Returns a tuple (py_value, arena_detached).
+           Notes: must be called before the arena is released.
+        """
+        for handle in handles:
+            if handle.address == address: # parameter returned
+                return handle.get_returned_value(), False
+        if self.module.entry_return_converter is not None:
+            return self.module.entry_return_converter( address ), False
+        from rpy.arena import DetachedChunks
+        l_chunks_address = self.engine.run_function( self.module.arena.l_detach,
+                                                     l_arena_slot )
+        owner = DetachedChunks( self.engine, self.module.arena,
+                                l_chunks_address.as_int(), self._call_lock )
+        return self.module.entry_return_view( address, owner ), True
+
+    def get_allocation_statistics( self ):
+        """Returns the rpy.arena.ArenaStatistics of the arena used by the
+           calling thread for the instances allocated by this function.
+        """
+        from llvm.ee import GenericValue
+        from rpy.codegenerator import L_INT_TYPE, L_INDEX_TYPE
+        from rpy.arena import ArenaStatistics, STAT_COUNT, get_thread_arena_slot
+        l_arena_slot = GenericValue.int( L_INT_TYPE, get_thread_arena_slot() )
+        stats = []
+        with self._call_lock:
+            for stat_index in range(0, STAT_COUNT):
+                l_stat = self.engine.run_function( self.module.arena.l_get_stat,
+                    [l_arena_slot, GenericValue.int( L_INDEX_TYPE, stat_index )] )
+                stats.append( l_stat.as_int() )
+        return ArenaStatistics( *stats )
+
+    def _deoptimized_call( self, call_args ):
+        """Re-executes the call with CPython. Used when the native code bailed
+           out, for example because the result would not fit in a native int.
+           Notes: the native code must not have side effects visible from python
+           before bailing out.
+        """
+        from rpy.nativebytes import BytesArgument
+        py_call_args = []
+        for py_call_arg, boundary in zip( call_args, self.module.entry_arg_boundaries ):
+            if isinstance( boundary, BytesArgument ):
+                py_call_arg = boundary.to_python( py_call_arg )
+            py_call_args.append( py_call_arg )
+        self.deoptimization_count += 1
+        return self.py_func( *py_call_args )
+
+def run( py_main_func, *call_args ):
+    """Compiles py_main_func for the type of call_args and executes it.
+    """
+    compiled_func = compile( py_main_func, get_signature( call_args ) )
+    return compiled_func( *call_args )
+
+from rpy.asynccompiler import compile_async, compile_awaitable
+from rpy.tiered import jit, TieredFunction
+from rpy.typeprofile import TypeProfiler, load_manifest, precompile_manifest
+from rpy.structlayout import LAYOUT_PACKED, LAYOUT_HOT_FIRST, LAYOUT_DECLARED
+from rpy.structofarrays import soa
+from rpy.streaming import stream
+from rpy.foreign import foreign
@@ -0,0 +1,323 @@
+"""Region (arena) allocator used by the native code for escaping instances.
+
+Instances that escape the function creating them (see rpy.escapeanalysis)
+are bump-allocated in an arena. The arena is released in bulk when the
+entry point call returns: individual instances are never freed.
+
+The allocator is emitted as LLVM IR in each compiled module:
+- rpy_arenas: a table of MAX_ARENAS arena states. Each python thread calling
+  compiled functions owns a slot of the table (see get_thread_arena_slot()),
+  so that the memory chunks of an arena are reused by the next call of the
+  same thread.
+- rpy_current_arena: pointer to the arena of the calling thread, set by
+  rpy_arena_select() before running the entry point.
+- rpy_arena_refill(): slow path of the allocation, mallocs a new chunk.
+- rpy_arena_release(): frees all the chunks of an arena.
+- rpy_arena_detach(): unlinks the chunks of an arena without freeing them.
+  Used when the entry point returns a view on native memory (see
+  DetachedChunks): the chunks are freed by rpy_arena_free_chunks() once the
+  view is garbage collected.
+- rpy_arena_get_stat(): reads the allocation statistics of an arena.
+The allocation fast path is inlined by the code generator, see
+ArenaRuntime.emit_allocation().
+"""
+import collections
+import threading
+import llvm.core as lcore
+
+# Default size of the memory chunks allocated by an arena
+ARENA_CHUNK_SIZE = 64 * 1024
+# Allocations are rounded up to a multiple of this size
+ARENA_ALIGNMENT = 8
+# Number of arena slots per compiled module
+MAX_ARENAS = 64
+# Slot shared by the threads started when all other slots are in use.
+# Notes: native calls are serialized, so sharing an arena is safe.
+SHARED_ARENA_SLOT = 0
+
+VAR_ARENAS = 'rpy_arenas'
+VAR_CURRENT_ARENA = 'rpy_current_arena'
+FN_ARENA_SELECT = 'rpy_arena_select'
+FN_ARENA_REFILL = 'rpy_arena_refill'
+FN_ARENA_RELEASE = 'rpy_arena_release'
+FN_ARENA_DETACH = 'rpy_arena_detach'
+FN_ARENA_FREE_CHUNKS = 'rpy_arena_free_chunks'
+FN_ARENA_GET_STAT = 'rpy_arena_get_stat'
+
+# Fields of the arena structure
+FIELD_CURRENT = 0 # i8*, next free byte of the current chunk
+FIELD_END = 1 # i8*, end of the current chunk
+FIELD_CHUNKS = 2 # i8*, last allocated chunk. Chunks start with a pointer to the previous one.
+FIELD_STATS = 3 # [STAT_COUNT x i64]
+
+# Allocation statistics, indexes in the FIELD_STATS array
+STAT_ALLOCATION_COUNT = 0 # number of allocations
+STAT_ALLOCATED_BYTES = 1 # number of bytes allocated
+STAT_CHUNK_COUNT = 2 # number of chunks currently allocated
+STAT_RELEASE_COUNT = 3 # number of bulk releases
+STAT_COUNT = 4
+
+ArenaStatistics = collections.namedtuple( 'ArenaStatistics',
+    'allocation_count allocated_bytes chunk_count release_count' )
+
+L_BYTE_PTR_TYPE = lcore.Type.pointer( lcore.Type.int(8) )
+L_BYTE_PTR_PTR_TYPE = lcore.Type.pointer( L_BYTE_PTR_TYPE )
+L_SIZE_TYPE = lcore.Type.int(64)
+L_FIELD_INDEX_TYPE = lcore.Type.int(32)
+L_ARENA_TYPE = lcore.Type.struct( [L_BYTE_PTR_TYPE, L_BYTE_PTR_TYPE, L_BYTE_PTR_TYPE,
+                                   lcore.Type.array( L_SIZE_TYPE, STAT_COUNT )] )
+L_ARENA_PTR_TYPE = lcore.Type.pointer( L_ARENA_TYPE )
+
+def _field_index( index ):
+    return lcore.Constant.int( L_FIELD_INDEX_TYPE, index )
+
+def _size( size ):
+    return lcore.Constant.int( L_SIZE_TYPE, size )
+
+L_FIELD_0 = _field_index( 0 )
+L_CHUNK_HEADER_SIZE = _size( ARENA_ALIGNMENT ) # pointer to previous chunk, padded
+L_NULL_BYTE_PTR = lcore.Constant.null( L_BYTE_PTR_TYPE )
+
+class ArenaRuntime(object):
+    """Declares the arena allocator in a LLVM module.
+    """
+    def __init__( self, l_module ):
+        self.l_module = l_module
+        l_module.add_type_name( 'rpy_arena', L_ARENA_TYPE )
+        l_arenas_type = lcore.Type.array( L_ARENA_TYPE, MAX_ARENAS )
+        self.l_arenas = l_module.add_global_variable( l_arenas_type, VAR_ARENAS )
+        self.l_arenas.initializer = lcore.Constant.null( l_arenas_type )
+        self.l_current_arena = l_module.add_global_variable( L_ARENA_PTR_TYPE,
+                                                             VAR_CURRENT_ARENA )
+        self.l_current_arena.initializer = lcore.Constant.null( L_ARENA_PTR_TYPE )
+        self.l_malloc = l_module.get_or_insert_function(
+            lcore.Type.function( L_BYTE_PTR_TYPE, [L_SIZE_TYPE] ), 'malloc' )
+        self.l_free = l_module.get_or_insert_function(
+            lcore.Type.function( lcore.Type.void(), [L_BYTE_PTR_TYPE] ), 'free' )
+        self.l_select = self._declare_select()
+        self.l_refill = self._declare_refill()
+        self.l_free_chunks = self._declare_free_chunks()
+        self.l_release = self._declare_release()
+        self.l_detach = self._declare_detach()
+        self.l_get_stat = self._declare_get_stat()
+
+    def _get_slot_arena( self, builder, l_slot ):
+        return builder.gep( self.l_arenas, [_size(0), l_slot] )
+
+    def _get_stat_ptr( self, builder, l_arena, l_stat_index ):
+        return builder.gep( l_arena, [L_FIELD_0, _field_index(FIELD_STATS),
+                                      l_stat_index] )
+
+    def _increment_stat( self, builder, l_arena, stat_index, l_increment ):
+        l_stat_ptr = self._get_stat_ptr( builder, l_arena,
+                                         _field_index( stat_index ) )
+        builder.store( builder.add( builder.load( l_stat_ptr ), l_increment ),
+                       l_stat_ptr )
+
+    def _declare_select( self ):
+        """void rpy_arena_select( i64 slot ): sets the current arena."""
+        l_func = self.l_module.add_function(
+            lcore.Type.function( lcore.Type.void(), [L_SIZE_TYPE] ), FN_ARENA_SELECT )
+        builder = lcore.Builder.new( l_func.append_basic_block( 'entry' ) )
+        builder.store( self._get_slot_arena( builder, l_func.args[0] ),
+                       self.l_current_arena )
+        builder.ret_void()
+        return l_func
+
+    def _declare_refill( self ):
+        """i8* rpy_arena_refill( rpy_arena*, i64 size ): allocates a new chunk
+           large enough for size bytes and returns the first size bytes.
+        """
+        l_func = self.l_module.add_function(
+            lcore.Type.function( L_BYTE_PTR_TYPE, [L_ARENA_PTR_TYPE, L_SIZE_TYPE] ),
+            FN_ARENA_REFILL )
+        l_arena, l_size = l_func.args
+        builder = lcore.Builder.new( l_func.append_basic_block( 'entry' ) )
+        l_min_chunk_size = builder.add( l_size, L_CHUNK_HEADER_SIZE )
+        l_is_large = builder.icmp( lcore.IPRED_UGT, l_min_chunk_size,
+                                   _size( ARENA_CHUNK_SIZE ) )
+        l_chunk_size = builder.select( l_is_large, l_min_chunk_size,
+                                       _size( ARENA_CHUNK_SIZE ) )
+        l_chunk = builder.call( self.l_malloc, [l_chunk_size] )
+        # Links the chunk to the list of chunks of the arena
+        l_chunks_ptr = builder.gep( l_arena, [L_FIELD_0, _field_index(FIELD_CHUNKS)] )
+        builder.store( builder.load( l_chunks_ptr ),
+                       builder.bitcast( l_chunk, L_BYTE_PTR_PTR_TYPE ) )
+        builder.store( l_chunk, l_chunks_ptr )
+        l_data = builder.gep( l_chunk, [L_CHUNK_HEADER_SIZE] )
+        builder.store( builder.gep( l_data, [l_size] ),
+                       builder.gep( l_arena, [L_FIELD_0, _field_index(FIELD_CURRENT)] ) )
+        builder.store( builder.gep( l_chunk, [l_chunk_size] ),
+                       builder.gep( l_arena, [L_FIELD_0, _field_index(FIELD_END)] ) )
+        self._increment_stat( builder, l_arena, STAT_CHUNK_COUNT, _size(1) )
+        builder.ret( l_data )
+        return l_func
+
+    def _declare_free_chunks( self ):
+        """void rpy_arena_free_chunks( i64 chunk ): frees chunk (an address)
+           and all the chunks it is linked to.
+        """
+        l_func = self.l_module.add_function(
+            lcore.Type.function( lcore.Type.void(), [L_SIZE_TYPE] ), FN_ARENA_FREE_CHUNKS )
+        l_entry_block = l_func.append_basic_block( 'entry' )
+        l_loop_block = l_func.append_basic_block( 'free_chunk' )
+        l_next_block = l_func.append_basic_block( 'next_chunk' )
+        l_done_block = l_func.append_basic_block( 'done' )
+        builder = lcore.Builder.new( l_entry_block )
+        l_first_chunk = builder.inttoptr( l_func.args[0], L_BYTE_PTR_TYPE )
+        builder.branch( l_loop_block )
+        builder.position_at_end( l_loop_block )
+        l_chunk = builder.phi( L_BYTE_PTR_TYPE )
+        l_chunk.add_incoming( l_first_chunk, l_entry_block )
+        l_is_null = builder.icmp( lcore.IPRED_EQ, l_chunk, L_NULL_BYTE_PTR )
+        builder.cbranch( l_is_null, l_done_block, l_next_block )
+        builder.position_at_end( l_next_block )
+        l_previous_chunk = builder.load( builder.bitcast( l_chunk, L_BYTE_PTR_PTR_TYPE ) )
+        builder.call( self.l_free, [l_chunk] )
+        l_chunk.add_incoming( l_previous_chunk, l_next_block )
+        builder.branch( l_loop_block )
+        builder.position_at_end( l_done_block )
+        builder.ret_void()
+        return l_func
+
+    def _emit_unlink_chunks( self, builder, l_arena ):
+        """Resets the arena to an empty state. Returns the address of its last
+           allocated chunk (an i64, 0 if none).
+        """
+        l_chunks_ptr = builder.gep( l_arena, [L_FIELD_0, _field_index(FIELD_CHUNKS)] )
+        l_chunks = builder.ptrtoint( builder.load( l_chunks_ptr ), L_SIZE_TYPE )
+        for field in (FIELD_CURRENT, FIELD_END, FIELD_CHUNKS):
+            builder.store( L_NULL_BYTE_PTR,
+                           builder.gep( l_arena, [L_FIELD_0, _field_index(field)] ) )
+        builder.store( _size(0), self._get_stat_ptr( builder, l_arena,
+                                                     _field_index( STAT_CHUNK_COUNT ) ) )
+        self._increment_stat( builder, l_arena, STAT_RELEASE_COUNT, _size(1) )
+        return l_chunks
+
+    def _declare_release( self ):
+        """void rpy_arena_release( i64 slot ): frees all the chunks of an
+           arena, and so all the instances allocated in it.
+        """
+        l_func = self.l_module.add_function(
+            lcore.Type.function( lcore.Type.void(), [L_SIZE_TYPE] ), FN_ARENA_RELEASE )
+        builder = lcore.Builder.new( l_func.append_basic_block( 'entry' ) )
+        l_arena = self._get_slot_arena( builder, l_func.args[0] )
+        builder.call( self.l_free_chunks, [self._emit_unlink_chunks( builder, l_arena )] )
+        builder.ret_void()
+        return l_func
+
+    def _declare_detach( self ):
+        """i64 rpy_arena_detach( i64 slot ): resets an arena without freeing
+           its chunks. Returns the address of the chunks (0 if none), to be
+           passed to rpy_arena_free_chunks().
+        """
+        l_func = self.l_module.add_function(
+            lcore.Type.function( L_SIZE_TYPE, [L_SIZE_TYPE] ), FN_ARENA_DETACH )
+        builder = lcore.Builder.new( l_func.append_basic_block( 'entry' ) )
+        l_arena = self._get_slot_arena( builder, l_func.args[0] )
+        builder.ret( self._emit_unlink_chunks( builder, l_arena ) )
+        return l_func
+
+    def _declare_get_stat( self ):
+        """i64 rpy_arena_get_stat( i64 slot, i32 stat_index )"""
+        l_func = self.l_module.add_function(
+            lcore.Type.function( L_SIZE_TYPE, [L_SIZE_TYPE, L_FIELD_INDEX_TYPE] ),
+            FN_ARENA_GET_STAT )
+        builder = lcore.Builder.new( l_func.append_basic_block( 'entry' ) )
+        l_arena = self._get_slot_arena( builder, l_func.args[0] )
+        builder.ret( builder.load( self._get_stat_ptr( builder, l_arena,
+                                                       l_func.args[1] ) ) )
+        return l_func
+
+    def emit_size_of( self, builder, l_type, l_count=None ):
+        """Returns the size of l_type (or of an array of l_count l_type)
+           rounded up to ARENA_ALIGNMENT as an i64.
+           Notes: computed with the getelementptr null trick, folded into a
+           constant if l_count is None.
+        """
+        l_null_ptr = lcore.Constant.null( lcore.Type.pointer( l_type ) )
+        if l_count is None:
+            l_count = _field_index(1)
+        l_size = builder.ptrtoint( builder.gep( l_null_ptr, [l_count] ),
+                                   L_SIZE_TYPE )
+        l_size = builder.add( l_size, _size( ARENA_ALIGNMENT - 1 ) )
+        return builder.and_( l_size, _size( -ARENA_ALIGNMENT ) )
+
+    def emit_allocation( self, builder, l_func, l_type, name, l_count=None ):
+        """Emits the inline bump allocation of an instance of l_type (or of an
+           array of l_count l_type) in the current arena. The allocation falls
+           back to rpy_arena_refill() when the current chunk is full.
+           Returns a tuple (l_ptr, l_block) where l_ptr is a pointer to
+           l_type and l_block the LLVM block code generation must continue in.
+        """
+        l_size = self.emit_size_of( builder, l_type, l_count )
+        l_arena = builder.load( self.l_current_arena )
+        l_current_ptr = builder.gep( l_arena, [L_FIELD_0, _field_index(FIELD_CURRENT)] )
+        l_current = builder.load( l_current_ptr )
+        l_new_current = builder.gep( l_current, [l_size] )
+        l_end = builder.load( builder.gep( l_arena, [L_FIELD_0, _field_index(FIELD_END)] ) )
+        l_fits = builder.icmp( lcore.IPRED_ULE,
+                               builder.ptrtoint( l_new_current, L_SIZE_TYPE ),
+                               builder.ptrtoint( l_end, L_SIZE_TYPE ) )
+        l_fast_block = l_func.append_basic_block( name + '.bump' )
+        l_slow_block = l_func.append_basic_block( name + '.refill' )
+        l_done_block = l_func.append_basic_block( name + '.allocated' )
+        builder.cbranch( l_fits, l_fast_block, l_slow_block )
+        builder.position_at_end( l_fast_block )
+        builder.store( l_new_current, l_current_ptr )
+        builder.branch( l_done_block )
+        builder.position_at_end( l_slow_block )
+        l_refilled = builder.call( self.l_refill, [l_arena, l_size] )
+        builder.branch( l_done_block )
+        builder.position_at_end( l_done_block )
+        l_memory = builder.phi( L_BYTE_PTR_TYPE )
+        l_memory.add_incoming( l_current, l_fast_block )
+        l_memory.add_incoming( l_refilled, l_slow_block )
+        self._increment_stat( builder, l_arena, STAT_ALLOCATION_COUNT, _size(1) )
+        self._increment_stat( builder, l_arena, STAT_ALLOCATED_BYTES, l_size )
+        return builder.bitcast( l_memory, lcore.Type.pointer( l_type ), name ), l_done_block
+
+class DetachedChunks(object):
+    """Owns the chunks detached from an arena by rpy_arena_detach(). The
+       views returned by an entry point reference this object: the chunks
+       are freed when the last view is garbage collected.
+    """
+    def __init__( self, engine, arena_runtime, chunks_address, lock ):
+        self._engine = engine
+        self._arena_runtime = arena_runtime
+        self._chunks_address = chunks_address
+        self._lock = lock # serializes the native calls, must be reentrant
+
+    def __del__( self ):
+        if self._chunks_address:
+            from llvm.ee import GenericValue
+            with self._lock:
+                self._engine.run_function( self._arena_runtime.l_free_chunks,
+                    [GenericValue.int( L_SIZE_TYPE, self._chunks_address )] )
+            self._chunks_address = 0
+
+class _ThreadArenaSlot(object):
+    """Arena slot owned by a thread. The slot is made available to other
+       threads when the thread ends (the thread local storage is released).
+    """
+    def __init__( self, slot ):
+        self.slot = slot
+
+    def __del__( self ):
+        if self.slot != SHARED_ARENA_SLOT:
+            with _slots_lock:
+                _free_slots.append( self.slot )
+
+_slots_lock = threading.Lock()
+_free_slots = list( range( MAX_ARENAS - 1, SHARED_ARENA_SLOT, -1 ) )
+_thread_arenas = threading.local()
+
+def get_thread_arena_slot():
+    """Returns the arena slot of the calling thread."""
+    thread_slot = getattr( _thread_arenas, 'slot', None )
+    if thread_slot is None:
+        with _slots_lock:
+            slot = _free_slots and _free_slots.pop() or SHARED_ARENA_SLOT
+        thread_slot = _ThreadArenaSlot( slot )
+        _thread_arenas.slot = thread_slot
+    return thread_slot.slot
@@ -0,0 +1,54 @@
+"""Asynchronous compilation of entry points.
+
+Compilations are executed by a background thread pool and are identified by
+the tuple (python function, signature). Requesting a compilation that is in
+progress, or already done, returns the same future.
+"""
+import concurrent.futures
+import threading
+
+_lock = threading.Lock()
+_executor = None
+_futures = {} # dict {(py_func, signature): concurrent.futures.Future}
+
+# Notes: compilations are serialized by rpy.compile() as LLVM is not
+# thread-safe, more workers would only wait on that lock.
+MAX_WORKERS = 1
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=MAX_WORKERS )
+    return _executor
+
+def compile_async( py_func, arg_types ):
+    """Schedules the compilation of py_func for the specified entry point
+       parameter types (a sequence of python types).
+       Returns a concurrent.futures.Future whose result is the CompiledFunction.
+    """
+    import rpy
+    signature = tuple( arg_types )
+    key = (py_func, signature)
+    with _lock:
+        future = _futures.get( key )
+        if future is None:
+            future = _get_executor().submit( rpy.compile, py_func, signature )
+            _futures[key] = future
+            future.add_done_callback(
+                lambda future: _on_compilation_done( key, future ) )
+    return future
+
+def _on_compilation_done( key, future ):
+    # Failed compilation are forgotten so that they can be requested again
+    if future.cancelled() or future.exception() is not None:
+        with _lock:
+            if _futures.get( key ) is future:
+                del _futures[key]
+
+def compile_awaitable( py_func, arg_types ):
+    """Same as compile_async() but returns an asyncio future, that must be
+       awaited from the running event loop.
+    """
+    import asyncio
+    return asyncio.wrap_future( compile_async( py_func, arg_types ) )
@@ -1,9 +1,27 @@
 from rpy.opcodedecoder import make_opcode_functions_map, opname, make_opcode_functions_map, opcode_decoder, determine_branch_targets
 from rpy.opcodedecoder import CMP_LT, CMP_LE, CMP_EQ, CMP_NE, CMP_GE, CMP_GT, CMP_IN, CMP_NOT_IN, CMP_IS, CMP_IS_NOT, CMP_EXCEPTION_MATCH
 import sys
+import builtins
+import functools
 import rpy.rtypes as rtypes
 import llvm.core as lcore
 from rpy.typeinference import FunctionLocationHelper
+from rpy.escapeanalysis import ALLOC_STACK
+from rpy.arena import ArenaRuntime
+import rpy.nativelist as nativelist
+import rpy.nativedict as nativedict
+import rpy.nativebytes as nativebytes
+import rpy.nativestruct as nativestruct
+import rpy.nativeio as nativeio
+from rpy.nativelist import LIST_FIELD_DATA, LIST_FIELD_LENGTH, LIST_FIELD_CAPACITY
+from rpy.nativebytes import (BytesRuntime, L_BYTES_TYPE, BYTES_FIELD_DATA,
+                             BYTES_FIELD_LENGTH)
+from rpy.nativeio import FileRuntime
+from rpy.nativedict import (DictRuntime, make_dict_type, get_field_ptr,
+                            DICT_FIELD_ENTRIES, DICT_FIELD_LENGTH, DICT_FIELD_CAPACITY,
+                            ENTRY_FIELD_STATE, ENTRY_FIELD_KEY, ENTRY_FIELD_VALUE,
+                            ENTRY_EMPTY)
+import rpy.structlayout as structlayout
 
 # Maps Python comparison to LLVM comparison predicate
 _PY_CMP_AS_LLVM = {
@@ -15,16 +33,79 @@ _PY_CMP_AS_LLVM = {
     CMP_GT: lcore.IPRED_SGT,
     }
 
+# Maps Python comparison to LLVM floating point comparison predicate.
+# Notes: NaN != NaN is True in python, hence the unordered predicate.
+_PY_CMP_AS_LLVM_REAL = {
+    CMP_LT: lcore.FPRED_OLT,
+    CMP_LE: lcore.FPRED_OLE,
+    CMP_EQ: lcore.FPRED_OEQ,
+    CMP_NE: lcore.FPRED_UNE,
+    CMP_GE: lcore.FPRED_OGE,
+    CMP_GT: lcore.FPRED_OGT,
+    }
+
 _FN_ALLOC = 'alloc'
+# Native code sets this global flag when it bails out (integer overflow,
+# division by zero...) and the call must be re-executed by CPython.
+VAR_DEOPTIMIZED = 'rpy_deoptimized'
+FN_GET_DEOPTIMIZED = 'rpy_get_deoptimized'
+FN_RESET_DEOPTIMIZED = 'rpy_reset_deoptimized'
 
 # rtype -> LLVM primitive types
-L_INT_TYPE = lcore.Type.int(32)
+L_INT_TYPE = lcore.Type.int(64)
 L_DOUBLE_TYPE = lcore.Type.double()
 L_BOOL_TYPE = lcore.Type.int(1)
 L_VOID_TYPE = lcore.Type.void()
+L_INDEX_TYPE = lcore.Type.int(32) # struct member index in getelementptr
+L_BYTE_TYPE = lcore.Type.int(8)
+L_BYTE_PTR_TYPE = lcore.Type.pointer( L_BYTE_TYPE )
+
+L_CONSTANT_0 = lcore.Constant.int( L_INDEX_TYPE, 0 )
+L_INT_0 = lcore.Constant.int( L_INT_TYPE, 0 )
+L_INT_1 = lcore.Constant.int( L_INT_TYPE, 1 )
+L_INT_2 = lcore.Constant.int( L_INT_TYPE, 2 )
+L_INT_MINUS_1 = lcore.Constant.int( L_INT_TYPE, -1 )
+L_INT_MIN = lcore.Constant.int( L_INT_TYPE, -2**63 )
+L_TRUE = lcore.Constant.int( L_BOOL_TYPE, 1 )
+L_FALSE = lcore.Constant.int( L_BOOL_TYPE, 0 )
+L_DOUBLE_0 = lcore.Constant.real( L_DOUBLE_TYPE, 0.0 )
+L_DOUBLE_HALF = lcore.Constant.real( L_DOUBLE_TYPE, 0.5 )
+L_DOUBLE_1 = lcore.Constant.real( L_DOUBLE_TYPE, 1.0 )
+L_DOUBLE_INF = lcore.Constant.real( L_DOUBLE_TYPE, float('inf') )
+L_DOUBLE_MINUS_INF = lcore.Constant.real( L_DOUBLE_TYPE, float('-inf') )
+L_DOUBLE_2_POW_63 = lcore.Constant.real( L_DOUBLE_TYPE, 2.0**63 )
+L_DOUBLE_MINUS_2_POW_63 = lcore.Constant.real( L_DOUBLE_TYPE, -2.0**63 )
+
+# Python type of the values at the entry point boundary: rtype
+_BOUNDARY_RTYPES = {
+    int: rtypes.IntType,
+    float: rtypes.FloatType,
+    bool: rtypes.BoolType,
+    str: rtypes.StringType,
+    bytes: rtypes.BytesType
+    }
 
-L_CONSTANT_0 = lcore.Constant.int( L_INT_TYPE, 0 )
+# Capacity of the list allocated for small literals and on first append
+LIST_MIN_CAPACITY = 4
+L_LIST_MIN_CAPACITY = lcore.Constant.int( L_INT_TYPE, LIST_MIN_CAPACITY )
 
+# Range of the python int that can be represented by L_INT_TYPE
+INT_MIN = -2**63
+INT_MAX = 2**63 - 1
+
+
+def is_instance_field( py_class, name ):
+    """Returns True if the attribute name of the instances of py_class is
+       stored in the instance: it is not a method or a descriptor (property,
+       staticmethod...) of the class. A class attribute holding a value (e.g.
+       a default) is shadowed by the instance attribute.
+    """
+    for py_base_class in py_class.__mro__:
+        if name in py_base_class.__dict__:
+            py_class_attribute = py_base_class.__dict__[name]
+            return not (callable( py_class_attribute ) or
+                        hasattr( type(py_class_attribute), '__get__' ))
+    return True
 
 class LLVMTypeProvider(object):
     """Converts a rtype into an llvm type.
@@ -36,16 +117,28 @@ class LLVMTypeProvider(object):
             rtypes.IntType: lambda rtype: (L_INT_TYPE, None),
             rtypes.NoneType: lambda rtype: (lcore.Type.void(), None),
             rtypes.UnknownType: self._rtype_unknown_to_llvm,
+            rtypes.PromotedType: self._rtype_unknown_to_llvm,
             rtypes.CallableType: self._rtype_callable_to_llvm,
             rtypes.FunctionType: self._rtype_callable_to_llvm,
             rtypes.FloatType: lambda rtype: (L_DOUBLE_TYPE, None),
             rtypes.BoolType: lambda rtype: (L_BOOL_TYPE, 'bool'),
             rtypes.ClassType: self._rtype_class_to_llvm,
-            rtypes.InstanceType: self._rtype_instance_to_llvm
+            rtypes.InstanceType: self._rtype_instance_to_llvm,
+            rtypes.CStructType: self._rtype_cstruct_to_llvm,
+            rtypes.ListType: self._rtype_list_to_llvm,
+            rtypes.DictType: self._rtype_dict_to_llvm,
+            rtypes.StringType: lambda rtype: (L_BYTES_TYPE, 'bytes'),
+            rtypes.BytesType: lambda rtype: (L_BYTES_TYPE, 'bytes'),
+            rtypes.SoAType: self._rtype_soa_to_llvm,
+            rtypes.SoAItemType: self._rtype_soa_item_to_llvm,
+            rtypes.NativeInstanceType: lambda rtype: (nativeio.L_FILE_PTR_TYPE, None)
             }
         self._l_type_by_rtype = {} # dict{ r_type : l_type }
         self._l_type_by_rtype_callable = {} # dict{ r_type_callable : l_type }
         self._r_class_attributes = {} # dict { r_type_class: dict { attribute_name : l_constant_index } }
+        self._r_class_fields = {} # dict { r_type_class: list [ (attribute_name, l_type) ] }
+        self._target_data = None # Created on first use by _get_target_data()
+        self._soa_columns = {} # dict { r_type_soa: dict { attribute_name : l_constant_index } }
 
     def from_rtype( self, rtype ):
         """Returns the LLVM type corresponding to rtype.
@@ -89,6 +182,30 @@ class LLVMTypeProvider(object):
         l_attribute_indexes_by_name = self._r_class_attributes[r_type_class]
         return l_attribute_indexes_by_name[attribute_name]
 
+    def get_class_fields( self, r_type ):
+        """Returns the list of (attribute_name, l_type) of the LLVM structure
+        of r_type (an instance or a class), in order.
+        """
+        r_type_class = r_type.get_resolved_type( self.type_registry )
+        if isinstance( r_type_class, rtypes.InstanceType ):
+            r_type_class = r_type_class.class_type
+        self.from_rtype( r_type_class )
+        return self._r_class_fields[r_type_class]
+
+    def get_soa_column_index( self, r_type_soa, attribute_name ):
+        """Returns a integer constant corresponding to the index of the field
+        of the column of attribute 'attribute_name' in the SoA header struct.
+        """
+        self.from_rtype( r_type_soa )
+        return self._soa_columns[r_type_soa][attribute_name]
+
+    def get_soa_columns( self, r_type_soa ):
+        """Returns a dict { attribute_name : l_constant_index } of the columns
+           of the SoA header struct.
+        """
+        self.from_rtype( r_type_soa )
+        return self._soa_columns[r_type_soa]
+
     def _declare_named_l_type( self, l_type, name ):
         """Declares a type alias for l_type in the module with the specified
            name prefixed by 'rtype_'.
@@ -96,21 +213,95 @@ class LLVMTypeProvider(object):
         if name:
             self.l_module.add_type_name( 'rtype_' + name, l_type )
 
+    def _get_target_data( self ):
+        if self._target_data is None:
+            from llvm.ee import TargetData
+            self._target_data = TargetData.new('')
+        return self._target_data
+
     def _rtype_class_to_llvm( self, rtype_class ):
         print( '#' * 80 )
-        l_attribute_types = []
         r_instance_type = rtype_class.instance_type
         r_instance_type.flush_pending_records( self.type_registry )
-        l_attribute_indexes_by_name = {}
+        py_class = rtype_class.py_class
+        target_data = self._get_target_data()
+        l_types_by_name = {}
+        fields = []
         for name, r_attribute_type in r_instance_type.attribute_types.items():
+            if not is_instance_field( py_class, name ): # method
+                continue
             print( 'Found attribute:', name, r_attribute_type )
             l_attribute_type = self.from_rtype( r_attribute_type )
-            l_attribute_indexes_by_name[name] = lcore.Constant.int( L_INT_TYPE, len(l_attribute_types) )
-            l_attribute_types.append( l_attribute_type )
+            l_types_by_name[name] = l_attribute_type
+            fields.append( structlayout.StructField(
+                name, target_data.abi_size( l_attribute_type ),
+                target_data.abi_alignment( l_attribute_type ),
+                r_instance_type.attribute_access_counts[name] ) )
+        fields = structlayout.order_fields( fields,
+                                            structlayout.get_class_layout( py_class ) )
+        l_attribute_types = []
+        l_attribute_indexes_by_name = {}
+        for field in fields:
+            l_attribute_indexes_by_name[field.name] = lcore.Constant.int( L_INDEX_TYPE, len(l_attribute_types) )
+            l_attribute_types.append( l_types_by_name[field.name] )
         l_struct_type = lcore.Type.struct( l_attribute_types )
         self._r_class_attributes[rtype_class] = l_attribute_indexes_by_name
+        self._r_class_fields[rtype_class] = [ (field.name, l_types_by_name[field.name])
+                                              for field in fields ]
         return l_struct_type, rtype_class.get_qualified_type_name()
 
+    def _rtype_cstruct_to_llvm( self, rtype_cstruct ):
+        """A ctypes.Structure has the fields of its _fields_, in order. See
+        rpy.nativestruct.
+        """
+        fields = [ (name, nativestruct.llvm_type_from_ctype( ctype ))
+                   for name, ctype in rtype_cstruct.fields ]
+        self._r_class_attributes[rtype_cstruct] = dict(
+            (name, lcore.Constant.int( L_INDEX_TYPE, index ))
+            for index, (name, l_type) in enumerate( fields ) )
+        self._r_class_fields[rtype_cstruct] = fields
+        return (lcore.Type.struct( [ l_type for name, l_type in fields ] ),
+                rtype_cstruct.get_qualified_type_name())
+
+    def _rtype_list_to_llvm( self, rtype_list ):
+        """A list is a pointer to a header struct { T* data, i64 length, i64 capacity }.
+           See rpy.nativelist.
+        """
+        l_item_type = self.from_rtype( rtype_list.item_type )
+        l_header_type = lcore.Type.struct( [lcore.Type.pointer( l_item_type ),
+                                            L_INT_TYPE, L_INT_TYPE] )
+        return lcore.Type.pointer( l_header_type ), None
+
+    def _rtype_dict_to_llvm( self, rtype_dict ):
+        """A dict is a pointer to a hash table header, see rpy.nativedict."""
+        return make_dict_type( self.from_rtype( rtype_dict.key_type ),
+                               self.from_rtype( rtype_dict.value_type ) ), None
+
+    def _rtype_soa_to_llvm( self, rtype_soa ):
+        """A SoA is a pointer to a header struct { i64 length, T1* column1, ... }.
+        """
+        r_instance_type = rtype_soa.class_type.instance_type
+        r_instance_type.flush_pending_records( self.type_registry )
+        py_class = rtype_soa.class_type.py_class
+        l_field_types = [L_INT_TYPE]
+        l_column_indexes_by_name = {}
+        for name, r_attribute_type in r_instance_type.attribute_types.items():
+            if not is_instance_field( py_class, name ): # method
+                continue
+            l_attribute_type = self.from_rtype( r_attribute_type )
+            l_column_indexes_by_name[name] = lcore.Constant.int( L_INDEX_TYPE, len(l_field_types) )
+            l_field_types.append( lcore.Type.pointer( l_attribute_type ) )
+        self._soa_columns[rtype_soa] = l_column_indexes_by_name
+        l_header_type = lcore.Type.struct( l_field_types )
+        self._declare_named_l_type( l_header_type, 'soa_' + rtype_soa.class_type.get_qualified_type_name() )
+        return lcore.Type.pointer( l_header_type ), None
+
+    def _rtype_soa_item_to_llvm( self, rtype_soa_item ):
+        """A SoA item is a first class struct value { soa_header*, i64 index }.
+        """
+        l_soa_type = self.from_rtype( rtype_soa_item.soa_type )
+        return lcore.Type.struct( [l_soa_type, L_INT_TYPE] ), None
+
     def _rtype_instance_to_llvm( self, rtype_instance ):
         l_class_type = self.from_rtype( rtype_instance.class_type )
         return lcore.Type.pointer( l_class_type ), None
@@ -137,10 +328,75 @@ class LLVMTypeProvider(object):
 
 class ModuleGenerator(object):
     def __init__( self, type_registry ):
+        self.type_registry = type_registry
         self.l_module = lcore.Module.new('main_module')
         self._type_provider = LLVMTypeProvider( self.l_module, type_registry )
         self.l_functions = {} # dict { py_func: l_func }
+        self._l_intrinsics = {} # dict { (intrinsic_id, l_types): l_func }
         #self.l_sys_functions[_FN_ALLOC] = 
+        self._declare_deoptimization_flag()
+        self.arena = ArenaRuntime( self.l_module )
+        self.dict_runtime = DictRuntime( self.l_module, self.arena )
+        self.bytes_runtime = BytesRuntime( self.l_module )
+        self.file_runtime = FileRuntime( self.l_module )
+        self._l_bytes_constants = {} # dict { bytes: l_constant }
+        self._struct_ctypes = {} # dict { r_type_class: ctypes.Structure subclass }
+
+    def _declare_deoptimization_flag( self ):
+        """Declares the global flag set by native code when it bails out, and
+           the functions used to read and reset it from python.
+        """
+        self.l_deoptimized = self.l_module.add_global_variable( L_BOOL_TYPE,
+                                                                VAR_DEOPTIMIZED )
+        self.l_deoptimized.initializer = L_FALSE
+        l_func_type = lcore.Type.function( L_BOOL_TYPE, [] )
+        self.l_get_deoptimized = self.l_module.add_function( l_func_type,
+                                                             FN_GET_DEOPTIMIZED )
+        builder = lcore.Builder.new( self.l_get_deoptimized.append_basic_block('entry') )
+        builder.ret( builder.load( self.l_deoptimized ) )
+        l_func_type = lcore.Type.function( L_VOID_TYPE, [] )
+        self.l_reset_deoptimized = self.l_module.add_function( l_func_type,
+                                                               FN_RESET_DEOPTIMIZED )
+        builder = lcore.Builder.new( self.l_reset_deoptimized.append_basic_block('entry') )
+        builder.store( L_FALSE, self.l_deoptimized )
+        builder.ret_void()
+
+    def get_external_function( self, name, l_func_type ):
+        """Returns the declaration of a function implemented outside of the
+           module (e.g. in the C library). The JIT resolves the symbol in the
+           libraries loaded by the process.
+        """
+        return self.l_module.get_or_insert_function( l_func_type, name )
+
+    def get_intrinsic( self, intrinsic_id, l_types ):
+        """Returns the declaration of the LLVM intrinsic function overloaded
+           for the specified types.
+        """
+        key = (intrinsic_id, tuple(l_types))
+        l_function = self._l_intrinsics.get( key )
+        if l_function is None:
+            l_function = lcore.Function.intrinsic( self.l_module, intrinsic_id,
+                                                   list(l_types) )
+            self._l_intrinsics[key] = l_function
+        return l_function
+
+    def get_bytes_constant( self, py_bytes ):
+        """Returns a { i8* data, i64 length } constant. The data is stored in
+           a global constant shared by the equal bytes.
+        """
+        l_constant = self._l_bytes_constants.get( py_bytes )
+        if l_constant is None:
+            l_data_type = lcore.Type.array( L_BYTE_TYPE, len(py_bytes) )
+            l_data = self.l_module.add_global_variable(
+                l_data_type, 'rpy_bytes.%d' % len(self._l_bytes_constants) )
+            l_data.initializer = lcore.Constant.array( L_BYTE_TYPE,
+                [lcore.Constant.int( L_BYTE_TYPE, byte ) for byte in py_bytes] )
+            l_data.global_constant = True
+            l_constant = lcore.Constant.struct( [
+                l_data.gep( [L_CONSTANT_0, L_CONSTANT_0] ),
+                lcore.Constant.int( L_INT_TYPE, len(py_bytes) )] )
+            self._l_bytes_constants[py_bytes] = l_constant
+        return l_constant
 
     def llvm_type_from_rtype( self, rtype ):
         """Returns the LLVM type corresponding to rtype.
@@ -164,6 +420,29 @@ class ModuleGenerator(object):
         """
         return self._type_provider.get_attribute_index( r_type_class, attribute_name )
 
+    def get_struct_ctype( self, r_type ):
+        """Returns the ctypes.Structure with the layout of the LLVM structure
+        of r_type (an instance or a class), see rpy.nativestruct.
+        """
+        r_type_class = r_type.get_resolved_type( self.type_registry )
+        if isinstance( r_type_class, rtypes.InstanceType ):
+            r_type_class = r_type_class.class_type
+        if isinstance( r_type_class, rtypes.CStructType ):
+            return r_type_class.py_class
+        struct_ctype = self._struct_ctypes.get( r_type_class )
+        if struct_ctype is None:
+            struct_ctype = nativestruct.make_struct_ctype(
+                r_type_class.py_class.__name__,
+                self._type_provider.get_class_fields( r_type_class ) )
+            self._struct_ctypes[r_type_class] = struct_ctype
+        return struct_ctype
+
+    def get_soa_column_index( self, r_type_soa, attribute_name ):
+        return self._type_provider.get_soa_column_index( r_type_soa, attribute_name )
+
+    def get_soa_columns( self, r_type_soa ):
+        return self._type_provider.get_soa_columns( r_type_soa )
+
     def add_function( self, py_func, r_func_type ):
         # Notes: some rtypes are both a type and a callable (constructor). We hardwire that we want the callable aspect as llvm type.
         l_func_type = self.llvm_function_type_from_rtype( r_func_type )
@@ -179,6 +458,113 @@ class ModuleGenerator(object):
             self.l_functions[ r_func_type.py_class ] = l_function
         return l_function, l_func_type
 
+    def _get_boundary_py_type( self, r_type, supported_py_types ):
+        r_type = r_type.get_resolved_type( self.type_registry )
+        for py_type in supported_py_types:
+            if type(r_type) is _BOUNDARY_RTYPES[py_type]:
+                return py_type
+        raise ValueError( 'Unsupported entry point container item type: %r' % r_type )
+
+    def _get_list_item_py_type( self, r_type ):
+        """Returns the python type of the items if r_type is a list, None
+           otherwise.
+        """
+        r_type = r_type.get_resolved_type( self.type_registry )
+        if type(r_type) is not rtypes.ListType:
+            return None
+        return self._get_boundary_py_type( r_type.item_type, (int, float) )
+
+    def _get_arg_boundary( self, r_type ):
+        """Returns the object marshalling a parameter passed by address (see
+           add_entry_point_thunk()), None for parameters passed as generic
+           values.
+        """
+        r_type = r_type.get_resolved_type( self.type_registry )
+        if type(r_type) is rtypes.ListType:
+            return nativelist.ListArgument( self._get_list_item_py_type( r_type ) )
+        if isinstance( r_type, rtypes.BytesType ):
+            return nativebytes.BytesArgument()
+        if (isinstance( r_type, rtypes.InstanceType ) and
+            isinstance( r_type.class_type, rtypes.CStructType )):
+            return nativestruct.StructArgument( r_type.class_type.py_class )
+        if isinstance( r_type, rtypes.NativeInstanceType ):
+            return nativeio.FileArgument()
+        return None
+
+    def _get_return_view( self, r_type ):
+        """Returns the function making a python view on a returned list or
+           instance, None for other types. It is called with the address of
+           the value and the rpy.arena.DetachedChunks holding it.
+        """
+        r_type = r_type.get_resolved_type( self.type_registry )
+        if type(r_type) is rtypes.ListType:
+            return functools.partial( nativelist.list_view_from_header_address,
+                                      item_py_type=self._get_list_item_py_type( r_type ) )
+        if isinstance( r_type, rtypes.InstanceType ):
+            return functools.partial( nativestruct.struct_view_from_address,
+                                      struct_ctype=self.get_struct_ctype( r_type ) )
+        return None
+
+    def _get_return_converter( self, r_type ):
+        """Returns the function converting the address of a returned dict into
+           a python object (a copy), None for other types.
+        """
+        r_type = r_type.get_resolved_type( self.type_registry )
+        if type(r_type) is rtypes.DictType:
+            return functools.partial( nativedict.dict_from_header_address,
+                key_py_type=self._get_boundary_py_type( r_type.key_type, (int, str, bytes) ),
+                value_py_type=self._get_boundary_py_type( r_type.value_type, (int, float, bool) ) )
+        return None
+
+    def add_entry_point_thunk( self, l_func, r_func_type ):
+        """Adds the function called by CompiledFunction. Lists, dicts, instances
+           (pointers) and bytes (structures) can not be marshalled as generic
+           values: the thunk takes and returns them as an address (int).
+           The parameters passed by address are described by
+           entry_arg_boundaries, see nativelist.ListArgument for the interface.
+           A returned address is converted by entry_return_view (zero-copy)
+           or entry_return_converter (copy).
+           Returns the thunk (l_func if no value is passed by address).
+        """
+        r_arg_types = r_func_type.get_arg_types()
+        self.entry_arg_boundaries = [ self._get_arg_boundary( r_arg_type )
+                                      for r_arg_type in r_arg_types ]
+        r_return_type = r_func_type.get_return_type()
+        self.entry_return_view = self._get_return_view( r_return_type )
+        self.entry_return_converter = self._get_return_converter( r_return_type )
+        returns_address = (self.entry_return_view is not None or
+                           self.entry_return_converter is not None)
+        if not returns_address and not any( self.entry_arg_boundaries ):
+            return l_func
+        l_func_type = l_func.type.pointee
+        l_return_type = l_func_type.return_type
+        if returns_address:
+            l_return_type = L_INT_TYPE
+        l_arg_types = [ L_INT_TYPE if boundary is not None else l_arg.type
+                        for l_arg, boundary in zip( l_func.args,
+                                                    self.entry_arg_boundaries ) ]
+        l_thunk = self.l_module.add_function(
+            lcore.Type.function( l_return_type, l_arg_types ), l_func.name + '__thunk' )
+        builder = lcore.Builder.new( l_thunk.append_basic_block( 'entry' ) )
+        l_call_args = []
+        for l_arg, l_thunk_arg, boundary in zip( l_func.args, l_thunk.args,
+                                                 self.entry_arg_boundaries ):
+            if boundary is not None:
+                if isinstance( l_arg.type, lcore.PointerType ):
+                    l_thunk_arg = builder.inttoptr( l_thunk_arg, l_arg.type )
+                else: # structure passed by value
+                    l_thunk_arg = builder.load( builder.inttoptr(
+                        l_thunk_arg, lcore.Type.pointer( l_arg.type ) ) )
+            l_call_args.append( l_thunk_arg )
+        l_return_value = builder.call( l_func, l_call_args )
+        if returns_address:
+            builder.ret( builder.ptrtoint( l_return_value, L_INT_TYPE ) )
+        elif l_return_type == L_VOID_TYPE:
+            builder.ret_void()
+        else:
+            builder.ret( l_return_value )
+        return l_thunk
+
     def get_function( self, py_func ):
         """Returns the LLVM function declaration corresponding to the
            specified python function.
@@ -203,6 +589,10 @@ class BasicBlock(object):
         self.opcode_index = opcode_index
         name = self._make_name( name )
         self.l_basic_block = l_func.append_basic_block( name )
+        # LLVM block where code is appended. Differs from l_basic_block
+        # once some code generated for the python block needed extra
+        # LLVM blocks (e.g. overflow check).
+        self.l_tail_block = self.l_basic_block
         self.incoming_blocks = [] # The list of blocks that branch to this block
         #self.outgoing_blocks = []
         self.locals_value = {} # values of local variable by index
@@ -224,6 +614,10 @@ class BasicBlock(object):
         """
         return 'l%d_%s' % (self.opcode_index, name) 
 
+    def continue_in( self, l_block ):
+        """Sets the LLVM block where the code of this block continues."""
+        self.l_tail_block = l_block
+
     def set_local_var( self, index, l_value ):
         self.locals_value[index] = l_value
 
@@ -280,6 +674,19 @@ class BasicBlock(object):
             list(block.name for block in self.incoming_blocks),
             loop_info )
 
+class LoopCounter(object):
+    """Induction variable of a for loop lowered to a counted loop.
+       l_stop is None when iterating over a container: its length is loaded
+       on each iteration. l_length is the length of an iterated dict when the
+       loop starts, see generate_dict_iteration().
+    """
+    def __init__( self, l_counter_ptr, l_stop, l_step, l_iterable=None, l_length=None ):
+        self.l_counter_ptr = l_counter_ptr
+        self.l_stop = l_stop
+        self.l_step = l_step
+        self.l_iterable = l_iterable
+        self.l_length = l_length
+
 class FunctionCodeGenerator(object):
     """The function code generator acts mostly as a python bytecode to LLVM translator.
 
@@ -304,12 +711,15 @@ class FunctionCodeGenerator(object):
             py_func, self.annotation.r_func_type )
         self.arg_count = self.l_func_type.arg_count
         self.is_constructor = self.annotation.r_func_type.is_constructor()
+        # See rpy.fast_math decorator
+        self.fast_math = getattr( py_func, 'rpy_fast_math', False )
         self.blocks_by_target = {} # dict{opcode_index: basic_block}
         self.branch_indexes = determine_branch_targets( self.py_func.__code__.co_code ) # read-only
         self.global_var_values = {} # dict{global_index: l_value}
         self._next_id_by_prefix = {}
         self.value_stack = []
         self.pending_break_jump_blocks = [] # List of blocks that need a final "break" jump
+        self._l_deoptimize_block = None # Created on first use by get_deoptimize_block()
         # self.locals_ptr: dict{local_var_index: l_value}
         #   This dictionary contains pointer to local variable memory
         #   allocated via alloca(), and pointer directly to parameters
@@ -369,6 +779,7 @@ class FunctionCodeGenerator(object):
                 action = ACTION_PROCESS_NEXT_OPCODE
             else:
                 print( "Processing @%d: opcode %s, %d" % (last_instr, opname[opcode], oparg) )
+                self.current_opcode_index = last_instr
                 self.next_instr_index = next_instr
                 action = opcode_handler( self, oparg )
                 assert action is not None
@@ -409,7 +820,7 @@ class FunctionCodeGenerator(object):
         for block in self.pending_break_jump_blocks:
             branch_index = block.find_break_branch_target()
             # Setup context to emit branch instruction
-            self.builder.position_at_end( block.l_basic_block )
+            self.builder.position_at_end( block.l_tail_block )
             self.current_block = block
             # Emit branch instruction
             self.generic_jump_absolute( branch_index )
@@ -440,6 +851,32 @@ class FunctionCodeGenerator(object):
         self.blocks_by_target[branch_index] = target_block
         return target_block
 
+    def get_deoptimize_block( self ):
+        """Returns the LLVM block that bails out of native code: it sets the
+           deoptimization flag and returns immediately. The caller checks the
+           flag and re-executes the call with CPython.
+        """
+        if self._l_deoptimize_block is None:
+            self._l_deoptimize_block = self.l_func.append_basic_block( 'deoptimize' )
+            builder = lcore.Builder.new( self._l_deoptimize_block )
+            builder.store( L_TRUE, self.module_generator.l_deoptimized )
+            l_return_type = self.l_func_type.return_type
+            if l_return_type.kind == lcore.TYPE_VOID:
+                builder.ret_void()
+            else:
+                builder.ret( lcore.Constant.undef( l_return_type ) )
+        return self._l_deoptimize_block
+
+    def deoptimize_if( self, l_condition, name ):
+        """Branches to the deoptimization block if l_condition is true, and
+           continues code generation in a new LLVM block otherwise.
+        """
+        l_continue_block = self.l_func.append_basic_block( self.new_id( name ) )
+        self.builder.cbranch( l_condition, self.get_deoptimize_block(),
+                              l_continue_block )
+        self.builder.position_at_end( l_continue_block )
+        self.current_block.continue_in( l_continue_block )
+
     def reset_block_name( self, branch_index, name ):
         block = self.obtain_block_at( branch_index, name )
         block.set_block_name( name )
@@ -472,29 +909,45 @@ class FunctionCodeGenerator(object):
     def py_value_as_llvm_value( self, py_value, r_value_type ):
         """Returns a tuple (l_value, l_type) for the specified python object.
         """
+        if isinstance( r_value_type, (rtypes.BuiltinFunctionType, rtypes.ForeignFunctionType,
+                                      rtypes.ModuleType) ):
+            return (None, None) # only used at compile time, see opcode_call_function
         l_value_type = self.module_generator.llvm_type_from_rtype( r_value_type )
         if l_value_type == L_INT_TYPE:
             l_value = lcore.Constant.int( L_INT_TYPE, py_value )
+        elif l_value_type == L_DOUBLE_TYPE:
+            l_value = lcore.Constant.real( L_DOUBLE_TYPE, py_value )
+        elif l_value_type == L_BOOL_TYPE:
+            l_value = py_value and L_TRUE or L_FALSE
         elif isinstance( l_value_type, lcore.FunctionType ):
             l_value = self.module_generator.get_function( py_value )
+        elif isinstance( py_value, str ): # str are UTF-8 encoded
+            l_value = self.module_generator.get_bytes_constant( py_value.encode( 'utf-8' ) )
+        elif isinstance( py_value, bytes ):
+            l_value = self.module_generator.get_bytes_constant( py_value )
         elif py_value is None:
             l_value = lcore.Constant.int( L_INT_TYPE, 0 ) # @todo Use more distinct type to generate error
         elif isinstance( py_value, type ):
-            # Notes: this assumes we want the constructor function corresponding to the type
-            l_value = self.module_generator.get_function( py_value )
+            # Notes: this assumes we want the constructor function corresponding to the type.
+            # The constructor of a class only passed to rpy.soa() is not generated.
+            l_value = self.module_generator.l_functions.get( py_value )
         else:
             raise NotImplementedError( 'Can not manage code generation for constant: %r' % py_value )
         return (l_value, l_value_type)
 
     def opcode_load_global( self, oparg ):
         global_index = oparg
+        r_type = self.get_global_var_type( global_index )
         if global_index in self.global_var_values:
-            return self.global_var_values[global_index]
+            self.push_value( self.global_var_values[global_index], r_type )
+            return ACTION_PROCESS_NEXT_OPCODE
 
         global_var_name = self.py_func.__code__.co_names[global_index]
-        py_value = self.py_func.__globals__[ global_var_name ]
+        if global_var_name in self.py_func.__globals__:
+            py_value = self.py_func.__globals__[ global_var_name ]
+        else:
+            py_value = getattr( builtins, global_var_name )
 
-        r_type = self.get_global_var_type( global_index )
         l_value, l_value_type = self.py_value_as_llvm_value(
             py_value, r_type )
         self.global_var_values[global_index] = l_value
@@ -521,29 +974,809 @@ class FunctionCodeGenerator(object):
 ##            parameter_name = self.pop_constant_value()
 ##            kw_args[parameter_name] = parameter_type
         l_arg_values = []
+        r_arg_types = []
         for index in range(0,nb_arg):
-            l_arg_values.insert( 0, self.pop_value() )
+            l_arg_value, r_arg_type = self.pop_value_with_rtype()
+            l_arg_values.insert( 0, l_arg_value )
+            r_arg_types.insert( 0, r_arg_type )
         l_fn_value, r_fn_type = self.pop_value_with_rtype()
+        if isinstance( r_fn_type, rtypes.ForeignFunctionType ):
+            r_return_type = self.annotation.get_site_type( self.current_opcode_index )
+            l_return_value = self.generate_foreign_call( r_fn_type.foreign_function,
+                                                         l_arg_values )
+            self.push_value( l_return_value, r_return_type )
+            return ACTION_PROCESS_NEXT_OPCODE
+        if isinstance( r_fn_type, rtypes.BuiltinFunctionType ):
+            r_return_type = self.annotation.get_site_type( self.current_opcode_index )
+            if isinstance( r_fn_type, rtypes.BuiltinMethodType ): # self is the method value
+                l_arg_values.insert( 0, l_fn_value )
+                r_arg_types.insert( 0, r_fn_type.instance_type )
+            generator = getattr( self, 'generate_builtin_' + r_fn_type.name )
+            l_return_value = generator( l_arg_values, r_arg_types, r_return_type )
+            self.push_value( l_return_value, r_return_type )
+            return ACTION_PROCESS_NEXT_OPCODE
+        l_param_types = l_fn_value.type.pointee.args
+        if r_fn_type.is_constructor(): # first parameter is the instance
+            l_param_types = l_param_types[1:]
+        l_arg_values = [ self.coerce_value( l_arg_value, l_param_type )
+                         for l_arg_value, l_param_type in zip( l_arg_values,
+                                                               l_param_types ) ]
         if r_fn_type.is_constructor(): # The call is a constructor invocation
             # We allocate the memory for the type, call the constructor, and
             # use the address of the allocated type as expression value
             l_struct_type = self.module_generator.llvm_type_from_rtype( r_fn_type )
-            # @todo allocate memory dynamically instead of on the stack
-            l_instance = self.builder.alloca( l_struct_type, self.new_id('instance') )
+            l_instance = self.allocate_instance( l_struct_type )
             l_arg_values.insert( 0, l_instance )
             self.builder.call( l_fn_value, l_arg_values )
             l_return_value = l_instance
         else:
             l_return_value = self.builder.call( l_fn_value, l_arg_values )
+        # Bails out if the called function did
+        l_deoptimized = self.builder.load( self.module_generator.l_deoptimized )
+        self.deoptimize_if( l_deoptimized, 'call_succeed' )
         self.push_value( l_return_value, r_fn_type.get_return_type() )
         return ACTION_PROCESS_NEXT_OPCODE
 
+    def generate_foreign_call( self, foreign_function, l_arg_values ):
+        """Calls a C function declared with rpy.foreign() through its address,
+           resolved at compile time. Arguments are truncated to the declared
+           ctypes and the returned value is widened like a ctypes.Structure
+           field. A bytes argument passes the address of its data.
+        """
+        b = self.builder
+        l_param_types = [ L_BYTE_PTR_TYPE if ctype is bytes
+                          else nativestruct.llvm_type_from_ctype( ctype )
+                          for ctype in foreign_function.argtypes ]
+        if foreign_function.restype is None:
+            l_return_type = L_VOID_TYPE
+        else:
+            l_return_type = nativestruct.llvm_type_from_ctype( foreign_function.restype )
+        l_func_type = lcore.Type.function( l_return_type, l_param_types )
+        l_func = b.inttoptr( lcore.Constant.int( L_INT_TYPE, foreign_function.get_address() ),
+                             lcore.Type.pointer( l_func_type ) )
+        l_call_args = []
+        for l_arg_value, l_param_type in zip( l_arg_values, l_param_types ):
+            if l_param_type == L_BYTE_PTR_TYPE:
+                if l_arg_value.type != L_BYTES_TYPE:
+                    raise ValueError( '%s() expects a bytes argument, not %s' %
+                                      (foreign_function.symbol, l_arg_value.type) )
+                l_call_args.append( b.extract_value( l_arg_value, BYTES_FIELD_DATA ) )
+            else:
+                l_call_args.append( self.coerce_value( l_arg_value, l_param_type ) )
+        l_return_value = b.call( l_func, l_call_args )
+        if foreign_function.restype is None:
+            return l_return_value
+        return self.widen_native_value( l_return_value, foreign_function.is_unsigned_return() )
+
+    def allocate_instance( self, l_struct_type ):
+        """Allocates the memory of the instance created by the constructor
+           call at the current opcode. Instances that do not escape the
+           function are allocated on the stack (see rpy.escapeanalysis),
+           others in the arena of the entry point call (see rpy.arena).
+        """
+        strategy = self.annotator.escape_analysis.get_allocation_strategy(
+            self.py_func, self.current_opcode_index )
+        if strategy == ALLOC_STACK:
+            # Allocating in the entry block reserves the stack space once,
+            # even when the constructor is called in a loop, and allows
+            # the scalar replacement of the instance.
+            return self.entry_alloca( l_struct_type, 'instance' )
+        return self.arena_allocate( l_struct_type, 'heap_instance' )
+
+    def entry_alloca( self, l_type, name ):
+        """Reserves stack space for a l_type in the entry block."""
+        l_entry_block = self.blocks_by_target[0].l_basic_block
+        builder = lcore.Builder.new( l_entry_block )
+        builder.position_at_beginning( l_entry_block )
+        return builder.alloca( l_type, self.new_id( name ) )
+
+    def arena_allocate( self, l_type, name, l_count=None ):
+        """Allocates an l_type (or an array of l_count l_type) in the arena of
+           the entry point call. Returns a pointer to l_type.
+        """
+        l_ptr, l_continue_block = self.module_generator.arena.emit_allocation(
+            self.builder, self.l_func, l_type, self.new_id( name ), l_count )
+        self.current_block.continue_in( l_continue_block )
+        return l_ptr
+
+    def get_resolved_type( self, r_type ):
+        return r_type.get_resolved_type( self.module_generator.type_registry )
+
+    def get_checked_index( self, l_index, l_length ):
+        """Returns the index of an item of a container of length l_length with
+           python semantic: negative index counts from the end. Bails out if
+           the index is out of range (IndexError).
+        """
+        b = self.builder
+        l_index = self.coerce_value( l_index, L_INT_TYPE )
+        l_is_negative = b.icmp( lcore.IPRED_SLT, l_index, L_INT_0 )
+        l_index = b.select( l_is_negative, b.add( l_index, l_length ), l_index )
+        # Notes: negative index are greater than l_length when unsigned
+        l_out_of_range = b.icmp( lcore.IPRED_UGE, l_index, l_length )
+        self.deoptimize_if( l_out_of_range, 'index_in_range' )
+        return l_index
+
+    def generate_builtin_len( self, l_arg_values, r_arg_types, r_return_type ):
+        r_container_type = self.get_resolved_type( r_arg_types[0] )
+        if isinstance( r_container_type, rtypes.SoAType ):
+            return self.get_soa_length( l_arg_values[0] )
+        if isinstance( r_container_type, rtypes.ListType ):
+            return self.builder.load( self.get_list_field_ptr( l_arg_values[0],
+                                                               LIST_FIELD_LENGTH ) )
+        if isinstance( r_container_type, rtypes.DictType ):
+            return self.builder.load( get_field_ptr( self.builder, l_arg_values[0],
+                                                     DICT_FIELD_LENGTH ) )
+        if isinstance( r_container_type, rtypes.BytesType ):
+            return self.builder.extract_value( l_arg_values[0], BYTES_FIELD_LENGTH )
+        raise NotImplementedError( 'len() not supported for %r' % r_container_type )
+
+    # Numeric functions (see rtypes._NUMERIC_BUILTINS). The math functions are
+    # LLVM intrinsics or libm functions known to LLVM, so they are constant
+    # folded and vectorized. Arguments for which python raises an exception
+    # (math domain error, overflow) bail out: CPython raises it.
+
+    def call_float_function( self, name, l_arg_values, intrinsic_id=None ):
+        """Calls the double intrinsic intrinsic_id, or the libm function name
+           if intrinsic_id is None, with the arguments converted to double.
+        """
+        l_args = [ self.coerce_value( l_arg_value, L_DOUBLE_TYPE )
+                   for l_arg_value in l_arg_values ]
+        if intrinsic_id is None:
+            l_function = self.module_generator.get_external_function(
+                name, lcore.Type.function( L_DOUBLE_TYPE, [L_DOUBLE_TYPE] * len(l_args) ) )
+        else:
+            l_function = self.module_generator.get_intrinsic( intrinsic_id, [L_DOUBLE_TYPE] )
+        return self.builder.call( l_function, l_args )
+
+    def deoptimize_if_not_finite( self, l_value ):
+        """Bails out if l_value is infinite or NaN."""
+        b = self.builder
+        l_not_finite = b.or_( b.fcmp( lcore.FPRED_UEQ, l_value, L_DOUBLE_INF ),
+                              b.fcmp( lcore.FPRED_OEQ, l_value, L_DOUBLE_MINUS_INF ) )
+        self.deoptimize_if( l_not_finite, 'finite' )
+
+    def generate_builtin_math_sqrt( self, l_arg_values, r_arg_types, r_return_type ):
+        l_x = self.coerce_value( l_arg_values[0], L_DOUBLE_TYPE )
+        self.deoptimize_if( self.builder.fcmp( lcore.FPRED_OLT, l_x, L_DOUBLE_0 ),
+                            'sqrt_domain' )
+        return self.call_float_function( 'sqrt', [l_x], lcore.INTR_SQRT )
+
+    def generate_builtin_math_exp( self, l_arg_values, r_arg_types, r_return_type ):
+        """Bails out on overflow, including exp(inf) which CPython returns."""
+        l_result = self.call_float_function( 'exp', l_arg_values, lcore.INTR_EXP )
+        self.deoptimize_if( self.builder.fcmp( lcore.FPRED_OEQ, l_result, L_DOUBLE_INF ),
+                            'exp_range' )
+        return l_result
+
+    def generate_builtin_math_log( self, l_arg_values, r_arg_types, r_return_type ):
+        l_x = self.coerce_value( l_arg_values[0], L_DOUBLE_TYPE )
+        self.deoptimize_if( self.builder.fcmp( lcore.FPRED_OLE, l_x, L_DOUBLE_0 ),
+                            'log_domain' )
+        return self.call_float_function( 'log', [l_x], lcore.INTR_LOG )
+
+    def generate_builtin_math_sin( self, l_arg_values, r_arg_types, r_return_type ):
+        return self.generate_trigonometric_call( 'sin', l_arg_values, lcore.INTR_SIN )
+
+    def generate_builtin_math_cos( self, l_arg_values, r_arg_types, r_return_type ):
+        return self.generate_trigonometric_call( 'cos', l_arg_values, lcore.INTR_COS )
+
+    def generate_trigonometric_call( self, name, l_arg_values, intrinsic_id ):
+        """Bails out if the result is NaN: the argument is infinite (domain
+           error) or NaN.
+        """
+        l_result = self.call_float_function( name, l_arg_values, intrinsic_id )
+        self.deoptimize_if( self.builder.fcmp( lcore.FPRED_UNO, l_result, l_result ),
+                            name + '_domain' )
+        return l_result
+
+    def generate_builtin_math_pow( self, l_arg_values, r_arg_types, r_return_type ):
+        """Bails out if the result is not finite (domain error, overflow or
+           infinite/NaN arguments).
+        """
+        l_result = self.call_float_function( 'pow', l_arg_values, lcore.INTR_POW )
+        self.deoptimize_if_not_finite( l_result )
+        return l_result
+
+    def generate_builtin_math_fabs( self, l_arg_values, r_arg_types, r_return_type ):
+        return self.call_float_function( 'fabs', l_arg_values )
+
+    def generate_builtin_math_floor( self, l_arg_values, r_arg_types, r_return_type ):
+        return self.generate_rounding_call( 'floor', l_arg_values[0] )
+
+    def generate_builtin_math_ceil( self, l_arg_values, r_arg_types, r_return_type ):
+        return self.generate_rounding_call( 'ceil', l_arg_values[0] )
+
+    def generate_rounding_call( self, name, l_value ):
+        """math.floor() and math.ceil() return an int. Bails out if it does
+           not fit in 64 bits (big int, or error for infinite and NaN).
+        """
+        if l_value.type != L_DOUBLE_TYPE:
+            return self.coerce_value( l_value, L_INT_TYPE )
+        b = self.builder
+        l_rounded = self.call_float_function( name, [l_value] )
+        l_out_of_range = b.or_( b.fcmp( lcore.FPRED_UGE, l_rounded, L_DOUBLE_2_POW_63 ),
+                                b.fcmp( lcore.FPRED_OLT, l_rounded, L_DOUBLE_MINUS_2_POW_63 ) )
+        self.deoptimize_if( l_out_of_range, name + '_range' )
+        return b.fptosi( l_rounded, L_INT_TYPE )
+
+    def generate_builtin_abs( self, l_arg_values, r_arg_types, r_return_type ):
+        """abs( INT_MIN ) bails out (big int)."""
+        l_value = l_arg_values[0]
+        if l_value.type == L_DOUBLE_TYPE:
+            return self.call_float_function( 'fabs', [l_value] )
+        b = self.builder
+        l_value = self.coerce_value( l_value, L_INT_TYPE )
+        self.deoptimize_if( b.icmp( lcore.IPRED_EQ, l_value, L_INT_MIN ), 'abs_overflow' )
+        return b.select( b.icmp( lcore.IPRED_SLT, l_value, L_INT_0 ),
+                         b.sub( L_INT_0, l_value ), l_value )
+
+    def generate_builtin_min( self, l_arg_values, r_arg_types, r_return_type ):
+        return self.generate_min_max( l_arg_values, r_return_type, want_min=True )
+
+    def generate_builtin_max( self, l_arg_values, r_arg_types, r_return_type ):
+        return self.generate_min_max( l_arg_values, r_return_type, want_min=False )
+
+    def generate_min_max( self, l_arg_values, r_return_type, want_min ):
+        """Like CPython, an argument replaces the current result if it
+           compares lower (min) or greater (max): the first of equal values
+           is kept and NaN arguments are skipped unless first. Mixed int and
+           float arguments are promoted to float.
+        """
+        b = self.builder
+        l_type = self.module_generator.llvm_type_from_rtype( r_return_type )
+        l_values = [ self.coerce_value( l_arg_value, l_type ) for l_arg_value in l_arg_values ]
+        if l_type == L_DOUBLE_TYPE:
+            compare, predicate = b.fcmp, lcore.FPRED_OLT if want_min else lcore.FPRED_OGT
+        elif l_type == L_BOOL_TYPE: # True is 1, not -1
+            compare, predicate = b.icmp, lcore.IPRED_ULT if want_min else lcore.IPRED_UGT
+        else:
+            compare, predicate = b.icmp, lcore.IPRED_SLT if want_min else lcore.IPRED_SGT
+        l_result = l_values[0]
+        for l_value in l_values[1:]:
+            l_result = b.select( compare( predicate, l_value, l_result ), l_value, l_result )
+        return l_result
+
+    def get_list_field_ptr( self, l_list, field ):
+        return self.builder.gep( l_list, [L_CONSTANT_0,
+                                          lcore.Constant.int( L_INDEX_TYPE, field )] )
+
+    def emit_memcpy( self, l_destination, l_source, l_item_type, l_count ):
+        """Copies l_count items of type l_item_type."""
+        b = self.builder
+        l_memcpy = self.module_generator.get_intrinsic( lcore.INTR_MEMCPY, [L_INT_TYPE] )
+        l_size = self.module_generator.arena.emit_size_of( b, l_item_type, l_count )
+        b.call( l_memcpy, [b.bitcast( l_destination, L_BYTE_PTR_TYPE ),
+                           b.bitcast( l_source, L_BYTE_PTR_TYPE ),
+                           l_size, lcore.Constant.int( L_INDEX_TYPE, 1 )] )
+
+    def allocate_list( self, l_list_type, l_length, l_capacity ):
+        """Allocates a list header and its data in the arena. Returns the
+           list (pointer to the header).
+        """
+        b = self.builder
+        l_list = self.arena_allocate( l_list_type.pointee, 'list' )
+        l_item_type = l_list_type.pointee.elements[LIST_FIELD_DATA].pointee
+        l_data = self.arena_allocate( l_item_type, 'list_data', l_capacity )
+        b.store( l_data, self.get_list_field_ptr( l_list, LIST_FIELD_DATA ) )
+        b.store( l_length, self.get_list_field_ptr( l_list, LIST_FIELD_LENGTH ) )
+        b.store( l_capacity, self.get_list_field_ptr( l_list, LIST_FIELD_CAPACITY ) )
+        return l_list
+
+    def generate_builtin_list_append( self, l_arg_values, r_arg_types, r_return_type ):
+        """Appends an item, growing the list data (amortized doubling of the
+           capacity) if it is full. The old data is released with the arena.
+           A list sharing the buffer of a parameter (negative capacity, see
+           rpy.nativelist) is always full: its items are copied.
+        """
+        b = self.builder
+        l_list, l_value = l_arg_values
+        l_data_ptr = self.get_list_field_ptr( l_list, LIST_FIELD_DATA )
+        l_length_ptr = self.get_list_field_ptr( l_list, LIST_FIELD_LENGTH )
+        l_capacity_ptr = self.get_list_field_ptr( l_list, LIST_FIELD_CAPACITY )
+        l_length = b.load( l_length_ptr )
+        l_capacity = b.load( l_capacity_ptr )
+        l_grow_block = self.l_func.append_basic_block( self.new_id( 'list_grow' ) )
+        l_append_block = self.l_func.append_basic_block( self.new_id( 'list_append' ) )
+        b.cbranch( b.icmp( lcore.IPRED_SGE, l_length, l_capacity ),
+                   l_grow_block, l_append_block )
+        b.position_at_end( l_grow_block )
+        self.current_block.continue_in( l_grow_block )
+        # length == capacity, unless the capacity is negative
+        l_new_capacity = b.select( b.icmp( lcore.IPRED_SLT, l_length, L_LIST_MIN_CAPACITY ),
+                                   L_LIST_MIN_CAPACITY, b.mul( l_length, L_INT_2 ) )
+        l_old_data = b.load( l_data_ptr )
+        l_new_data = self.arena_allocate( l_old_data.type.pointee, 'list_data',
+                                          l_new_capacity )
+        self.emit_memcpy( l_new_data, l_old_data, l_old_data.type.pointee, l_length )
+        b.store( l_new_data, l_data_ptr )
+        b.store( l_new_capacity, l_capacity_ptr )
+        b.branch( l_append_block )
+        b.position_at_end( l_append_block )
+        self.current_block.continue_in( l_append_block )
+        l_data = b.load( l_data_ptr )
+        l_item_ptr = b.gep( l_data, [l_length] )
+        b.store( self.coerce_value( l_value, l_item_ptr.type.pointee ), l_item_ptr )
+        b.store( b.add( l_length, L_INT_1 ), l_length_ptr )
+        return None # python returns None
+
+    def ensure_list_writable( self, l_list ):
+        """Copies the items of a list sharing the buffer of a parameter
+           (negative capacity, see rpy.nativelist) into the arena before they
+           are modified: the buffer of the caller is only updated when the
+           call completes, not if it bails out.
+        """
+        b = self.builder
+        l_capacity_ptr = self.get_list_field_ptr( l_list, LIST_FIELD_CAPACITY )
+        l_copy_block = self.l_func.append_basic_block( self.new_id( 'list_copy' ) )
+        l_writable_block = self.l_func.append_basic_block( self.new_id( 'list_writable' ) )
+        b.cbranch( b.icmp( lcore.IPRED_SLT, b.load( l_capacity_ptr ), L_INT_0 ),
+                   l_copy_block, l_writable_block )
+        b.position_at_end( l_copy_block )
+        self.current_block.continue_in( l_copy_block )
+        l_data_ptr = self.get_list_field_ptr( l_list, LIST_FIELD_DATA )
+        l_length = b.load( self.get_list_field_ptr( l_list, LIST_FIELD_LENGTH ) )
+        l_shared_data = b.load( l_data_ptr )
+        l_data = self.arena_allocate( l_shared_data.type.pointee, 'list_data', l_length )
+        self.emit_memcpy( l_data, l_shared_data, l_shared_data.type.pointee, l_length )
+        b.store( l_data, l_data_ptr )
+        b.store( l_length, l_capacity_ptr )
+        b.branch( l_writable_block )
+        b.position_at_end( l_writable_block )
+        self.current_block.continue_in( l_writable_block )
+
+    def get_list_item_ptr( self, l_list, l_index ):
+        """Returns a pointer to an item of the list, bails out if the index is
+           out of range.
+        """
+        l_length = self.builder.load( self.get_list_field_ptr( l_list, LIST_FIELD_LENGTH ) )
+        l_index = self.get_checked_index( l_index, l_length )
+        l_data = self.builder.load( self.get_list_field_ptr( l_list, LIST_FIELD_DATA ) )
+        return self.builder.gep( l_data, [l_index] )
+
+    def get_slice_bound( self, l_index, l_length ):
+        """Clamps a slice bound in [0, length] with python semantic."""
+        b = self.builder
+        l_index = self.coerce_value( l_index, L_INT_TYPE )
+        l_index = b.select( b.icmp( lcore.IPRED_SLT, l_index, L_INT_0 ),
+                            b.add( l_index, l_length ), l_index )
+        l_index = b.select( b.icmp( lcore.IPRED_SLT, l_index, L_INT_0 ),
+                            L_INT_0, l_index )
+        return b.select( b.icmp( lcore.IPRED_SGT, l_index, l_length ),
+                         l_length, l_index )
+
+    def generate_list_slice( self, l_list, l_start, l_stop ):
+        """Returns a new list containing a copy of the items list[start:stop].
+           l_start and l_stop are None if omitted.
+        """
+        b = self.builder
+        l_length = b.load( self.get_list_field_ptr( l_list, LIST_FIELD_LENGTH ) )
+        l_start = L_INT_0 if l_start is None else self.get_slice_bound( l_start, l_length )
+        l_stop = l_length if l_stop is None else self.get_slice_bound( l_stop, l_length )
+        l_count = b.select( b.icmp( lcore.IPRED_SGT, l_stop, l_start ),
+                            b.sub( l_stop, l_start ), L_INT_0 )
+        l_slice = self.allocate_list( l_list.type, l_count, l_count )
+        l_data = b.load( self.get_list_field_ptr( l_list, LIST_FIELD_DATA ) )
+        l_slice_data = b.load( self.get_list_field_ptr( l_slice, LIST_FIELD_DATA ) )
+        self.emit_memcpy( l_slice_data, b.gep( l_data, [l_start] ),
+                          l_data.type.pointee, l_count )
+        return l_slice
+
+    def opcode_build_list( self, oparg ):
+        l_item_values = [ self.pop_value() for index in range(0, oparg) ]
+        l_item_values.reverse()
+        r_list_type = self.annotation.get_site_type( self.current_opcode_index )
+        l_list_type = self.module_generator.llvm_type_from_rtype( r_list_type )
+        l_capacity = lcore.Constant.int( L_INT_TYPE, max( oparg, LIST_MIN_CAPACITY ) )
+        l_list = self.allocate_list( l_list_type, lcore.Constant.int( L_INT_TYPE, oparg ),
+                                     l_capacity )
+        l_data = self.builder.load( self.get_list_field_ptr( l_list, LIST_FIELD_DATA ) )
+        for index, l_item_value in enumerate( l_item_values ):
+            l_item_ptr = self.builder.gep( l_data, [lcore.Constant.int( L_INT_TYPE, index )] )
+            self.builder.store( self.coerce_value( l_item_value, l_item_ptr.type.pointee ),
+                                l_item_ptr )
+        self.push_value( l_list, r_list_type )
+        return ACTION_PROCESS_NEXT_OPCODE
+
+    def make_bytes( self, l_data, l_length ):
+        l_bytes = self.builder.insert_value( lcore.Constant.undef( L_BYTES_TYPE ),
+                                             l_data, BYTES_FIELD_DATA )
+        return self.builder.insert_value( l_bytes, l_length, BYTES_FIELD_LENGTH )
+
+    def generate_bytes_slice( self, l_bytes, l_start, l_stop ):
+        """Returns a view bytes[start:stop] on the same data."""
+        b = self.builder
+        l_length = b.extract_value( l_bytes, BYTES_FIELD_LENGTH )
+        l_start = L_INT_0 if l_start is None else self.get_slice_bound( l_start, l_length )
+        l_stop = l_length if l_stop is None else self.get_slice_bound( l_stop, l_length )
+        l_count = b.select( b.icmp( lcore.IPRED_SGT, l_stop, l_start ),
+                            b.sub( l_stop, l_start ), L_INT_0 )
+        l_data = b.gep( b.extract_value( l_bytes, BYTES_FIELD_DATA ), [l_start] )
+        return self.make_bytes( l_data, l_count )
+
+    def get_bytes_find_start( self, l_start, l_length ):
+        """Start index of bytes.find(): negative index counts from the end.
+           A start beyond the end is kept: nothing can be found there.
+        """
+        b = self.builder
+        l_start = self.coerce_value( l_start, L_INT_TYPE )
+        l_start = b.select( b.icmp( lcore.IPRED_SLT, l_start, L_INT_0 ),
+                            b.add( l_start, l_length ), l_start )
+        return b.select( b.icmp( lcore.IPRED_SLT, l_start, L_INT_0 ), L_INT_0, l_start )
+
+    def generate_builtin_bytes_find( self, l_arg_values, r_arg_types, r_return_type ):
+        """bytes.find( sub[, start] ). sub is a bytes or an int (a byte)."""
+        b = self.builder
+        l_bytes, l_sub = l_arg_values[:2]
+        l_length = b.extract_value( l_bytes, BYTES_FIELD_LENGTH )
+        if len(l_arg_values) == 3:
+            l_start = self.get_bytes_find_start( l_arg_values[2], l_length )
+        else:
+            l_start = L_INT_0
+        if l_sub.type == L_BYTES_TYPE:
+            l_sub_data = b.extract_value( l_sub, BYTES_FIELD_DATA )
+            l_sub_length = b.extract_value( l_sub, BYTES_FIELD_LENGTH )
+        else:
+            l_sub = self.coerce_value( l_sub, L_INT_TYPE )
+            # A byte value out of [0, 255] raises ValueError
+            self.deoptimize_if( b.icmp( lcore.IPRED_UGT, l_sub, lcore.Constant.int( L_INT_TYPE, 255 ) ),
+                                'byte_in_range' )
+            l_sub_data = self.entry_alloca( L_BYTE_TYPE, 'find_byte' )
+            b.store( b.trunc( l_sub, L_BYTE_TYPE ), l_sub_data )
+            l_sub_length = L_INT_1
+        return self.module_generator.bytes_runtime.emit_find( b, l_bytes, l_sub_data,
+                                                              l_sub_length, l_start )
+
+    def generate_builtin_native_read( self, l_arg_values, r_arg_types, r_return_type ):
+        """RawFile.read( [n] ) reads into a buffer allocated in the arena, see
+           rpy.nativeio. Bails out if n is negative or the read fails.
+        """
+        b = self.builder
+        runtime = self.module_generator.file_runtime
+        l_file = l_arg_values[0]
+        if len(l_arg_values) == 2:
+            l_count = self.coerce_value( l_arg_values[1], L_INT_TYPE )
+            self.deoptimize_if( b.icmp( lcore.IPRED_SLT, l_count, L_INT_0 ),
+                                'read_size_positive' )
+        else: # until the end of the file
+            l_size = runtime.emit_file_size( b, l_file )
+            self.deoptimize_if( b.icmp( lcore.IPRED_SLT, l_size, L_INT_0 ),
+                                'file_size_known' )
+            l_remaining = b.sub( l_size, runtime.emit_tell( b, l_file ) )
+            l_count = b.select( b.icmp( lcore.IPRED_SGT, l_remaining, L_INT_0 ),
+                                l_remaining, L_INT_0 )
+        l_buffer = self.arena_allocate( L_BYTE_TYPE, 'read_buffer', l_count )
+        l_read = runtime.emit_read( b, l_file, l_buffer, l_count )
+        self.deoptimize_if( b.icmp( lcore.IPRED_SLT, l_read, L_INT_0 ), 'read_succeed' )
+        return self.make_bytes( l_buffer, l_read )
+
+    def generate_builtin_native_write( self, l_arg_values, r_arg_types, r_return_type ):
+        """RawFile.write( data ), bails out if data is not completely written."""
+        b = self.builder
+        l_file, l_data = l_arg_values
+        l_length = b.extract_value( l_data, BYTES_FIELD_LENGTH )
+        l_written = self.module_generator.file_runtime.emit_write(
+            b, l_file, b.extract_value( l_data, BYTES_FIELD_DATA ), l_length )
+        self.deoptimize_if( b.icmp( lcore.IPRED_NE, l_written, l_length ), 'write_complete' )
+        return l_length
+
+    def generate_builtin_native_seek( self, l_arg_values, r_arg_types, r_return_type ):
+        """RawFile.seek( offset[, whence] ), bails out if the position is
+           negative or whence is invalid.
+        """
+        b = self.builder
+        runtime = self.module_generator.file_runtime
+        l_file = l_arg_values[0]
+        l_offset = self.coerce_value( l_arg_values[1], L_INT_TYPE )
+        if len(l_arg_values) == 3:
+            l_whence = self.coerce_value( l_arg_values[2], L_INT_TYPE )
+        else:
+            l_whence = L_INT_0 # SEEK_SET
+        l_position = runtime.emit_seek( b, l_file, l_offset, l_whence )
+        self.deoptimize_if( b.icmp( lcore.IPRED_SLT, l_position, L_INT_0 ), 'seek_valid' )
+        runtime.emit_set_position( b, l_file, l_position )
+        return l_position
+
+    def generate_builtin_native_tell( self, l_arg_values, r_arg_types, r_return_type ):
+        return self.module_generator.file_runtime.emit_tell( self.builder, l_arg_values[0] )
+
+    def generate_builtin_native_fileno( self, l_arg_values, r_arg_types, r_return_type ):
+        l_fd = self.module_generator.file_runtime.emit_load_fd( self.builder, l_arg_values[0] )
+        return self.builder.sext( l_fd, L_INT_TYPE )
+
+    def get_dict_entry( self, l_dict, l_key ):
+        """Returns a tuple (l_entry, l_found) for the key, see
+           DictRuntime.emit_lookup().
+        """
+        l_key_type = l_dict.type.pointee.elements[DICT_FIELD_ENTRIES].pointee.elements[ENTRY_FIELD_KEY]
+        return self.module_generator.dict_runtime.emit_lookup(
+            self.builder, l_dict, self.coerce_value( l_key, l_key_type ) )
+
+    def store_dict_item( self, l_dict, l_key, l_value ):
+        l_entry_type = l_dict.type.pointee.elements[DICT_FIELD_ENTRIES].pointee
+        self.module_generator.dict_runtime.emit_store( self.builder, l_dict,
+            self.coerce_value( l_key, l_entry_type.elements[ENTRY_FIELD_KEY] ),
+            self.coerce_value( l_value, l_entry_type.elements[ENTRY_FIELD_VALUE] ) )
+
+    def generate_builtin_dict_get( self, l_arg_values, r_arg_types, r_return_type ):
+        l_dict, l_key, l_default = l_arg_values
+        l_entry, l_found = self.get_dict_entry( l_dict, l_key )
+        # The value of an empty entry is zeroed: loading it is safe
+        l_value = self.builder.load( get_field_ptr( self.builder, l_entry,
+                                                    ENTRY_FIELD_VALUE ) )
+        return self.builder.select( l_found, l_value,
+                                    self.coerce_value( l_default, l_value.type ) )
+
+    def opcode_build_map( self, oparg ):
+        """oparg is the number of items of the dict literal, see opcode_store_map()."""
+        r_dict_type = self.annotation.get_site_type( self.current_opcode_index )
+        l_dict_type = self.module_generator.llvm_type_from_rtype( r_dict_type )
+        l_dict, l_block = self.module_generator.dict_runtime.emit_allocation(
+            self.builder, self.l_func, l_dict_type, oparg )
+        self.current_block.continue_in( l_block )
+        self.push_value( l_dict, r_dict_type )
+        return ACTION_PROCESS_NEXT_OPCODE
+
+    def opcode_store_map( self, oparg ):
+        l_key = self.pop_value()
+        l_value = self.pop_value()
+        l_dict = self.value_stack[-1][0]
+        self.store_dict_item( l_dict, l_key, l_value )
+        return ACTION_PROCESS_NEXT_OPCODE
+
+    def opcode_build_slice( self, oparg ):
+        """The slice is kept as a python tuple (l_start, l_stop) on the value
+           stack, None for omitted bounds. It is only used by subscripts.
+        """
+        if oparg != 2:
+            raise NotImplementedError( 'Slice step is not supported' )
+        l_stop, r_stop_type = self.pop_value_with_rtype()
+        l_start, r_start_type = self.pop_value_with_rtype()
+        if isinstance( r_start_type, rtypes.NoneType ):
+            l_start = None
+        if isinstance( r_stop_type, rtypes.NoneType ):
+            l_stop = None
+        self.push_value( (l_start, l_stop), rtypes.SliceType() )
+        return ACTION_PROCESS_NEXT_OPCODE
+
+    def opcode_store_subscr( self, oparg ):
+        l_index = self.pop_value()
+        l_container, r_container_type = self.pop_value_with_rtype()
+        l_value = self.pop_value()
+        r_container_type = self.get_resolved_type( r_container_type )
+        if isinstance( r_container_type, rtypes.DictType ):
+            self.store_dict_item( l_container, l_index, l_value )
+            return ACTION_PROCESS_NEXT_OPCODE
+        if type(r_container_type) is rtypes.ListType:
+            self.ensure_list_writable( l_container )
+            l_item_ptr = self.get_list_item_ptr( l_container, l_index )
+            self.builder.store( self.coerce_value( l_value, l_item_ptr.type.pointee ),
+                                l_item_ptr )
+            return ACTION_PROCESS_NEXT_OPCODE
+        raise NotImplementedError( 'Subscript assignment not supported for %r' % r_container_type )
+
+    def opcode_get_iter( self, oparg ):
+        """For loops are lowered to counted loops: the iterator is a
+           LoopCounter (see opcode_for_iter()), no iterator object is created.
+        """
+        l_iterable, r_iterable_type = self.pop_value_with_rtype()
+        r_iterable_type = self.get_resolved_type( r_iterable_type )
+        l_counter_ptr = self.entry_alloca( L_INT_TYPE, 'loop_counter' )
+        if isinstance( r_iterable_type, rtypes.RangeType ):
+            l_start, l_stop, l_step = l_iterable
+            counter = LoopCounter( l_counter_ptr, l_stop, l_step )
+        elif isinstance( r_iterable_type, rtypes.DictType ):
+            l_start = L_INT_0
+            l_length = self.builder.load( get_field_ptr( self.builder, l_iterable,
+                                                         DICT_FIELD_LENGTH ) )
+            counter = LoopCounter( l_counter_ptr, None, L_INT_1, l_iterable, l_length )
+        elif isinstance( r_iterable_type, rtypes.ListType ):
+            l_start = L_INT_0
+            # The stop is evaluated on each iteration: the list may grow
+            counter = LoopCounter( l_counter_ptr, None, L_INT_1, l_iterable )
+        else:
+            raise NotImplementedError( 'Iteration not supported for %r' % r_iterable_type )
+        self.builder.store( l_start, l_counter_ptr )
+        self.push_value( counter, rtypes.IteratorType( r_iterable_type ) )
+        return ACTION_PROCESS_NEXT_OPCODE
+
+    def opcode_for_iter( self, oparg ):
+        """Tests the loop counter and branches to the loop body or to the loop
+           exit. The loop body starts by incrementing the counter, so that
+           continue statements (jump to FOR_ITER) do not need special handling.
+           Unlike CPython, the iterator is popped: the loop body only pushes
+           the item.
+        """
+        b = self.builder
+        counter, r_iterator_type = self.pop_value_with_rtype()
+        block_body = self.obtain_block_at( self.next_instr_index, self.new_id( 'for_body' ) )
+        block_body.incoming_blocks.append( self.current_block )
+        block_exit = self.obtain_block_at( self.next_instr_index + oparg,
+                                           self.new_id( 'end_for' ) )
+        block_exit.incoming_blocks.append( self.current_block )
+        r_iterable_type = r_iterator_type.iterable_type
+        if isinstance( r_iterable_type, rtypes.DictType ):
+            self.generate_dict_iteration( counter, r_iterable_type,
+                                          block_body, block_exit )
+            return ACTION_BRANCH
+        l_index = b.load( counter.l_counter_ptr )
+        if counter.l_stop is None: # list or soa
+            if isinstance( r_iterable_type, rtypes.SoAType ):
+                l_stop = self.get_soa_length( counter.l_iterable )
+            else:
+                l_stop = b.load( self.get_list_field_ptr( counter.l_iterable,
+                                                          LIST_FIELD_LENGTH ) )
+            l_continue = b.icmp( lcore.IPRED_SLT, l_index, l_stop )
+        else:
+            l_continue = b.select( b.icmp( lcore.IPRED_SGT, counter.l_step, L_INT_0 ),
+                                   b.icmp( lcore.IPRED_SLT, l_index, counter.l_stop ),
+                                   b.icmp( lcore.IPRED_SGT, l_index, counter.l_stop ) )
+        b.cbranch( l_continue, block_body.l_basic_block, block_exit.l_basic_block )
+        # The loop body is the next block processed by explore_function_opcodes()
+        b.position_at_end( block_body.l_basic_block )
+        l_next_index = b.add( l_index, counter.l_step )
+        if counter.l_stop is not None:
+            # Near the int64 bounds the add wraps: an overflow means the next
+            # index is past the stop, so the stop is stored to exit the loop.
+            l_overflow = b.xor( b.icmp( lcore.IPRED_SLT, l_next_index, l_index ),
+                                b.icmp( lcore.IPRED_SLT, counter.l_step, L_INT_0 ) )
+            l_next_index = b.select( l_overflow, counter.l_stop, l_next_index )
+        b.store( l_next_index, counter.l_counter_ptr )
+        if isinstance( r_iterable_type, rtypes.RangeType ):
+            self.push_value( l_index, rtypes.IntType() )
+        elif isinstance( r_iterable_type, rtypes.SoAType ):
+            self.push_value( self.make_soa_item( counter.l_iterable, r_iterable_type, l_index ),
+                             r_iterable_type.item_type )
+        else:
+            l_data = b.load( self.get_list_field_ptr( counter.l_iterable, LIST_FIELD_DATA ) )
+            self.push_value( b.load( b.gep( l_data, [l_index] ) ),
+                             r_iterable_type.item_type )
+        return ACTION_BRANCH
+
+    def generate_dict_iteration( self, counter, r_dict_type, block_body, block_exit ):
+        """Iterates the keys of a dict: scans the hash table entries, skipping
+           the empty ones. CPython raises RuntimeError if the size of the dict
+           changes during the iteration: the loop bails out, as inserting may
+           also reallocate the entries.
+        """
+        b = self.builder
+        l_scan_block = self.l_func.append_basic_block( self.new_id( 'dict_scan' ) )
+        l_bounds_block = self.l_func.append_basic_block( self.new_id( 'dict_same_length' ) )
+        l_check_block = self.l_func.append_basic_block( self.new_id( 'dict_check_entry' ) )
+        b.branch( l_scan_block )
+        b.position_at_end( l_scan_block )
+        l_dict = counter.l_iterable
+        l_length = b.load( get_field_ptr( b, l_dict, DICT_FIELD_LENGTH ) )
+        b.cbranch( b.icmp( lcore.IPRED_NE, l_length, counter.l_length ),
+                   self.get_deoptimize_block(), l_bounds_block )
+        b.position_at_end( l_bounds_block )
+        l_index = b.load( counter.l_counter_ptr )
+        l_capacity = b.load( get_field_ptr( b, l_dict, DICT_FIELD_CAPACITY ) )
+        b.cbranch( b.icmp( lcore.IPRED_SLT, l_index, l_capacity ),
+                   l_check_block, block_exit.l_basic_block )
+        b.position_at_end( l_check_block )
+        l_entry = b.gep( b.load( get_field_ptr( b, l_dict, DICT_FIELD_ENTRIES ) ), [l_index] )
+        b.store( b.add( l_index, L_INT_1 ), counter.l_counter_ptr )
+        l_state = b.load( get_field_ptr( b, l_entry, ENTRY_FIELD_STATE ) )
+        b.cbranch( b.icmp( lcore.IPRED_EQ, l_state,
+                           lcore.Constant.int( L_BYTE_TYPE, ENTRY_EMPTY ) ),
+                   l_scan_block, block_body.l_basic_block )
+        b.position_at_end( block_body.l_basic_block )
+        self.push_value( b.load( get_field_ptr( b, l_entry, ENTRY_FIELD_KEY ) ),
+                         r_dict_type.key_type )
+
+    def opcode_pop_top( self, oparg ):
+        self.pop_value()
+        return ACTION_PROCESS_NEXT_OPCODE
+
+    def generate_builtin_soa( self, l_arg_values, r_arg_types, r_return_type ):
+        """rpy.soa( py_class, length ): the header and the columns are
+           allocated in the arena. Columns are zero initialized.
+        """
+        b = self.builder
+        l_length = self.coerce_value( l_arg_values[1], L_INT_TYPE )
+        self.deoptimize_if( b.icmp( lcore.IPRED_SLT, l_length, L_INT_0 ),
+                            'valid_length' )
+        l_soa_type = self.module_generator.llvm_type_from_rtype( r_return_type )
+        l_soa = self.arena_allocate( l_soa_type.pointee, 'soa' )
+        b.store( l_length, b.gep( l_soa, [L_CONSTANT_0, L_CONSTANT_0] ) )
+        l_memset = self.module_generator.get_intrinsic( lcore.INTR_MEMSET, [L_INT_TYPE] )
+        l_columns = self.module_generator.get_soa_columns( r_return_type )
+        for attribute_name, l_column_index in sorted( l_columns.items() ):
+            l_column_ptr = b.gep( l_soa, [L_CONSTANT_0, l_column_index] )
+            l_item_type = l_column_ptr.type.pointee.pointee
+            l_column = self.arena_allocate( l_item_type, 'column_' + attribute_name,
+                                            l_length )
+            l_size = self.module_generator.arena.emit_size_of( b, l_item_type, l_length )
+            b.call( l_memset, [b.bitcast( l_column, L_BYTE_PTR_TYPE ),
+                               lcore.Constant.int( lcore.Type.int(8), 0 ),
+                               l_size, lcore.Constant.int( L_INDEX_TYPE, 1 )] )
+            b.store( l_column, l_column_ptr )
+        return l_soa
+
+    def make_soa_item( self, l_soa, r_soa_type, l_index ):
+        l_item_type = self.module_generator.llvm_type_from_rtype( r_soa_type.item_type )
+        l_item = self.builder.insert_value( lcore.Constant.undef( l_item_type ),
+                                            l_soa, 0 )
+        return self.builder.insert_value( l_item, l_index, 1 )
+
+    def generate_builtin_range( self, l_arg_values, r_arg_types, r_return_type ):
+        """The range is kept as a python tuple (l_start, l_stop, l_step) on the
+           value stack. It is only used by for loops, see opcode_for_iter().
+        """
+        l_arg_values = [ self.coerce_value( l_arg_value, L_INT_TYPE )
+                         for l_arg_value in l_arg_values ]
+        if len(l_arg_values) == 1:
+            return (L_INT_0, l_arg_values[0], L_INT_1)
+        if len(l_arg_values) == 2:
+            return (l_arg_values[0], l_arg_values[1], L_INT_1)
+        l_step = l_arg_values[2]
+        # range() raises ValueError
+        self.deoptimize_if( self.builder.icmp( lcore.IPRED_EQ, l_step, L_INT_0 ),
+                            'range_step_not_zero' )
+        return tuple( l_arg_values )
+
+    def get_soa_length( self, l_soa ):
+        return self.builder.load( self.builder.gep( l_soa, [L_CONSTANT_0, L_CONSTANT_0] ) )
+
+    def get_attribute_ptr( self, l_instance, r_type_instance, attribute_name ):
+        """Returns a pointer to the attribute of an instance or SoA item."""
+        r_type_instance = self.get_resolved_type( r_type_instance )
+        if isinstance( r_type_instance, rtypes.SoAItemType ):
+            l_soa = self.builder.extract_value( l_instance, 0 )
+            l_index = self.builder.extract_value( l_instance, 1 )
+            l_column_index = self.module_generator.get_soa_column_index(
+                r_type_instance.soa_type, attribute_name )
+            l_column = self.builder.load( self.builder.gep( l_soa, [L_CONSTANT_0, l_column_index] ) )
+            return self.builder.gep( l_column, [l_index] )
+        l_attribute_index = self.module_generator.get_attribute_index(
+            r_type_instance, attribute_name )
+        return self.builder.gep( l_instance, [L_CONSTANT_0, l_attribute_index] ) # gep =  getelementptr
+
+    def opcode_binary_subscr( self, oparg ):
+        l_index = self.pop_value()
+        l_container, r_container_type = self.pop_value_with_rtype()
+        r_container_type = self.get_resolved_type( r_container_type )
+        if isinstance( r_container_type, rtypes.SoAType ):
+            l_index = self.get_checked_index( l_index, self.get_soa_length( l_container ) )
+            self.push_value( self.make_soa_item( l_container, r_container_type, l_index ),
+                             r_container_type.item_type )
+            return ACTION_PROCESS_NEXT_OPCODE
+        if isinstance( r_container_type, rtypes.ListType ):
+            if isinstance( l_index, tuple ): # slice, see opcode_build_slice()
+                l_slice = self.generate_list_slice( l_container, *l_index )
+                self.push_value( l_slice, r_container_type )
+            else:
+                l_item_ptr = self.get_list_item_ptr( l_container, l_index )
+                self.push_value( self.builder.load( l_item_ptr ),
+                                 r_container_type.item_type )
+            return ACTION_PROCESS_NEXT_OPCODE
+        if isinstance( r_container_type, rtypes.BytesType ):
+            if isinstance( l_index, tuple ): # slice, see opcode_build_slice()
+                self.push_value( self.generate_bytes_slice( l_container, *l_index ),
+                                 r_container_type )
+            else:
+                l_data = self.builder.extract_value( l_container, BYTES_FIELD_DATA )
+                l_index = self.get_checked_index( l_index, self.builder.extract_value(
+                    l_container, BYTES_FIELD_LENGTH ) )
+                l_byte = self.builder.load( self.builder.gep( l_data, [l_index] ) )
+                self.push_value( self.builder.zext( l_byte, L_INT_TYPE ), rtypes.IntType() )
+            return ACTION_PROCESS_NEXT_OPCODE
+        if isinstance( r_container_type, rtypes.DictType ):
+            l_entry, l_found = self.get_dict_entry( l_container, l_index )
+            self.deoptimize_if( self.builder.not_( l_found ), 'key_found' ) # KeyError
+            self.push_value( self.builder.load( get_field_ptr( self.builder, l_entry,
+                                                               ENTRY_FIELD_VALUE ) ),
+                             r_container_type.value_type )
+            return ACTION_PROCESS_NEXT_OPCODE
+        raise NotImplementedError( 'Subscript not supported for %r' % r_container_type )
+
     def opcode_store_fast( self, oparg ):
         """Stores the local variable/parameter value in the current block.
         """
         local_var_index = oparg
         l_value = self.pop_value()
         l_local_ptr = self.locals_ptr[ local_var_index ]
+        l_value = self.coerce_value( l_value, l_local_ptr.type.pointee )
         self.builder.store( l_value, l_local_ptr )
         return ACTION_PROCESS_NEXT_OPCODE
 
@@ -561,10 +1794,24 @@ class FunctionCodeGenerator(object):
         py_code = self.py_func.__code__
         attribute_name = py_code.co_names[oparg]
         l_instance_ptr, r_type_instance = self.pop_value_with_rtype()
-        l_attribute_index = self.module_generator.get_attribute_index(
-            r_type_instance, attribute_name )
-        l_attribute_ptr = self.builder.gep( l_instance_ptr, [L_CONSTANT_0, l_attribute_index] ) # gep =  getelementptr
-        l_attribute_value = self.builder.load( l_attribute_ptr )
+        if isinstance( self.get_resolved_type( r_type_instance ), rtypes.ModuleType ):
+            r_type_attribute = r_type_instance.get_instance_attribute_type(
+                self.module_generator.type_registry, attribute_name )
+            py_value = getattr( r_type_instance.get_module_object(), attribute_name )
+            l_attribute_value, _ = self.py_value_as_llvm_value( py_value, r_type_attribute )
+            self.push_value( l_attribute_value, r_type_attribute )
+            return ACTION_PROCESS_NEXT_OPCODE
+        r_type_resolved = self.get_resolved_type( r_type_instance )
+        if type(r_type_resolved) in (rtypes.ListType, rtypes.DictType, rtypes.BytesType,
+                                     rtypes.NativeInstanceType): # method, see opcode_call_function
+            r_type_method = r_type_resolved.get_instance_attribute_type(
+                self.module_generator.type_registry, attribute_name )
+            self.push_value( l_instance_ptr, r_type_method )
+            return ACTION_PROCESS_NEXT_OPCODE
+        l_attribute_ptr = self.get_attribute_ptr( l_instance_ptr, r_type_instance,
+                                                  attribute_name )
+        l_attribute_value = self.widen_field_value( self.builder.load( l_attribute_ptr ),
+                                                    r_type_resolved, attribute_name )
         r_type_attribute = r_type_instance.get_known_attribute_type( attribute_name )
         self.push_value( l_attribute_value, r_type_attribute )
         return ACTION_PROCESS_NEXT_OPCODE
@@ -574,8 +1821,10 @@ class FunctionCodeGenerator(object):
         attribute_name = py_code.co_names[oparg]
         l_instance_ptr, r_type_instance = self.pop_value_with_rtype()
         l_attribute_value = self.pop_value()
-        l_attribute_index = self.module_generator.get_attribute_index( r_type_instance, attribute_name )
-        l_attribute_ptr = self.builder.gep( l_instance_ptr, [L_CONSTANT_0, l_attribute_index] ) # gep =  getelementptr
+        l_attribute_ptr = self.get_attribute_ptr( l_instance_ptr, r_type_instance,
+                                                  attribute_name )
+        l_attribute_value = self.coerce_value( l_attribute_value,
+                                               l_attribute_ptr.type.pointee )
         self.builder.store( l_attribute_value, l_attribute_ptr )
         return ACTION_PROCESS_NEXT_OPCODE
 
@@ -590,42 +1839,227 @@ class FunctionCodeGenerator(object):
             # Python generated code allow constuctor to return value. RPython does not allow this.
             self.builder.ret_void()
         else:
-            self.builder.ret( l_value )
+            self.builder.ret( self.coerce_value( l_value,
+                                                 self.l_func_type.return_type ) )
         return ACTION_BRANCH
 
     def opcode_binary_add( self, oparg ):
-        return self.generic_binary_op( self.builder.add )
+        return self.generic_binary_op(
+            self.make_checked_int_op( lcore.INTR_SADD_WITH_OVERFLOW ),
+            self.builder.fadd )
 
     def opcode_binary_subtract( self, oparg ):
-        return self.generic_binary_op( self.builder.sub )
+        return self.generic_binary_op(
+            self.make_checked_int_op( lcore.INTR_SSUB_WITH_OVERFLOW ),
+            self.builder.fsub )
 
     def opcode_binary_multiply( self, oparg ):
-        return self.generic_binary_op( self.builder.mul )
+        return self.generic_binary_op(
+            self.make_checked_int_op( lcore.INTR_SMUL_WITH_OVERFLOW ),
+            self.builder.fmul )
 
     def opcode_binary_floor_divide( self, oparg ):
-        return self.generic_binary_op( self.builder.sdiv )
+        return self.generic_binary_op( self.make_int_division( want_quotient=True ),
+                                       self.float_floor_division )
 
     def opcode_binary_modulo( self, oparg ):
-        return self.generic_binary_op( self.builder.srem )
+        return self.generic_binary_op( self.make_int_division( want_quotient=False ),
+                                       self.float_modulo )
+
+    def opcode_binary_true_divide( self, oparg ):
+        # Notes: the result is always a float, even for int operands
+        return self.generic_binary_op( None, self.float_true_division )
 
     opcode_inplace_add = opcode_binary_add
     opcode_inplace_subtract = opcode_binary_subtract
     opcode_inplace_multiply = opcode_binary_multiply
     opcode_inplace_floor_divide = opcode_binary_floor_divide
     opcode_inplace_modulo = opcode_binary_modulo
+    opcode_inplace_true_divide = opcode_binary_true_divide
 
-    def generic_binary_op( self, value_factory ):
-        l_value_rhs, rtype_rhs = self.pop_value_with_rtype()
-        l_value_lhs, rtype_lhs = self.pop_value_with_rtype()
-        l_value = value_factory( l_value_lhs, l_value_rhs )
-        self.push_value( l_value, rtype_lhs )
+    def generic_binary_op( self, int_value_factory, float_value_factory ):
+        """Generates an arithmetic operation. Operands are promoted following
+           python rules: bool -> int -> float. int_value_factory is None if
+           the operation always produces a float.
+        """
+        l_value_rhs = self.pop_value()
+        l_value_lhs = self.pop_value()
+        if (int_value_factory is None or
+            L_DOUBLE_TYPE in (l_value_lhs.type, l_value_rhs.type)):
+            l_value = float_value_factory(
+                self.coerce_value( l_value_lhs, L_DOUBLE_TYPE ),
+                self.coerce_value( l_value_rhs, L_DOUBLE_TYPE ) )
+            r_type = rtypes.FloatType()
+        else:
+            l_value = int_value_factory(
+                self.coerce_value( l_value_lhs, L_INT_TYPE ),
+                self.coerce_value( l_value_rhs, L_INT_TYPE ) )
+            r_type = rtypes.IntType()
+        self.push_value( l_value, r_type )
         return ACTION_PROCESS_NEXT_OPCODE
 
+    def widen_field_value( self, l_value, r_type_instance, attribute_name ):
+        """Converts the value of a narrow ctypes.Structure field (e.g. c_int32,
+           c_float) into the representation of its rtype.
+        """
+        l_type = l_value.type
+        unsigned = (l_type.kind == lcore.TYPE_INTEGER and l_type.width not in (1, 64) and
+                    attribute_name in r_type_instance.class_type.unsigned_fields)
+        return self.widen_native_value( l_value, unsigned )
+
+    def widen_native_value( self, l_value, unsigned ):
+        """Converts a float or narrow integer C value into a double or an int
+           (zero-extended if unsigned).
+        """
+        l_type = l_value.type
+        if l_type.kind == lcore.TYPE_FLOAT:
+            return self.builder.fpext( l_value, L_DOUBLE_TYPE )
+        if l_type.kind == lcore.TYPE_INTEGER and l_type.width not in (1, 64):
+            if unsigned:
+                return self.builder.zext( l_value, L_INT_TYPE )
+            return self.builder.sext( l_value, L_INT_TYPE )
+        return l_value
+
+    def coerce_value( self, l_value, l_target_type ):
+        """Converts a value to the target type following python numeric
+           promotion (bool -> int -> float). Other values are returned as is.
+           Values stored in a narrow ctypes.Structure field are truncated like
+           ctypes does.
+        """
+        l_type = l_value.type
+        if l_type == l_target_type:
+            return l_value
+        if l_target_type.kind == lcore.TYPE_FLOAT:
+            return self.builder.fptrunc( self.coerce_value( l_value, L_DOUBLE_TYPE ),
+                                         l_target_type )
+        if (l_target_type.kind == lcore.TYPE_INTEGER and l_target_type != L_BOOL_TYPE and
+            l_target_type.width < 64):
+            return self.builder.trunc( self.coerce_value( l_value, L_INT_TYPE ),
+                                       l_target_type )
+        if l_target_type == L_INT_TYPE and l_type == L_BOOL_TYPE:
+            return self.builder.zext( l_value, L_INT_TYPE )
+        if l_target_type == L_DOUBLE_TYPE:
+            if l_type == L_BOOL_TYPE:
+                return self.builder.uitofp( l_value, L_DOUBLE_TYPE )
+            if l_type == L_INT_TYPE:
+                return self.builder.sitofp( l_value, L_DOUBLE_TYPE )
+        return l_value
+
+    def make_checked_int_op( self, intrinsic_id ):
+        """Returns a factory generating an integer operation with an
+           overflow-checking intrinsic. On overflow python would produce a big
+           int: the native code bails out.
+        """
+        def value_factory( l_value_lhs, l_value_rhs ):
+            l_intrinsic = self.module_generator.get_intrinsic( intrinsic_id,
+                                                               [L_INT_TYPE] )
+            l_result = self.builder.call( l_intrinsic, [l_value_lhs, l_value_rhs] )
+            l_overflow = self.builder.extract_value( l_result, 1 )
+            self.deoptimize_if( l_overflow, 'no_overflow' )
+            return self.builder.extract_value( l_result, 0 )
+        return value_factory
+
+    def make_int_division( self, want_quotient ):
+        """Returns a factory generating an integer floor division or modulo
+           with python semantic: the quotient is rounded toward negative
+           infinity, and the remainder has the sign of the divisor.
+           Division by zero and INT_MIN // -1 bail out.
+        """
+        def value_factory( l_value_lhs, l_value_rhs ):
+            b = self.builder
+            l_by_zero = b.icmp( lcore.IPRED_EQ, l_value_rhs, L_INT_0 )
+            l_overflow = b.and_( b.icmp( lcore.IPRED_EQ, l_value_lhs, L_INT_MIN ),
+                                 b.icmp( lcore.IPRED_EQ, l_value_rhs, L_INT_MINUS_1 ) )
+            self.deoptimize_if( b.or_( l_by_zero, l_overflow ), 'valid_division' )
+            l_quotient = b.sdiv( l_value_lhs, l_value_rhs )
+            l_remainder = b.srem( l_value_lhs, l_value_rhs )
+            # C division truncates toward zero: adjust if the remainder is not
+            # zero and does not have the sign of the divisor.
+            l_adjust = b.and_(
+                b.icmp( lcore.IPRED_NE, l_remainder, L_INT_0 ),
+                b.icmp( lcore.IPRED_SLT, b.xor( l_remainder, l_value_rhs ), L_INT_0 ) )
+            if want_quotient:
+                return b.select( l_adjust, b.sub( l_quotient, L_INT_1 ), l_quotient )
+            return b.select( l_adjust, b.add( l_remainder, l_value_rhs ), l_remainder )
+        return value_factory
+
+    def deoptimize_if_float_zero( self, l_value ):
+        """Python raises ZeroDivisionError: let CPython do it."""
+        l_is_zero = self.builder.fcmp( lcore.FPRED_OEQ, l_value, L_DOUBLE_0 )
+        self.deoptimize_if( l_is_zero, 'not_zero' )
+
+    def float_true_division( self, l_value_lhs, l_value_rhs ):
+        self.deoptimize_if_float_zero( l_value_rhs )
+        return self.builder.fdiv( l_value_lhs, l_value_rhs )
+
+    def float_divmod_adjustment( self, l_value_lhs, l_value_rhs ):
+        """Returns a tuple (l_mod, l_adjust) where l_mod is the C remainder
+           (fmod) and l_adjust is true if the remainder does not have the sign
+           of the divisor, as python requires.
+        """
+        b = self.builder
+        l_mod = b.frem( l_value_lhs, l_value_rhs )
+        l_adjust = b.and_(
+            b.fcmp( lcore.FPRED_ONE, l_mod, L_DOUBLE_0 ),
+            b.icmp( lcore.IPRED_NE,
+                    b.fcmp( lcore.FPRED_OLT, l_value_rhs, L_DOUBLE_0 ),
+                    b.fcmp( lcore.FPRED_OLT, l_mod, L_DOUBLE_0 ) ) )
+        return l_mod, l_adjust
+
+    def float_modulo( self, l_value_lhs, l_value_rhs ):
+        self.deoptimize_if_float_zero( l_value_rhs )
+        if self.fast_math:
+            return self.builder.frem( l_value_lhs, l_value_rhs )
+        b = self.builder
+        l_mod, l_adjust = self.float_divmod_adjustment( l_value_lhs, l_value_rhs )
+        return b.select( l_adjust, b.fadd( l_mod, l_value_rhs ), l_mod )
+
+    def float_floor_division( self, l_value_lhs, l_value_rhs ):
+        self.deoptimize_if_float_zero( l_value_rhs )
+        b = self.builder
+        l_floor = self.module_generator.get_external_function(
+            'floor', lcore.Type.function( L_DOUBLE_TYPE, [L_DOUBLE_TYPE] ) )
+        if self.fast_math:
+            return b.call( l_floor, [b.fdiv( l_value_lhs, l_value_rhs )] )
+        # Same algorithm as CPython float_divmod()
+        l_mod, l_adjust = self.float_divmod_adjustment( l_value_lhs, l_value_rhs )
+        l_div = b.fdiv( b.fsub( l_value_lhs, l_mod ), l_value_rhs )
+        l_div = b.select( l_adjust, b.fsub( l_div, L_DOUBLE_1 ), l_div )
+        l_floor_div = b.call( l_floor, [l_div] )
+        l_round_up = b.fcmp( lcore.FPRED_OGT, b.fsub( l_div, l_floor_div ),
+                             L_DOUBLE_HALF )
+        return b.select( l_round_up, b.fadd( l_floor_div, L_DOUBLE_1 ), l_floor_div )
+
     def opcode_compare_op( self, oparg ):
-        l_value_rhs, rtype_rhs = self.pop_value_with_rtype()
-        l_value_lhs, rtype_lhs = self.pop_value_with_rtype()
-        ipred = _PY_CMP_AS_LLVM[oparg]
-        l_value = self.builder.icmp( ipred, l_value_lhs, l_value_rhs )
+        l_value_rhs, r_type_rhs = self.pop_value_with_rtype()
+        l_value_lhs = self.pop_value()
+        if oparg in (CMP_IN, CMP_NOT_IN):
+            r_type_rhs = self.get_resolved_type( r_type_rhs )
+            if not isinstance( r_type_rhs, (rtypes.DictType, rtypes.BytesType) ):
+                raise NotImplementedError( 'Operator in not supported for %r' % r_type_rhs )
+            if isinstance( r_type_rhs, rtypes.BytesType ): # sub in bytes
+                l_position = self.generate_builtin_bytes_find(
+                    [l_value_rhs, l_value_lhs], None, None )
+                l_value = self.builder.icmp( lcore.IPRED_SGE, l_position, L_INT_0 )
+            else:
+                l_entry, l_value = self.get_dict_entry( l_value_rhs, l_value_lhs )
+            if oparg == CMP_NOT_IN:
+                l_value = self.builder.not_( l_value )
+        elif l_value_lhs.type == L_BYTES_TYPE and l_value_rhs.type == L_BYTES_TYPE:
+            l_compare = self.module_generator.bytes_runtime.emit_compare(
+                self.builder, l_value_lhs, l_value_rhs )
+            l_value = self.builder.icmp( _PY_CMP_AS_LLVM[oparg], l_compare, L_INT_0 )
+        elif L_DOUBLE_TYPE in (l_value_lhs.type, l_value_rhs.type):
+            fpred = _PY_CMP_AS_LLVM_REAL[oparg]
+            l_value = self.builder.fcmp( fpred,
+                self.coerce_value( l_value_lhs, L_DOUBLE_TYPE ),
+                self.coerce_value( l_value_rhs, L_DOUBLE_TYPE ) )
+        else:
+            # Notes: bool are compared as int as i1 true is -1 with signed predicate
+            ipred = _PY_CMP_AS_LLVM[oparg]
+            l_value = self.builder.icmp( ipred,
+                self.coerce_value( l_value_lhs, L_INT_TYPE ),
+                self.coerce_value( l_value_rhs, L_INT_TYPE ) )
         self.push_value( l_value, rtypes.BoolType() )
         return ACTION_PROCESS_NEXT_OPCODE
 
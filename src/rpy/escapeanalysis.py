@@ -0,0 +1,268 @@
+"""Escape analysis of the instances created by the compiled call graph.
+
+An instance escapes the function that creates it if it may be referenced
+after the function returns: it is returned, stored into another object or
+passed to a function that lets its parameter escape. Instances that do not
+escape are allocated on the stack of the function that creates them (and
+usually scalar-replaced by the LLVM optimizer), others on the heap.
+
+The analysis is flow-insensitive: each value on the evaluation stack and each
+local variable is abstracted as the set of its possible sources:
+- (SOURCE_PARAM, param_index): a function parameter,
+- (SOURCE_ALLOC, opcode_index): the instance created by a constructor call.
+The parameter escape summaries of all the functions of the call graph are
+computed together until a fixed point is reached.
+"""
+import dis
+from rpy.opcodedecoder import make_opcode_functions_map, opcode_decoder, opname
+
+SOURCE_PARAM = 'param'
+SOURCE_ALLOC = 'alloc'
+
+ALLOC_STACK = 'stack'
+ALLOC_HEAP = 'heap'
+
+_NO_SOURCE = frozenset()
+
+class StackValue(object):
+    """Abstract value of the evaluation stack.
+       py_object is the python object for global loaded values (used to
+       identify the callee of a call), None otherwise.
+    """
+    def __init__( self, sources=_NO_SOURCE, py_object=None ):
+        self.sources = frozenset( sources )
+        self.py_object = py_object
+
+class FunctionEscapeAnalyzer(object):
+    def __init__( self, py_func, escape_analysis ):
+        self.py_func = py_func
+        self.escape_analysis = escape_analysis
+        self.func_code = py_func.__code__
+        self.local_sources = {} # dict {local_var_index: set(source)}
+        for index in range(0, self.func_code.co_argcount):
+            self.local_sources[index] = set( [(SOURCE_PARAM, index)] )
+        self.escaped = set() # set(source)
+        self.passed_as_argument = set() # set(source)
+        self.allocation_sites = {} # dict {opcode_index: py_class}
+        self.loop_ranges = [] # list of (start_index, end_index)
+        self.stack = []
+        self.current_opcode_index = 0
+
+    def analyze( self ):
+        """Scans the function bytecode until the local variable sources are
+           stable. Returns True if the set of escaping sources changed.
+        """
+        escaped_count = len(self.escaped)
+        while True:
+            local_source_count = sum( len(sources) for sources in
+                                      self.local_sources.values() )
+            self._scan_opcodes()
+            if local_source_count == sum( len(sources) for sources in
+                                          self.local_sources.values() ):
+                break
+        return escaped_count != len(self.escaped)
+
+    def _scan_opcodes( self ):
+        co_code = self.func_code.co_code
+        self.stack = []
+        self.loop_ranges = []
+        next_instr = 0
+        while next_instr < len(co_code):
+            self.current_opcode_index = next_instr
+            next_instr, opcode, oparg = opcode_decoder( co_code, next_instr )
+            self.next_instr_index = next_instr
+            handler = ESCAPE_ANALYZER_OPCODE_FUNCTIONS.get( opcode )
+            if handler is None:
+                self.generic_unknown_opcode( opcode, oparg )
+            else:
+                handler( self, oparg )
+
+    def param_escapes( self, param_index ):
+        return (SOURCE_PARAM, param_index) in self.escaped
+
+    def get_allocation_strategy( self, opcode_index ):
+        """Returns ALLOC_STACK or ALLOC_HEAP for the instance created by the
+           constructor call at opcode_index.
+        """
+        source = (SOURCE_ALLOC, opcode_index)
+        if source in self.escaped:
+            return ALLOC_HEAP
+        if self._is_in_loop( opcode_index ):
+            # The stack slot is reused by each iteration: the previous
+            # instance must be unreachable when the new one is created.
+            holders = [ sources for sources in self.local_sources.values()
+                        if source in sources ]
+            if (len(holders) > 1 or (holders and holders[0] != set([source])) or
+                source in self.passed_as_argument):
+                return ALLOC_HEAP
+        return ALLOC_STACK
+
+    def _is_in_loop( self, opcode_index ):
+        for start_index, end_index in self.loop_ranges:
+            if start_index <= opcode_index < end_index:
+                return True
+        return False
+
+    def push( self, sources=_NO_SOURCE, py_object=None ):
+        self.stack.append( StackValue( sources, py_object ) )
+
+    def pop( self ):
+        return self.stack.pop()
+
+    def pop_n( self, n ):
+        if n == 0:
+            return []
+        values = self.stack[-n:]
+        del self.stack[-n:]
+        return values
+
+    def escape( self, sources ):
+        self.escaped.update( sources )
+
+    def generic_unknown_opcode( self, opcode, oparg ):
+        """Conservative handling: all the values on the stack escape."""
+        for value in self.stack:
+            self.escape( value.sources )
+        try:
+            stack_effect = dis.stack_effect( opcode, oparg if opcode >= dis.HAVE_ARGUMENT else None )
+        except ValueError:
+            raise ValueError( 'Escape analysis: unsupported opcode %s' % opname[opcode] )
+        if stack_effect < 0:
+            self.pop_n( -stack_effect )
+        for index in range(0, stack_effect):
+            self.push()
+
+    def opcode_load_fast( self, oparg ):
+        self.push( self.local_sources.get( oparg, _NO_SOURCE ) )
+
+    def opcode_store_fast( self, oparg ):
+        self.local_sources.setdefault( oparg, set() ).update( self.pop().sources )
+
+    def opcode_load_const( self, oparg ):
+        self.push()
+
+    def opcode_load_global( self, oparg ):
+        global_var_name = self.func_code.co_names[oparg]
+        self.push( py_object=self.py_func.__globals__.get( global_var_name ) )
+
+    def opcode_load_attr( self, oparg ):
+        self.pop()
+        # Objects stored into attributes have already escaped
+        self.push()
+
+    def opcode_store_attr( self, oparg ):
+        self.pop()
+        self.escape( self.pop().sources )
+
+    def opcode_pop_top( self, oparg ):
+        self.pop()
+
+    def opcode_return_value( self, oparg ):
+        self.escape( self.pop().sources )
+
+    def opcode_call_function( self, oparg ):
+        nb_arg = oparg & 0xff
+        nb_kw = (oparg >> 8) & 0xff
+        values = self.pop_n( nb_arg + 2 * nb_kw )
+        callee = self.pop().py_object
+        arg_values = values[:nb_arg]
+        if nb_kw or callee is None:
+            for value in values:
+                self.escape( value.sources )
+            self.push()
+            return
+        if isinstance( callee, type ) and callee.__module__ != 'builtins': # constructor call
+            py_func = callee.__init__
+            first_param_index = 1
+            source = (SOURCE_ALLOC, self.current_opcode_index)
+            self.allocation_sites[self.current_opcode_index] = callee
+            if self.escape_analysis.param_escapes( py_func, 0 ): # self escapes
+                self.escape( [source] )
+            result_sources = [source]
+        else:
+            py_func = callee
+            first_param_index = 0
+            result_sources = _NO_SOURCE
+        for index, value in enumerate( arg_values ):
+            self.passed_as_argument.update( value.sources )
+            if self.escape_analysis.param_escapes( py_func,
+                                                   first_param_index + index ):
+                self.escape( value.sources )
+        self.push( result_sources )
+
+    def opcode_get_iter( self, oparg ):
+        self.pop()
+        self.push()
+
+    def opcode_for_iter( self, oparg ):
+        # Lowered to a counted loop, see FunctionCodeGenerator.opcode_for_iter()
+        self.pop()
+        self.push()
+
+    def generic_binary_op( self, oparg ):
+        self.pop_n( 2 )
+        self.push()
+
+    opcode_binary_add = generic_binary_op
+    opcode_binary_subtract = generic_binary_op
+    opcode_binary_multiply = generic_binary_op
+    opcode_binary_floor_divide = generic_binary_op
+    opcode_binary_modulo = generic_binary_op
+    opcode_binary_true_divide = generic_binary_op
+    opcode_inplace_add = generic_binary_op
+    opcode_inplace_subtract = generic_binary_op
+    opcode_inplace_multiply = generic_binary_op
+    opcode_inplace_floor_divide = generic_binary_op
+    opcode_inplace_modulo = generic_binary_op
+    opcode_inplace_true_divide = generic_binary_op
+    opcode_compare_op = generic_binary_op
+
+    def opcode_pop_jump_if_false( self, oparg ):
+        self.pop()
+
+    opcode_pop_jump_if_true = opcode_pop_jump_if_false
+
+    def opcode_setup_loop( self, oparg ):
+        self.loop_ranges.append( (self.current_opcode_index,
+                                  self.next_instr_index + oparg) )
+
+    def opcode_jump_forward( self, oparg ):
+        pass
+
+    opcode_jump_absolute = opcode_jump_forward
+    opcode_pop_block = opcode_jump_forward
+    opcode_break_loop = opcode_jump_forward
+
+ESCAPE_ANALYZER_OPCODE_FUNCTIONS = make_opcode_functions_map( FunctionEscapeAnalyzer )
+
+class EscapeAnalysis(object):
+    """Escape analysis of a set of python functions (the annotated call graph).
+    """
+    def __init__( self, py_funcs ):
+        self._analyzers = {} # dict {py_func: FunctionEscapeAnalyzer}
+        for py_func in py_funcs:
+            self._analyzers[py_func] = FunctionEscapeAnalyzer( py_func, self )
+
+    def run( self ):
+        """Analyzes all functions until the escape summaries are stable."""
+        changed = True
+        while changed:
+            changed = False
+            for analyzer in self._analyzers.values():
+                if analyzer.analyze():
+                    changed = True
+
+    def param_escapes( self, py_func, param_index ):
+        """Returns True if the parameter of py_func may escape. Parameters of
+           functions outside of the call graph are assumed to escape.
+        """
+        analyzer = self._analyzers.get( py_func )
+        if analyzer is None:
+            return True
+        return analyzer.param_escapes( param_index )
+
+    def get_allocation_strategy( self, py_func, opcode_index ):
+        """Returns ALLOC_STACK or ALLOC_HEAP for the instance created by the
+           constructor call at opcode_index in py_func.
+        """
+        return self._analyzers[py_func].get_allocation_strategy( opcode_index )
@@ -0,0 +1,163 @@
+"""Declarations of C functions callable from compiled code.
+
+A python stub is bound to a C symbol, with the parameter and return types
+annotated like the methods of rpybuiltin.builtin:
+
+    @rpy.foreign( library='libm.so.6', return_type=float,
+                  parameter_types={'x': float} )
+    def cbrt(x):
+        pass
+
+    def main(n):
+        return cbrt( n * 1.0 )
+
+The compiled code calls the C function directly through its address, with
+native argument types (no ctypes marshalling). The types are python types
+(int: int64_t, float: double, bool, None for a void return) or ctypes
+scalar types (c_int32, c_uint32, c_float, c_size_t...) converted from and
+to the rpy int/float values like the fields of a ctypes.Structure. A bytes
+parameter passes the address of the data of the value (not NUL terminated).
+Notes: int is int64_t, not the C int: a C int parameter or return value
+must be declared as c_int32, otherwise the upper 32 bits are undefined.
+
+Called from python (e.g. when the caller is executed by CPython), the
+function is called through ctypes.
+"""
+import ctypes
+import ctypes.util
+import functools
+import threading
+
+# Python types accepted in the declarations: ctypes type
+_PY_TYPE_CTYPES = {
+    int: ctypes.c_int64,
+    float: ctypes.c_double,
+    bool: ctypes.c_bool
+    }
+
+# ctypes accepted in the declarations: python type of the values
+_CTYPES_PY_TYPES = {
+    ctypes.c_int8: int,
+    ctypes.c_int16: int,
+    ctypes.c_int32: int,
+    ctypes.c_int64: int,
+    ctypes.c_uint8: int,
+    ctypes.c_uint16: int,
+    ctypes.c_uint32: int,
+    ctypes.c_uint64: int, # sizes, values above 2**63 are not supported
+    ctypes.c_bool: bool,
+    ctypes.c_float: float,
+    ctypes.c_double: float
+    }
+_UNSIGNED_CTYPES = (ctypes.c_uint8, ctypes.c_uint16, ctypes.c_uint32, ctypes.c_uint64)
+
+_libraries_lock = threading.Lock()
+_libraries = {} # dict {library name: ctypes.CDLL}
+
+def foreign( symbol=None, library=None, return_type=None, parameter_types=None ):
+    """Decorator binding a python stub to the C function symbol (the name of
+       the stub by default) of library (a path or a name passed to
+       ctypes.util.find_library; the libraries already loaded by the process
+       if None). return_type and parameter_types (a dict {name: type}) default
+       to the rpy_return_type and rpy_parameter_types attributes of the stub.
+       Returns a ForeignFunction.
+    """
+    def decorator( py_stub ):
+        return ForeignFunction( py_stub, symbol or py_stub.__name__, library,
+                                return_type, parameter_types )
+    return decorator
+
+def _get_ctype( py_type, declaration ):
+    """Returns the ctypes type of a declared type: a ctypes type, bytes for
+       a bytes parameter or None for a void return type.
+    """
+    if py_type is None or py_type is type(None):
+        return None
+    if py_type is bytes or py_type in _CTYPES_PY_TYPES:
+        return py_type
+    if py_type in _PY_TYPE_CTYPES:
+        return _PY_TYPE_CTYPES[py_type]
+    raise ValueError( 'Unsupported type for %s: %r' % (declaration, py_type) )
+
+def _load_library( library ):
+    with _libraries_lock:
+        cdll = _libraries.get( library )
+        if cdll is None:
+            if library is None:
+                cdll = ctypes.CDLL( None )
+            else:
+                path = library
+                if '/' not in library and '.' not in library:
+                    path = ctypes.util.find_library( library ) or library
+                cdll = ctypes.CDLL( path )
+            _libraries[library] = cdll
+        return cdll
+
+class ForeignFunction(object):
+    """A C function declared with foreign(). argtypes are the ctypes of the
+       parameters in order (bytes for a bytes parameter), restype the ctypes
+       of the returned value (None if void).
+    """
+    def __init__( self, py_stub, symbol, library=None, return_type=None,
+                  parameter_types=None ):
+        if return_type is None:
+            return_type = getattr( py_stub, 'rpy_return_type', None )
+        if parameter_types is None:
+            parameter_types = getattr( py_stub, 'rpy_parameter_types', {} )
+        code = py_stub.__code__
+        self.param_names = code.co_varnames[:code.co_argcount]
+        if set( parameter_types ) != set( self.param_names ):
+            raise ValueError( 'The types of the parameters of %s must be declared: %r' %
+                              (symbol, self.param_names) )
+        self.py_stub = py_stub
+        self.symbol = symbol
+        self.library = library
+        self.argtypes = [ _get_ctype( parameter_types[name], '%s parameter %s' % (symbol, name) )
+                          for name in self.param_names ]
+        if None in self.argtypes:
+            raise ValueError( 'Parameters of %s can not be None' % symbol )
+        self.restype = _get_ctype( return_type, '%s return value' % symbol )
+        if self.restype is bytes:
+            raise ValueError( 'Return type of %s can not be bytes' % symbol )
+        py_stub.rpy_return_type = return_type
+        py_stub.rpy_parameter_types = parameter_types
+        self._c_function = None # created by get_c_function()
+        functools.update_wrapper( self, py_stub )
+
+    def get_c_function( self ):
+        """Returns the ctypes function. Loads the library and resolves the
+           symbol on first call, raises AttributeError if it is not found.
+        """
+        if self._c_function is None:
+            c_function = getattr( _load_library( self.library ), self.symbol )
+            c_function.argtypes = [ ctypes.c_char_p if ctype is bytes else ctype
+                                    for ctype in self.argtypes ]
+            c_function.restype = self.restype
+            self._c_function = c_function
+        return self._c_function
+
+    def get_address( self ):
+        """Returns the address of the C function."""
+        return ctypes.cast( self.get_c_function(), ctypes.c_void_p ).value
+
+    def is_unsigned_return( self ):
+        return self.restype in _UNSIGNED_CTYPES
+
+    def get_return_py_type( self ):
+        """Returns the python type of the returned values, None if void."""
+        if self.restype is None:
+            return None
+        return _CTYPES_PY_TYPES[self.restype]
+
+    def get_parameter_py_types( self ):
+        return [ bytes if ctype is bytes else _CTYPES_PY_TYPES[ctype]
+                 for ctype in self.argtypes ]
+
+    def __call__( self, *args ):
+        if len(args) != len(self.argtypes):
+            raise TypeError( '%s() takes exactly %d arguments (%d given)' %
+                             (self.symbol, len(self.argtypes), len(args)) )
+        return self.get_c_function()( *args )
+
+    def __repr__( self ):
+        return '<foreign function %s>' % self.symbol
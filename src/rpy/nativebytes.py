@@ -0,0 +1,214 @@
+"""Native representation of str and bytes.
+
+str and bytes values are first class structures { i8* data, i64 length }.
+str are UTF-8 encoded: comparing their bytes compares their code points.
+Slicing a bytes creates a view on the same data: the data of a value is never
+modified by the compiled code, so views can not be distinguished from copies.
+
+Entry point bytes parameters accept any object supporting the buffer protocol
+with a contiguous buffer (bytes, bytearray, memoryview, mmap...). The data
+pointer is the buffer of the object: the object is not copied. The buffer is
+held (the object can not be resized) until the call returns. If the call
+is re-executed by CPython, the python function receives a bytes copy of the
+buffer, see BytesArgument.to_python().
+
+The search and comparison functions are emitted as LLVM IR in each compiled
+module, see BytesRuntime.
+"""
+import ctypes
+import llvm.core as lcore
+
+FN_BYTES_COMPARE = 'rpy_bytes_compare'
+FN_BYTES_FIND = 'rpy_bytes_find'
+
+L_BYTE_TYPE = lcore.Type.int(8)
+L_BYTE_PTR_TYPE = lcore.Type.pointer( L_BYTE_TYPE )
+L_SIZE_TYPE = lcore.Type.int(64)
+L_C_INT_TYPE = lcore.Type.int(32)
+# Representation of str and bytes: { i8* data, i64 length }
+L_BYTES_TYPE = lcore.Type.struct( [L_BYTE_PTR_TYPE, L_SIZE_TYPE] )
+
+BYTES_FIELD_DATA = 0
+BYTES_FIELD_LENGTH = 1
+
+def _size( size ):
+    return lcore.Constant.int( L_SIZE_TYPE, size )
+
+L_NULL_BYTE_PTR = lcore.Constant.null( L_BYTE_PTR_TYPE )
+L_C_INT_0 = lcore.Constant.int( L_C_INT_TYPE, 0 )
+
+class BytesRuntime(object):
+    """Declares the functions operating on str and bytes in a LLVM module.
+    """
+    def __init__( self, l_module ):
+        self.l_module = l_module
+        self.l_memcmp = l_module.get_or_insert_function(
+            lcore.Type.function( L_C_INT_TYPE, [L_BYTE_PTR_TYPE, L_BYTE_PTR_TYPE, L_SIZE_TYPE] ),
+            'memcmp' )
+        self.l_memchr = l_module.get_or_insert_function(
+            lcore.Type.function( L_BYTE_PTR_TYPE, [L_BYTE_PTR_TYPE, L_C_INT_TYPE, L_SIZE_TYPE] ),
+            'memchr' )
+        self.l_compare = self._declare_compare()
+        self.l_find = self._declare_find()
+
+    def _declare_compare( self ):
+        """i64 rpy_bytes_compare( i8* a, i64 a_length, i8* b, i64 b_length ):
+           returns a negative value if a < b, 0 if a == b, a positive value
+           otherwise (lexicographic order of the bytes).
+        """
+        l_func = self.l_module.add_function(
+            lcore.Type.function( L_SIZE_TYPE, [L_BYTE_PTR_TYPE, L_SIZE_TYPE,
+                                               L_BYTE_PTR_TYPE, L_SIZE_TYPE] ),
+            FN_BYTES_COMPARE )
+        l_a, l_a_length, l_b, l_b_length = l_func.args
+        l_entry_block = l_func.append_basic_block( 'entry' )
+        l_different_block = l_func.append_basic_block( 'different' )
+        l_prefix_block = l_func.append_basic_block( 'same_prefix' )
+        builder = lcore.Builder.new( l_entry_block )
+        l_length = builder.select( builder.icmp( lcore.IPRED_SLT, l_a_length, l_b_length ),
+                                   l_a_length, l_b_length )
+        l_compare = builder.call( self.l_memcmp, [l_a, l_b, l_length] )
+        builder.cbranch( builder.icmp( lcore.IPRED_EQ, l_compare, L_C_INT_0 ),
+                         l_prefix_block, l_different_block )
+        builder.position_at_end( l_different_block )
+        builder.ret( builder.sext( l_compare, L_SIZE_TYPE ) )
+        builder.position_at_end( l_prefix_block )
+        # The shortest is the smallest
+        builder.ret( builder.sub( l_a_length, l_b_length ) )
+        return l_func
+
+    def _declare_find( self ):
+        """i64 rpy_bytes_find( i8* data, i64 length, i8* sub, i64 sub_length,
+                                i64 start ): returns the index of the first
+           occurrence of sub at or after start (a non negative index), -1 if
+           not found. Candidates are located with memchr() on the first byte
+           of sub.
+        """
+        l_func = self.l_module.add_function(
+            lcore.Type.function( L_SIZE_TYPE, [L_BYTE_PTR_TYPE, L_SIZE_TYPE,
+                                               L_BYTE_PTR_TYPE, L_SIZE_TYPE, L_SIZE_TYPE] ),
+            FN_BYTES_FIND )
+        l_data, l_length, l_sub, l_sub_length, l_start = l_func.args
+        l_entry_block = l_func.append_basic_block( 'entry' )
+        l_loop_block = l_func.append_basic_block( 'loop' )
+        l_check_empty_block = l_func.append_basic_block( 'check_empty' )
+        l_search_block = l_func.append_basic_block( 'search' )
+        l_compare_block = l_func.append_basic_block( 'compare' )
+        l_mismatch_block = l_func.append_basic_block( 'mismatch' )
+        l_found_block = l_func.append_basic_block( 'found' )
+        l_found_empty_block = l_func.append_basic_block( 'found_empty' )
+        l_not_found_block = l_func.append_basic_block( 'not_found' )
+        builder = lcore.Builder.new( l_entry_block )
+        builder.branch( l_loop_block )
+        builder.position_at_end( l_loop_block )
+        l_index = builder.phi( L_SIZE_TYPE )
+        l_index.add_incoming( l_start, l_entry_block )
+        l_remaining = builder.sub( l_length, l_index )
+        builder.cbranch( builder.icmp( lcore.IPRED_SLT, l_remaining, l_sub_length ),
+                         l_not_found_block, l_check_empty_block )
+        builder.position_at_end( l_check_empty_block )
+        builder.cbranch( builder.icmp( lcore.IPRED_EQ, l_sub_length, _size(0) ),
+                         l_found_empty_block, l_search_block )
+        builder.position_at_end( l_search_block )
+        l_first_byte = builder.zext( builder.load( l_sub ), L_C_INT_TYPE )
+        l_candidate = builder.call( self.l_memchr, [
+            builder.gep( l_data, [l_index] ), l_first_byte,
+            builder.add( builder.sub( l_remaining, l_sub_length ), _size(1) )] )
+        builder.cbranch( builder.icmp( lcore.IPRED_EQ, l_candidate, L_NULL_BYTE_PTR ),
+                         l_not_found_block, l_compare_block )
+        builder.position_at_end( l_compare_block )
+        l_position = builder.sub( builder.ptrtoint( l_candidate, L_SIZE_TYPE ),
+                                  builder.ptrtoint( l_data, L_SIZE_TYPE ) )
+        l_compare = builder.call( self.l_memcmp, [l_candidate, l_sub, l_sub_length] )
+        builder.cbranch( builder.icmp( lcore.IPRED_EQ, l_compare, L_C_INT_0 ),
+                         l_found_block, l_mismatch_block )
+        builder.position_at_end( l_mismatch_block )
+        l_index.add_incoming( builder.add( l_position, _size(1) ), l_mismatch_block )
+        builder.branch( l_loop_block )
+        builder.position_at_end( l_found_block )
+        builder.ret( l_position )
+        builder.position_at_end( l_found_empty_block )
+        builder.ret( l_index )
+        builder.position_at_end( l_not_found_block )
+        builder.ret( _size(-1) )
+        return l_func
+
+    def emit_compare( self, builder, l_a, l_b ):
+        """Returns the i64 result of rpy_bytes_compare()."""
+        return builder.call( self.l_compare, [
+            builder.extract_value( l_a, BYTES_FIELD_DATA ),
+            builder.extract_value( l_a, BYTES_FIELD_LENGTH ),
+            builder.extract_value( l_b, BYTES_FIELD_DATA ),
+            builder.extract_value( l_b, BYTES_FIELD_LENGTH )] )
+
+    def emit_find( self, builder, l_bytes, l_sub_data, l_sub_length, l_start ):
+        return builder.call( self.l_find, [
+            builder.extract_value( l_bytes, BYTES_FIELD_DATA ),
+            builder.extract_value( l_bytes, BYTES_FIELD_LENGTH ),
+            l_sub_data, l_sub_length, l_start] )
+
+# Entry point boundary
+
+class NativeBytes(ctypes.Structure):
+    _fields_ = [('data', ctypes.c_void_p),
+                ('length', ctypes.c_int64)]
+
+class Py_buffer(ctypes.Structure):
+    """Layout of the C Py_buffer structure. Only buf and len are used, the
+       tail is reserved for the fields that vary between python versions.
+    """
+    _fields_ = [('buf', ctypes.c_void_p),
+                ('obj', ctypes.c_void_p),
+                ('len', ctypes.c_ssize_t),
+                ('itemsize', ctypes.c_ssize_t),
+                ('readonly', ctypes.c_int),
+                ('ndim', ctypes.c_int),
+                ('format', ctypes.c_char_p),
+                ('shape', ctypes.c_void_p),
+                ('strides', ctypes.c_void_p),
+                ('suboffsets', ctypes.c_void_p),
+                ('reserved', ctypes.c_void_p * 4)]
+
+PyBUF_SIMPLE = 0 # contiguous buffer of bytes
+
+_PyObject_GetBuffer = ctypes.pythonapi.PyObject_GetBuffer
+_PyObject_GetBuffer.argtypes = [ctypes.py_object, ctypes.POINTER(Py_buffer), ctypes.c_int]
+_PyObject_GetBuffer.restype = ctypes.c_int
+_PyBuffer_Release = ctypes.pythonapi.PyBuffer_Release
+_PyBuffer_Release.argtypes = [ctypes.POINTER(Py_buffer)]
+_PyBuffer_Release.restype = None
+
+class BytesArgument(object):
+    """Marshals a bytes entry point parameter, see
+       rpy.codegenerator.ModuleGenerator.add_entry_point_thunk().
+    """
+    def acquire( self, py_value ):
+        return BufferHandle( py_value )
+
+    def to_python( self, py_value ):
+        """Returns the value passed to the python function when the call is
+           re-executed by CPython: buffers such as memoryview do not have the
+           methods of bytes (find, count...).
+        """
+        if isinstance( py_value, bytes ):
+            return py_value
+        return bytes( py_value )
+
+class BufferHandle(object):
+    """Holds the buffer of a python object during a call. address is the
+       address of its NativeBytes.
+    """
+    def __init__( self, py_value ):
+        if isinstance( py_value, str ):
+            raise ValueError( 'str parameters are not supported, pass bytes' )
+        self._view = Py_buffer()
+        try:
+            _PyObject_GetBuffer( py_value, ctypes.byref( self._view ), PyBUF_SIMPLE )
+        except TypeError:
+            raise ValueError( 'bytes parameter must support the buffer protocol, not %r' %
+                              type(py_value) )
+        self._header = NativeBytes( self._view.buf, self._view.len )
+        self.address = ctypes.addressof( self._header )
+
+    def release( self, completed ):
+        _PyBuffer_Release( ctypes.byref( self._view ) )
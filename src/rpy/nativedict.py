@@ -0,0 +1,394 @@
+"""Native dictionaries: homogeneous dict with int, str or bytes keys.
+
+A dict is a pointer to a header { entry* entries, i64 length, i64 capacity }
+allocated in the arena of the entry point call (see rpy.arena). entries is an
+open-addressing hash table of capacity (a power of 2) entries
+{ i8 state, i64 hash, key, value } probed linearly. The table doubles when it
+is 2/3 full. Keys are never removed, so the table has no tombstone.
+
+The hash of a key is computed once and stored in its entry, which speeds up
+the probing and the growth of the table: int keys use a multiplicative hash,
+str (UTF-8 encoded) and bytes keys FNV-1a. It is not the python hash(), so
+native dicts are converted into python dicts when they are returned by the
+entry point (see dict_from_header_address()).
+
+The probing and growth functions are emitted as LLVM IR for each dict type,
+see DictRuntime. Lookups and stores are inlined by the code generator.
+"""
+import ctypes
+import llvm.core as lcore
+from rpy.nativebytes import L_BYTES_TYPE, NativeBytes
+
+# Fields of the dict header
+DICT_FIELD_ENTRIES = 0
+DICT_FIELD_LENGTH = 1
+DICT_FIELD_CAPACITY = 2
+
+# Fields of an entry of the hash table
+ENTRY_FIELD_STATE = 0 # i8, ENTRY_EMPTY or ENTRY_USED
+ENTRY_FIELD_HASH = 1
+ENTRY_FIELD_KEY = 2
+ENTRY_FIELD_VALUE = 3
+
+ENTRY_EMPTY = 0
+ENTRY_USED = 1
+
+# Capacity of the table of a new dict. Must be a power of 2.
+DICT_MIN_CAPACITY = 8
+
+FN_HASH_BYTES = 'rpy_hash_bytes'
+FN_DICT_LOOKUP = 'rpy_dict_lookup'
+FN_DICT_GROW = 'rpy_dict_grow'
+FN_DICT_RESERVE = 'rpy_dict_reserve'
+
+def _signed_int64( value ):
+    return ctypes.c_int64( value ).value
+
+# Multiplicative hash (Fibonacci hashing) of the int keys
+INT_HASH_MULTIPLIER = _signed_int64( 0x9E3779B97F4A7C15 )
+# 64 bits FNV-1a hash of the str and bytes keys
+FNV_OFFSET_BASIS = _signed_int64( 0xcbf29ce484222325 )
+FNV_PRIME = 0x100000001b3
+
+L_BYTE_TYPE = lcore.Type.int(8)
+L_BYTE_PTR_TYPE = lcore.Type.pointer( L_BYTE_TYPE )
+L_SIZE_TYPE = lcore.Type.int(64)
+L_FIELD_INDEX_TYPE = lcore.Type.int(32)
+
+def _field_index( index ):
+    return lcore.Constant.int( L_FIELD_INDEX_TYPE, index )
+
+def _size( size ):
+    return lcore.Constant.int( L_SIZE_TYPE, size )
+
+L_FIELD_0 = _field_index( 0 )
+L_ENTRY_EMPTY = lcore.Constant.int( L_BYTE_TYPE, ENTRY_EMPTY )
+L_ENTRY_USED = lcore.Constant.int( L_BYTE_TYPE, ENTRY_USED )
+
+def get_field_ptr( builder, l_struct_ptr, field ):
+    return builder.gep( l_struct_ptr, [L_FIELD_0, _field_index( field )] )
+
+def make_dict_type( l_key_type, l_value_type ):
+    """Returns the LLVM type of a dict: a pointer to its header."""
+    l_entry_type = lcore.Type.struct( [L_BYTE_TYPE, L_SIZE_TYPE, l_key_type, l_value_type] )
+    return lcore.Type.pointer( lcore.Type.struct(
+        [lcore.Type.pointer( l_entry_type ), L_SIZE_TYPE, L_SIZE_TYPE] ) )
+
+def get_entry_type( l_dict_type ):
+    return l_dict_type.pointee.elements[DICT_FIELD_ENTRIES].pointee
+
+class DictRuntime(object):
+    """Declares the runtime functions of the native dicts in a LLVM module.
+       The functions depending on the key and value types are declared on
+       first use.
+    """
+    def __init__( self, l_module, arena ):
+        self.l_module = l_module
+        self.arena = arena
+        self.l_memcmp = l_module.get_or_insert_function(
+            lcore.Type.function( lcore.Type.int(32),
+                                 [L_BYTE_PTR_TYPE, L_BYTE_PTR_TYPE, L_SIZE_TYPE] ),
+            'memcmp' )
+        self.l_memset = lcore.Function.intrinsic( l_module, lcore.INTR_MEMSET,
+                                                  [L_SIZE_TYPE] )
+        self.l_hash_bytes = self._declare_hash_bytes()
+        self._l_functions = {} # dict {(name, l_dict_type): l_func}
+        self._next_id = 0
+
+    def _get_function( self, name, l_dict_type, declarator ):
+        key = (name, str(l_dict_type))
+        l_func = self._l_functions.get( key )
+        if l_func is None:
+            self._next_id += 1
+            l_func = declarator( l_dict_type, '%s.%d' % (name, self._next_id) )
+            self._l_functions[key] = l_func
+        return l_func
+
+    def _declare_hash_bytes( self ):
+        """i64 rpy_hash_bytes( i8* data, i64 length ): FNV-1a hash."""
+        l_func = self.l_module.add_function(
+            lcore.Type.function( L_SIZE_TYPE, [L_BYTE_PTR_TYPE, L_SIZE_TYPE] ),
+            FN_HASH_BYTES )
+        l_data, l_length = l_func.args
+        l_entry_block = l_func.append_basic_block( 'entry' )
+        l_loop_block = l_func.append_basic_block( 'loop' )
+        l_byte_block = l_func.append_basic_block( 'hash_byte' )
+        l_done_block = l_func.append_basic_block( 'done' )
+        builder = lcore.Builder.new( l_entry_block )
+        builder.branch( l_loop_block )
+        builder.position_at_end( l_loop_block )
+        l_index = builder.phi( L_SIZE_TYPE )
+        l_index.add_incoming( _size(0), l_entry_block )
+        l_hash = builder.phi( L_SIZE_TYPE )
+        l_hash.add_incoming( _size( FNV_OFFSET_BASIS ), l_entry_block )
+        builder.cbranch( builder.icmp( lcore.IPRED_ULT, l_index, l_length ),
+                         l_byte_block, l_done_block )
+        builder.position_at_end( l_byte_block )
+        l_byte = builder.zext( builder.load( builder.gep( l_data, [l_index] ) ),
+                               L_SIZE_TYPE )
+        l_next_hash = builder.mul( builder.xor( l_hash, l_byte ), _size( FNV_PRIME ) )
+        l_hash.add_incoming( l_next_hash, l_byte_block )
+        l_index.add_incoming( builder.add( l_index, _size(1) ), l_byte_block )
+        builder.branch( l_loop_block )
+        builder.position_at_end( l_done_block )
+        builder.ret( l_hash )
+        return l_func
+
+    def emit_hash( self, builder, l_key ):
+        """Returns the hash of a key as an i64."""
+        if l_key.type == L_SIZE_TYPE:
+            l_hash = builder.mul( l_key, _size( INT_HASH_MULTIPLIER ) )
+            # Mixes the high bits into the low bits used by the table index
+            return builder.xor( l_hash, builder.lshr( l_hash, _size(32) ) )
+        return builder.call( self.l_hash_bytes, [builder.extract_value( l_key, 0 ),
+                                                 builder.extract_value( l_key, 1 )] )
+
+    def _emit_key_check( self, builder, l_func, l_entry_key, l_key,
+                         l_equal_block, l_different_block ):
+        """Branches to l_equal_block if both keys are equal."""
+        if l_key.type == L_SIZE_TYPE:
+            builder.cbranch( builder.icmp( lcore.IPRED_EQ, l_entry_key, l_key ),
+                             l_equal_block, l_different_block )
+            return
+        l_compare_block = l_func.append_basic_block( 'compare_bytes' )
+        l_length = builder.extract_value( l_key, 1 )
+        builder.cbranch( builder.icmp( lcore.IPRED_EQ,
+                                       builder.extract_value( l_entry_key, 1 ), l_length ),
+                         l_compare_block, l_different_block )
+        builder.position_at_end( l_compare_block )
+        l_compare = builder.call( self.l_memcmp, [builder.extract_value( l_entry_key, 0 ),
+                                                  builder.extract_value( l_key, 0 ),
+                                                  l_length] )
+        builder.cbranch( builder.icmp( lcore.IPRED_EQ, l_compare,
+                                       lcore.Constant.int( lcore.Type.int(32), 0 ) ),
+                         l_equal_block, l_different_block )
+
+    def _declare_lookup( self, l_dict_type, name ):
+        """entry* rpy_dict_lookup( entry* entries, i64 mask, key, i64 hash ):
+           returns the entry of the key, or the empty entry where it should
+           be inserted. The table must have an empty entry.
+        """
+        l_entry_ptr_type = lcore.Type.pointer( get_entry_type( l_dict_type ) )
+        l_key_type = get_entry_type( l_dict_type ).elements[ENTRY_FIELD_KEY]
+        l_func = self.l_module.add_function(
+            lcore.Type.function( l_entry_ptr_type,
+                                 [l_entry_ptr_type, L_SIZE_TYPE, l_key_type, L_SIZE_TYPE] ),
+            name )
+        l_entries, l_mask, l_key, l_hash = l_func.args
+        l_entry_block = l_func.append_basic_block( 'entry' )
+        l_probe_block = l_func.append_basic_block( 'probe' )
+        l_found_block = l_func.append_basic_block( 'found' )
+        l_check_hash_block = l_func.append_basic_block( 'check_hash' )
+        l_check_key_block = l_func.append_basic_block( 'check_key' )
+        l_next_block = l_func.append_basic_block( 'next' )
+        builder = lcore.Builder.new( l_entry_block )
+        l_start = builder.and_( l_hash, l_mask )
+        builder.branch( l_probe_block )
+        builder.position_at_end( l_probe_block )
+        l_index = builder.phi( L_SIZE_TYPE )
+        l_index.add_incoming( l_start, l_entry_block )
+        l_entry = builder.gep( l_entries, [l_index] )
+        l_state = builder.load( get_field_ptr( builder, l_entry, ENTRY_FIELD_STATE ) )
+        builder.cbranch( builder.icmp( lcore.IPRED_EQ, l_state, L_ENTRY_EMPTY ),
+                         l_found_block, l_check_hash_block )
+        builder.position_at_end( l_found_block )
+        builder.ret( l_entry )
+        builder.position_at_end( l_check_hash_block )
+        l_entry_hash = builder.load( get_field_ptr( builder, l_entry, ENTRY_FIELD_HASH ) )
+        builder.cbranch( builder.icmp( lcore.IPRED_EQ, l_entry_hash, l_hash ),
+                         l_check_key_block, l_next_block )
+        builder.position_at_end( l_check_key_block )
+        l_entry_key = builder.load( get_field_ptr( builder, l_entry, ENTRY_FIELD_KEY ) )
+        self._emit_key_check( builder, l_func, l_entry_key, l_key,
+                              l_found_block, l_next_block )
+        builder.position_at_end( l_next_block )
+        l_index.add_incoming( builder.and_( builder.add( l_index, _size(1) ), l_mask ),
+                              l_next_block )
+        builder.branch( l_probe_block )
+        return l_func
+
+    def _emit_entries_allocation( self, builder, l_func, l_entry_type, l_capacity ):
+        """Allocates a zeroed (empty) table. Returns (l_entries, l_block)."""
+        l_entries, l_block = self.arena.emit_allocation(
+            builder, l_func, l_entry_type, 'dict_entries', l_capacity )
+        l_size = self.arena.emit_size_of( builder, l_entry_type, l_capacity )
+        builder.call( self.l_memset, [builder.bitcast( l_entries, L_BYTE_PTR_TYPE ),
+                                      lcore.Constant.int( L_BYTE_TYPE, 0 ), l_size,
+                                      _field_index(1)] )
+        return l_entries, l_block
+
+    def _declare_grow( self, l_dict_type, name ):
+        """void rpy_dict_grow( dict* ): doubles the capacity of the table and
+           re-inserts the entries using their stored hash.
+        """
+        l_entry_type = get_entry_type( l_dict_type )
+        l_lookup = self._get_function( FN_DICT_LOOKUP, l_dict_type, self._declare_lookup )
+        l_func = self.l_module.add_function(
+            lcore.Type.function( lcore.Type.void(), [l_dict_type] ), name )
+        l_dict = l_func.args[0]
+        builder = lcore.Builder.new( l_func.append_basic_block( 'entry' ) )
+        l_entries_ptr = get_field_ptr( builder, l_dict, DICT_FIELD_ENTRIES )
+        l_capacity_ptr = get_field_ptr( builder, l_dict, DICT_FIELD_CAPACITY )
+        l_old_entries = builder.load( l_entries_ptr )
+        l_old_capacity = builder.load( l_capacity_ptr )
+        l_capacity = builder.mul( l_old_capacity, _size(2) )
+        l_mask = builder.sub( l_capacity, _size(1) )
+        l_entries, l_allocated_block = self._emit_entries_allocation(
+            builder, l_func, l_entry_type, l_capacity )
+        l_loop_block = l_func.append_basic_block( 'loop' )
+        l_check_block = l_func.append_basic_block( 'check_entry' )
+        l_move_block = l_func.append_basic_block( 'move_entry' )
+        l_next_block = l_func.append_basic_block( 'next' )
+        l_done_block = l_func.append_basic_block( 'done' )
+        builder.branch( l_loop_block )
+        builder.position_at_end( l_loop_block )
+        l_index = builder.phi( L_SIZE_TYPE )
+        l_index.add_incoming( _size(0), l_allocated_block )
+        builder.cbranch( builder.icmp( lcore.IPRED_ULT, l_index, l_old_capacity ),
+                         l_check_block, l_done_block )
+        builder.position_at_end( l_check_block )
+        l_old_entry = builder.gep( l_old_entries, [l_index] )
+        l_state = builder.load( get_field_ptr( builder, l_old_entry, ENTRY_FIELD_STATE ) )
+        builder.cbranch( builder.icmp( lcore.IPRED_EQ, l_state, L_ENTRY_EMPTY ),
+                         l_next_block, l_move_block )
+        builder.position_at_end( l_move_block )
+        l_hash = builder.load( get_field_ptr( builder, l_old_entry, ENTRY_FIELD_HASH ) )
+        l_key = builder.load( get_field_ptr( builder, l_old_entry, ENTRY_FIELD_KEY ) )
+        l_new_entry = builder.call( l_lookup, [l_entries, l_mask, l_key, l_hash] )
+        builder.store( builder.load( l_old_entry ), l_new_entry )
+        builder.branch( l_next_block )
+        builder.position_at_end( l_next_block )
+        l_index.add_incoming( builder.add( l_index, _size(1) ), l_next_block )
+        builder.branch( l_loop_block )
+        builder.position_at_end( l_done_block )
+        builder.store( l_entries, l_entries_ptr )
+        builder.store( l_capacity, l_capacity_ptr )
+        builder.ret_void()
+        return l_func
+
+    def _declare_reserve( self, l_dict_type, name ):
+        """void rpy_dict_reserve( dict* ): grows the table if inserting a key
+           would make it more than 2/3 full. Small enough to be inlined.
+        """
+        l_grow = self._get_function( FN_DICT_GROW, l_dict_type, self._declare_grow )
+        l_func = self.l_module.add_function(
+            lcore.Type.function( lcore.Type.void(), [l_dict_type] ), name )
+        l_dict = l_func.args[0]
+        l_entry_block = l_func.append_basic_block( 'entry' )
+        l_grow_block = l_func.append_basic_block( 'grow' )
+        l_done_block = l_func.append_basic_block( 'done' )
+        builder = lcore.Builder.new( l_entry_block )
+        l_length = builder.load( get_field_ptr( builder, l_dict, DICT_FIELD_LENGTH ) )
+        l_capacity = builder.load( get_field_ptr( builder, l_dict, DICT_FIELD_CAPACITY ) )
+        l_is_full = builder.icmp( lcore.IPRED_SGT,
+                                  builder.mul( builder.add( l_length, _size(1) ), _size(3) ),
+                                  builder.mul( l_capacity, _size(2) ) )
+        builder.cbranch( l_is_full, l_grow_block, l_done_block )
+        builder.position_at_end( l_grow_block )
+        builder.call( l_grow, [l_dict] )
+        builder.branch( l_done_block )
+        builder.position_at_end( l_done_block )
+        builder.ret_void()
+        return l_func
+
+    def emit_allocation( self, builder, l_func, l_dict_type, key_count=0 ):
+        """Emits the allocation of an empty dict large enough for key_count
+           keys. Returns a tuple (l_dict, l_block) where l_block is the LLVM
+           block code generation must continue in.
+        """
+        capacity = DICT_MIN_CAPACITY
+        while (key_count + 1) * 3 > capacity * 2:
+            capacity *= 2
+        l_dict, l_block = self.arena.emit_allocation( builder, l_func,
+                                                      l_dict_type.pointee, 'dict' )
+        l_entries, l_block = self._emit_entries_allocation(
+            builder, l_func, get_entry_type( l_dict_type ), _size( capacity ) )
+        builder.store( l_entries, get_field_ptr( builder, l_dict, DICT_FIELD_ENTRIES ) )
+        builder.store( _size(0), get_field_ptr( builder, l_dict, DICT_FIELD_LENGTH ) )
+        builder.store( _size( capacity ), get_field_ptr( builder, l_dict, DICT_FIELD_CAPACITY ) )
+        return l_dict, l_block
+
+    def emit_lookup( self, builder, l_dict, l_key, l_hash=None ):
+        """Returns a tuple (l_entry, l_found): the entry of the key (the
+           empty entry where it would be inserted if missing) and an i1 that
+           is true if the key is in the dict.
+        """
+        if l_hash is None:
+            l_hash = self.emit_hash( builder, l_key )
+        l_lookup = self._get_function( FN_DICT_LOOKUP, l_dict.type, self._declare_lookup )
+        l_capacity = builder.load( get_field_ptr( builder, l_dict, DICT_FIELD_CAPACITY ) )
+        l_entry = builder.call( l_lookup, [
+            builder.load( get_field_ptr( builder, l_dict, DICT_FIELD_ENTRIES ) ),
+            builder.sub( l_capacity, _size(1) ), l_key, l_hash] )
+        l_state = builder.load( get_field_ptr( builder, l_entry, ENTRY_FIELD_STATE ) )
+        return l_entry, builder.icmp( lcore.IPRED_NE, l_state, L_ENTRY_EMPTY )
+
+    def emit_store( self, builder, l_dict, l_key, l_value ):
+        """Emits d[key] = value. The code is branch free: the entry key is
+           stored even if the key is already in the dict.
+        """
+        l_reserve = self._get_function( FN_DICT_RESERVE, l_dict.type, self._declare_reserve )
+        builder.call( l_reserve, [l_dict] )
+        l_hash = self.emit_hash( builder, l_key )
+        l_entry, l_found = self.emit_lookup( builder, l_dict, l_key, l_hash )
+        l_length_ptr = get_field_ptr( builder, l_dict, DICT_FIELD_LENGTH )
+        l_inserted = builder.zext( builder.not_( l_found ), L_SIZE_TYPE )
+        builder.store( builder.add( builder.load( l_length_ptr ), l_inserted ), l_length_ptr )
+        builder.store( L_ENTRY_USED, get_field_ptr( builder, l_entry, ENTRY_FIELD_STATE ) )
+        builder.store( l_hash, get_field_ptr( builder, l_entry, ENTRY_FIELD_HASH ) )
+        builder.store( l_key, get_field_ptr( builder, l_entry, ENTRY_FIELD_KEY ) )
+        builder.store( l_value, get_field_ptr( builder, l_entry, ENTRY_FIELD_VALUE ) )
+
+# Entry point boundary: conversion of a native dict into a python dict
+
+class DictHeader(ctypes.Structure):
+    _fields_ = [('entries', ctypes.c_void_p),
+                ('length', ctypes.c_int64),
+                ('capacity', ctypes.c_int64)]
+
+_KEY_CTYPES = {
+    int: ctypes.c_int64,
+    str: NativeBytes,
+    bytes: NativeBytes
+    }
+
+_VALUE_CTYPES = {
+    int: ctypes.c_int64,
+    float: ctypes.c_double,
+    bool: ctypes.c_bool
+    }
+
+_entry_ctypes = {} # dict {(key_py_type, value_py_type): ctypes.Structure}
+
+def get_entry_ctype( key_py_type, value_py_type ):
+    """Returns the ctypes Structure with the layout of the LLVM entries."""
+    key = (_KEY_CTYPES[key_py_type], value_py_type)
+    entry_ctype = _entry_ctypes.get( key )
+    if entry_ctype is None:
+        class DictEntry(ctypes.Structure):
+            _fields_ = [('state', ctypes.c_int8),
+                        ('hash', ctypes.c_int64),
+                        ('key', _KEY_CTYPES[key_py_type]),
+                        ('value', _VALUE_CTYPES[value_py_type])]
+        entry_ctype = _entry_ctypes[key] = DictEntry
+    return entry_ctype
+
+def _convert_key( native_key, key_py_type ):
+    if key_py_type is int:
+        return native_key
+    data = ctypes.string_at( native_key.data, native_key.length )
+    if key_py_type is str:
+        return data.decode( 'utf-8' )
+    return data
+
+def dict_from_header_address( address, key_py_type, value_py_type ):
+    """Returns a python dict containing a copy of the items of the native
+       dict whose header is at address.
+    """
+    header = DictHeader.from_address( address )
+    entries_ctype = get_entry_ctype( key_py_type, value_py_type ) * header.capacity
+    py_dict = {}
+    for entry in entries_ctype.from_address( header.entries ):
+        if entry.state != ENTRY_EMPTY:
+            py_dict[_convert_key( entry.key, key_py_type )] = entry.value
+    return py_dict
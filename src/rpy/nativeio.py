@@ -0,0 +1,218 @@
+"""Direct calls to the OS I/O layer for the rpy_native file classes.
+
+A RawFile (see rpybuiltin.builtin) entry point parameter is passed to the
+compiled code as a pointer to a { i32 fd, i64 position, i64 written }
+structure. Its
+methods are lowered to calls to the C library, resolved by the JIT in the
+libraries loaded by the process, so I/O loops never leave native code:
+
+    def count_bytes(f):
+        total = 0
+        data = f.read( 65536 )
+        while len(data) > 0:
+            total = total + len(data)
+            data = f.read( 65536 )
+        return total
+
+- read( [n] ): pread() into a buffer allocated in the arena of the call.
+  Without n, reads until the end of the file (lseek( SEEK_END )).
+- write( data ): pwrite(), returns len(data).
+- seek( offset[, whence] ), tell() and fileno() use the structure, only
+  SEEK_END calls lseek().
+
+As with PosixRawFile, reads and writes are positional: the position is kept
+in the structure and copied back to the python object when the call returns
+(see FileHandle). If a system call fails or is incomplete, the native code
+bails out and the call is re-executed by CPython, which raises the error.
+The position of the python object is only updated by completed calls.
+Writes can not be undone: re-executing a call would write the data again,
+at other offsets if the position depends on the file size (SEEK_END). The
+structure counts the bytes written, and a call bailing out after a write
+raises IOError instead of being re-executed. I/O kernels should write only
+once the values that can bail out (big ints, indexes...) are computed.
+Notes: only supported on 64 bits POSIX platforms (ssize_t and off_t are i64).
+"""
+import ctypes
+import sys
+import llvm.core as lcore
+
+FN_FILE_SEEK = 'rpy_file_seek'
+
+L_FD_TYPE = lcore.Type.int(32)
+L_SIZE_TYPE = lcore.Type.int(64)
+L_BYTE_PTR_TYPE = lcore.Type.pointer( lcore.Type.int(8) )
+L_FIELD_INDEX_TYPE = lcore.Type.int(32)
+# Representation of a native file: { i32 fd, i64 position, i64 written }
+L_FILE_TYPE = lcore.Type.struct( [L_FD_TYPE, L_SIZE_TYPE, L_SIZE_TYPE] )
+L_FILE_PTR_TYPE = lcore.Type.pointer( L_FILE_TYPE )
+
+FILE_FIELD_FD = 0
+FILE_FIELD_POSITION = 1
+FILE_FIELD_WRITTEN = 2
+
+# whence values of seek(), as in the os module
+SEEK_SET = 0
+SEEK_CUR = 1
+SEEK_END = 2
+
+def _field_index( index ):
+    return lcore.Constant.int( L_FIELD_INDEX_TYPE, index )
+
+def _size( size ):
+    return lcore.Constant.int( L_SIZE_TYPE, size )
+
+L_FIELD_0 = _field_index( 0 )
+
+def get_file_field_ptr( builder, l_file, field ):
+    return builder.gep( l_file, [L_FIELD_0, _field_index( field )] )
+
+class FileRuntime(object):
+    """Declares the C library I/O functions and the seek helper in a LLVM
+       module.
+    """
+    def __init__( self, l_module ):
+        self.l_module = l_module
+        l_transfer_type = lcore.Type.function(
+            L_SIZE_TYPE, [L_FD_TYPE, L_BYTE_PTR_TYPE, L_SIZE_TYPE, L_SIZE_TYPE] )
+        self.l_pread = l_module.get_or_insert_function( l_transfer_type, 'pread' )
+        self.l_pwrite = l_module.get_or_insert_function( l_transfer_type, 'pwrite' )
+        self.l_lseek = l_module.get_or_insert_function(
+            lcore.Type.function( L_SIZE_TYPE, [L_FD_TYPE, L_SIZE_TYPE, L_FD_TYPE] ),
+            'lseek' )
+        self.l_seek = self._declare_seek()
+
+    def _declare_seek( self ):
+        """i64 rpy_file_seek( file* f, i64 offset, i64 whence ): returns the
+           position designated by offset and whence, -1 if it is negative,
+           whence is invalid or lseek() failed. The position is not modified.
+        """
+        l_func = self.l_module.add_function(
+            lcore.Type.function( L_SIZE_TYPE, [L_FILE_PTR_TYPE, L_SIZE_TYPE, L_SIZE_TYPE] ),
+            FN_FILE_SEEK )
+        l_file, l_offset, l_whence = l_func.args
+        l_entry_block = l_func.append_basic_block( 'entry' )
+        l_end_block = l_func.append_basic_block( 'seek_end' )
+        l_not_end_block = l_func.append_basic_block( 'seek_set_or_cur' )
+        l_compute_block = l_func.append_basic_block( 'compute' )
+        l_valid_block = l_func.append_basic_block( 'valid' )
+        l_invalid_block = l_func.append_basic_block( 'invalid' )
+        builder = lcore.Builder.new( l_entry_block )
+        l_position = builder.load( get_file_field_ptr( builder, l_file, FILE_FIELD_POSITION ) )
+        builder.cbranch( builder.icmp( lcore.IPRED_EQ, l_whence, _size( SEEK_END ) ),
+                         l_end_block, l_not_end_block )
+        builder.position_at_end( l_end_block )
+        l_fd = builder.load( get_file_field_ptr( builder, l_file, FILE_FIELD_FD ) )
+        l_end = builder.call( self.l_lseek, [l_fd, _size(0),
+                                             lcore.Constant.int( L_FD_TYPE, SEEK_END )] )
+        builder.cbranch( builder.icmp( lcore.IPRED_SLT, l_end, _size(0) ),
+                         l_invalid_block, l_compute_block )
+        builder.position_at_end( l_not_end_block )
+        l_base = builder.select( builder.icmp( lcore.IPRED_EQ, l_whence, _size( SEEK_CUR ) ),
+                                 l_position, _size(0) )
+        builder.cbranch( builder.icmp( lcore.IPRED_UGT, l_whence, _size( SEEK_CUR ) ),
+                         l_invalid_block, l_compute_block )
+        builder.position_at_end( l_compute_block )
+        l_start = builder.phi( L_SIZE_TYPE )
+        l_start.add_incoming( l_end, l_end_block )
+        l_start.add_incoming( l_base, l_not_end_block )
+        l_new_position = builder.add( l_start, l_offset )
+        builder.cbranch( builder.icmp( lcore.IPRED_SLT, l_new_position, _size(0) ),
+                         l_invalid_block, l_valid_block )
+        builder.position_at_end( l_valid_block )
+        builder.ret( l_new_position )
+        builder.position_at_end( l_invalid_block )
+        builder.ret( _size(-1) )
+        return l_func
+
+    def emit_load_fd( self, builder, l_file ):
+        return builder.load( get_file_field_ptr( builder, l_file, FILE_FIELD_FD ) )
+
+    def emit_read( self, builder, l_file, l_buffer, l_count ):
+        """Reads at most l_count bytes at the position into l_buffer and
+           advances the position. Returns the number of bytes read, negative
+           on error.
+        """
+        l_position_ptr = get_file_field_ptr( builder, l_file, FILE_FIELD_POSITION )
+        l_position = builder.load( l_position_ptr )
+        l_read = builder.call( self.l_pread, [self.emit_load_fd( builder, l_file ),
+                                              l_buffer, l_count, l_position] )
+        l_advance = builder.select( builder.icmp( lcore.IPRED_SGT, l_read, _size(0) ),
+                                    l_read, _size(0) )
+        builder.store( builder.add( l_position, l_advance ), l_position_ptr )
+        return l_read
+
+    def emit_write( self, builder, l_file, l_data, l_count ):
+        """Writes l_count bytes of l_data at the position and advances the
+           position and the written byte count. Returns the number of bytes
+           written, negative on error.
+        """
+        l_position_ptr = get_file_field_ptr( builder, l_file, FILE_FIELD_POSITION )
+        l_position = builder.load( l_position_ptr )
+        l_written = builder.call( self.l_pwrite, [self.emit_load_fd( builder, l_file ),
+                                                  l_data, l_count, l_position] )
+        l_advance = builder.select( builder.icmp( lcore.IPRED_SGT, l_written, _size(0) ),
+                                    l_written, _size(0) )
+        builder.store( builder.add( l_position, l_advance ), l_position_ptr )
+        l_total_ptr = get_file_field_ptr( builder, l_file, FILE_FIELD_WRITTEN )
+        builder.store( builder.add( builder.load( l_total_ptr ), l_advance ), l_total_ptr )
+        return l_written
+
+    def emit_seek( self, builder, l_file, l_offset, l_whence ):
+        """Returns the new position, -1 if the seek is invalid (see
+           rpy_file_seek), without modifying the position.
+        """
+        return builder.call( self.l_seek, [l_file, l_offset, l_whence] )
+
+    def emit_set_position( self, builder, l_file, l_position ):
+        builder.store( l_position, get_file_field_ptr( builder, l_file, FILE_FIELD_POSITION ) )
+
+    def emit_tell( self, builder, l_file ):
+        return builder.load( get_file_field_ptr( builder, l_file, FILE_FIELD_POSITION ) )
+
+    def emit_file_size( self, builder, l_file ):
+        """Returns the size of the file, negative on error."""
+        return builder.call( self.l_lseek, [self.emit_load_fd( builder, l_file ), _size(0),
+                                            lcore.Constant.int( L_FD_TYPE, SEEK_END )] )
+
+# Entry point boundary
+
+class NativeFile(ctypes.Structure):
+    _fields_ = [('fd', ctypes.c_int32),
+                ('position', ctypes.c_int64),
+                ('written', ctypes.c_int64)]
+
+class FileArgument(object):
+    """Marshals a rpy_native file entry point parameter, see
+       rpy.codegenerator.ModuleGenerator.add_entry_point_thunk().
+    """
+    def acquire( self, py_value ):
+        return FileHandle( py_value )
+
+class FileHandle(object):
+    """Passes the descriptor and the position of a RawFile. Seeking to the
+       current position writes the buffered data of the file and drops its
+       read ahead data. The position is copied back if the call completed.
+       If the call bailed out after writing to the file, it can not be
+       re-executed by CPython: release() raises IOError.
+    """
+    def __init__( self, py_value ):
+        if sys.platform == 'win32':
+            raise ValueError( 'Native file parameters are only supported on POSIX platforms' )
+        if not getattr( type(py_value), 'rpy_native', False ):
+            raise ValueError( 'Parameter must be a RawFile, not %r' % type(py_value) )
+        if not py_value.seekable():
+            raise ValueError( 'Files opened in append mode can not be passed to compiled code' )
+        self._py_value = py_value
+        self._native = NativeFile( py_value.fileno(), py_value.seek( 0, SEEK_CUR ), 0 )
+        self.address = ctypes.addressof( self._native )
+
+    def release( self, completed ):
+        if completed:
+            self._py_value.seek( self._native.position )
+        elif self._native.written:
+            raise IOError( 'The compiled code bailed out after writing %d bytes to the '
+                           'file: the call can not be re-executed' % self._native.written )
+
+    def get_returned_value( self ):
+        """Returns the value of the call when it returns the parameter."""
+        return self._py_value
@@ -0,0 +1,190 @@
+"""Native representation of the lists at the entry point boundary.
+
+Compiled code represents a list as a pointer to a header
+{ T* data, i64 length, i64 capacity }. Items are stored contiguously in data,
+append() reallocates data in the arena of the call when the capacity is
+exhausted.
+
+Entry point list parameters are python array.array: the header points
+directly to the array buffer (zero-copy) with a negative capacity
+(SHARED_CAPACITY). The buffer is copy-on-write: before the first assignment
+or append, the native code copies the items into the arena. The items are
+copied back into the array only when the call completes, so a call that
+bails out (see CompiledFunction) is re-executed by CPython with the
+unmodified array. A list returned
+by the entry point is not copied: the caller gets a memoryview on the native
+items, which keeps the arena chunks holding them alive (see
+rpy.arena.DetachedChunks). A list parameter returned by the entry point is
+returned as a memoryview on its array.array.
+
+ctypes arrays of c_int64 or c_double are also accepted as list parameters
+(e.g. an array filled by a C library). They are shared the same way, but
+can not be resized: appending to them raises ValueError when the call
+returns.
+"""
+import array
+import ctypes
+
+# Fields of the list header
+LIST_FIELD_DATA = 0
+LIST_FIELD_LENGTH = 1
+LIST_FIELD_CAPACITY = 2
+
+# Capacity of a header sharing the buffer of a parameter (copy-on-write)
+SHARED_CAPACITY = -1
+
+class ListHeader(ctypes.Structure):
+    _fields_ = [('data', ctypes.c_void_p),
+                ('length', ctypes.c_int64),
+                ('capacity', ctypes.c_int64)]
+
+def _get_int64_typecodes():
+    return tuple( typecode for typecode in ('q', 'l')
+                  if array.array( typecode ).itemsize == 8 )
+
+# Native item type: array.array typecodes sharing the native representation
+# The first typecode is used for returned lists.
+ITEM_TYPECODES = {
+    int: _get_int64_typecodes(),
+    float: ('d',)
+    }
+
+# Native item type: ctypes type
+_ITEM_CTYPES = {
+    int: ctypes.c_int64,
+    float: ctypes.c_double
+    }
+
+class ListSignature(object):
+    """Entry point parameter type of a native list of item_py_type (int or
+       float), e.g. rpy.compile( f, (ListSignature( float ), int) ).
+    """
+    def __init__( self, item_py_type ):
+        self.item_py_type = item_py_type
+
+    def __eq__( self, other ):
+        return isinstance( other, ListSignature ) and \
+               other.item_py_type is self.item_py_type
+
+    def __ne__( self, other ):
+        return not self == other
+
+    def __hash__( self ):
+        return hash( (ListSignature, self.item_py_type) )
+
+    def __repr__( self ):
+        return 'ListSignature(%s)' % self.item_py_type.__name__
+
+# array.array typecode: entry point signature type
+_SIGNATURE_TYPES = {}
+for _item_py_type, _typecodes in ITEM_TYPECODES.items():
+    for _typecode in _typecodes:
+        _SIGNATURE_TYPES[_typecode] = ListSignature( _item_py_type )
+
+def get_array_signature_type( py_array ):
+    """Returns the entry point parameter type corresponding to an
+       array.array: ListSignature( int ) or ListSignature( float ).
+    """
+    try:
+        return _SIGNATURE_TYPES[py_array.typecode]
+    except KeyError:
+        raise ValueError( 'Unsupported array typecode for a native list: %r' %
+                          py_array.typecode )
+
+def get_ctypes_array_signature_type( py_array ):
+    """Returns the entry point parameter type corresponding to a ctypes
+       array: ListSignature( int ) or ListSignature( float ).
+    """
+    try:
+        return _SIGNATURE_TYPES[_get_ctypes_typecode( py_array )]
+    except KeyError:
+        raise ValueError( 'Unsupported ctypes array item type for a native list: %r' %
+                          py_array._type_ )
+
+def _get_ctypes_typecode( py_array ):
+    # Simple ctypes (c_double...) have an array.array compatible type code
+    return getattr( py_array._type_, '_type_', None )
+
+def make_list_header( py_array, item_py_type ):
+    """Returns a ListHeader sharing the buffer of py_array (an array.array or
+       a ctypes array) until the native code modifies the items.
+    """
+    if isinstance( py_array, ctypes.Array ):
+        typecode = _get_ctypes_typecode( py_array )
+        address, length = ctypes.addressof( py_array ), len(py_array)
+    elif isinstance( py_array, array.array ):
+        typecode = py_array.typecode
+        address, length = py_array.buffer_info()
+    else:
+        raise ValueError( 'Native list parameter must be an array.array, not %r' %
+                          type(py_array) )
+    if typecode not in ITEM_TYPECODES[item_py_type]:
+        raise ValueError( 'Array typecode %r does not match %r' %
+                          (typecode, ListSignature( item_py_type )) )
+    return ListHeader( address, length, SHARED_CAPACITY )
+
+class ListArgument(object):
+    """Marshals a list entry point parameter, see
+       rpy.codegenerator.ModuleGenerator.add_entry_point_thunk().
+    """
+    def __init__( self, item_py_type ):
+        self.item_py_type = item_py_type
+
+    def acquire( self, py_value ):
+        return ListHandle( py_value, self.item_py_type )
+
+class ListHandle(object):
+    """Keeps the header of an array.array alive during a call. address is
+       the address of the header.
+    """
+    def __init__( self, py_array, item_py_type ):
+        self._header = make_list_header( py_array, item_py_type )
+        self._py_array = py_array
+        self.address = ctypes.addressof( self._header )
+
+    def get_returned_value( self ):
+        """Returns the value of the call when it returns the parameter."""
+        if isinstance( self._py_array, ctypes.Array ):
+            return memoryview( self._py_array ).cast( 'B' ).cast(
+                _get_ctypes_typecode( self._py_array ) )
+        return memoryview( self._py_array )
+
+    def release( self, completed ):
+        """Copies back the modified items if the native code completed."""
+        if completed:
+            copy_back( self._header, self._py_array )
+
+def copy_back( header, py_array ):
+    """Copies the items of the native list into py_array if they are no
+       longer stored in its buffer (the native code modified the items).
+    """
+    if isinstance( py_array, ctypes.Array ):
+        if header.length != len(py_array):
+            raise ValueError( 'ctypes array parameters can not be resized' )
+        if header.data != ctypes.addressof( py_array ):
+            ctypes.memmove( py_array, header.data, ctypes.sizeof( py_array ) )
+        return
+    address, length = py_array.buffer_info()
+    if header.data != address or header.length != length:
+        py_array[:] = array_from_header( header, py_array.typecode )
+
+def array_from_header( header, typecode ):
+    """Returns a new array.array containing a copy of the native list items.
+    """
+    py_array = array.array( typecode )
+    if header.length:
+        py_array.frombytes( ctypes.string_at( header.data,
+                                              header.length * py_array.itemsize ) )
+    return py_array
+
+def list_view_from_header_address( address, item_py_type, owner ):
+    """Returns a memoryview on the items of the native list whose header is
+       at address. owner is kept alive as long as the view.
+    """
+    header = ListHeader.from_address( address )
+    typecode = ITEM_TYPECODES[item_py_type][0]
+    if not header.length:
+        return memoryview( array.array( typecode ) )
+    items = (_ITEM_CTYPES[item_py_type] * header.length).from_address( header.data )
+    items._rpy_owner = owner
+    return memoryview( items ).cast( 'B' ).cast( typecode )
@@ -0,0 +1,115 @@
+"""ctypes views on the LLVM structures of compiled classes.
+
+An instance returned by an entry point is not converted into a python
+object: the caller gets a ctypes.Structure mapped on the native instance.
+The structure class is generated from the LLVM structure selected by
+LLVMTypeProvider (see rpy.structlayout), so fields are at the same offsets:
+
+    class Point:
+        def __init__( self, x, y ):
+            self.x = x
+            self.y = y
+
+    point = rpy.run( make_point, 1.5 )  # ctypes view, point.x == 1.5
+
+The view keeps the arena chunks holding the instance alive (see
+rpy.arena.DetachedChunks). Attributes referencing other instances, lists or
+dicts are exposed as their address (c_void_p).
+
+Conversely, entry point parameters can be ctypes.Structure instances (see
+rpy.rtypes.CStructType). The compiled code accesses the fields through a
+pointer to a copy of the record (a memcpy, no field conversion), which is
+copied back into the instance when the call completes: if the native code
+bails out, CPython re-executes the call with the unmodified record. The
+fields are mapped to LLVM types of the same size (see
+llvm_type_from_ctype()), narrow fields are widened when read and truncated
+when written.
+"""
+import ctypes
+import llvm.core as lcore
+from rpy.nativebytes import L_BYTES_TYPE, NativeBytes
+
+# Width of a LLVM integer type: ctypes type
+_INTEGER_CTYPES = {
+    1: ctypes.c_bool, # i1 is stored as a byte
+    8: ctypes.c_int8,
+    16: ctypes.c_int16,
+    32: ctypes.c_int32,
+    64: ctypes.c_int64
+    }
+
+def ctype_from_llvm_type( l_type ):
+    """Returns the ctypes type with the same size and alignment as l_type."""
+    if l_type == L_BYTES_TYPE:
+        return NativeBytes
+    if l_type.kind == lcore.TYPE_INTEGER:
+        return _INTEGER_CTYPES[l_type.width]
+    if l_type.kind == lcore.TYPE_DOUBLE:
+        return ctypes.c_double
+    if l_type.kind == lcore.TYPE_FLOAT:
+        return ctypes.c_float
+    if l_type.kind == lcore.TYPE_POINTER:
+        return ctypes.c_void_p
+    if l_type.kind == lcore.TYPE_STRUCT:
+        return make_struct_ctype( 'struct', [ ('field%d' % index, l_element_type)
+            for index, l_element_type in enumerate( l_type.elements ) ] )
+    raise ValueError( 'No ctypes equivalent for LLVM type %s' % l_type )
+
+def llvm_type_from_ctype( ctype ):
+    """Returns the LLVM type of a ctypes.Structure field, see
+       rpy.rtypes.CStructType for the supported ctypes.
+    """
+    if ctype is ctypes.c_bool:
+        return lcore.Type.int(1)
+    if ctype is ctypes.c_double:
+        return lcore.Type.double()
+    if ctype is ctypes.c_float:
+        return lcore.Type.float()
+    return lcore.Type.int( ctypes.sizeof( ctype ) * 8 )
+
+def make_struct_ctype( name, fields ):
+    """Returns a ctypes.Structure subclass. fields is the list of
+       (name, l_type) of the LLVM structure, in order.
+    """
+    return type( name, (ctypes.Structure,), {
+        '_fields_': [ (field_name, ctype_from_llvm_type( l_type ))
+                      for field_name, l_type in fields ] } )
+
+def struct_view_from_address( address, struct_ctype, owner ):
+    """Returns a struct_ctype mapped at address. owner is kept alive as long
+       as the view.
+    """
+    view = struct_ctype.from_address( address )
+    view._rpy_owner = owner
+    return view
+
+class StructArgument(object):
+    """Marshals a ctypes.Structure entry point parameter, see
+       rpy.codegenerator.ModuleGenerator.add_entry_point_thunk().
+    """
+    def __init__( self, py_class ):
+        self.py_class = py_class
+
+    def acquire( self, py_value ):
+        if not isinstance( py_value, self.py_class ):
+            raise ValueError( 'Parameter must be a %s, not %r' %
+                              (self.py_class.__name__, type(py_value)) )
+        return StructHandle( py_value )
+
+class StructHandle(object):
+    """Passes a copy of a ctypes.Structure by address. The modifications of
+       the compiled code are copied back if the call completed.
+    """
+    def __init__( self, py_value ):
+        self._py_value = py_value
+        self._copy = type(py_value).from_buffer_copy( py_value )
+        self.address = ctypes.addressof( self._copy )
+
+    def release( self, completed ):
+        if completed:
+            ctypes.memmove( ctypes.addressof( self._py_value ), self.address,
+                            ctypes.sizeof( self._copy ) )
+
+    def get_returned_value( self ):
+        """Returns the value of the call when it returns the parameter."""
+        return self._py_value
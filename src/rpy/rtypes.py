@@ -1,7 +1,13 @@
 """Types
 """
 import types
+import ctypes
+import math
 import collections
+import builtins
+import rpy.structofarrays
+import rpy.foreign
+import rpy.nativelist
 
 SourceLocation = collections.namedtuple( 'SourceLocation', ('function_name', 'path', 'line', 'detail') )
 
@@ -21,6 +27,28 @@ class Type(object):
         """
         raise ValueError( 'Unsupported attribute reference: %r.%s' % (self, attribute_name) )
 
+    def get_item_type( self, type_registry ):
+        """Gets the type of the items of a container (subscript)."""
+        raise ValueError( 'Unsupported subscript of: %r' % self )
+
+    def record_item_type( self, r_type ):
+        """Records the type of a value stored in a container (subscript)."""
+        raise ValueError( 'Unsupported subscript assignment of: %r' % self )
+
+    def record_index_type( self, r_type ):
+        """Records the type of a subscript index (dict key)."""
+        pass
+
+    def get_iteration_item_type( self, type_registry ):
+        """Gets the type of the values produced by iterating the container."""
+        return self.get_item_type( type_registry )
+
+    def record_attribute_access( self, attribute_name ):
+        """Records a static access (load or store) to an attribute. Used to
+           lay out the most accessed attributes first (see rpy.structlayout).
+        """
+        pass
+
     def attach_to_instance( self, instance_type ):
         """Attachs the type to an instance (attribute look-up).
            Used to convert a function type into a method type.
@@ -81,6 +109,7 @@ class CallableType(Type):
         super(CallableType, self).__init__()
         self._arg_types = {}
         self._return_type = UnknownType()
+        self.call_count = 0 # number of call sites
 
     def set_location( self, location ):
         self._return_type.set_location(
@@ -121,6 +150,18 @@ class CallableType(Type):
     def record_return_type( self, return_type ):
         self._return_type.add_candidate_type( return_type )
 
+    def record_call( self ):
+        """Records a call site. Callables that are only referenced (e.g. a
+           class passed to rpy.soa) are not compiled.
+        """
+        self.call_count += 1
+
+    def get_call_return_type( self, type_registry, arg_types, location ):
+        """Returns the type of the value returned by a call site with the
+           specified argument types.
+        """
+        return self.get_return_type()
+
     def get_param_index( self, param_name ):
         raise NotImplementedError( self.__class__ )
 
@@ -176,6 +217,9 @@ class MethodType(CallableType):
     def record_arg_type( self, index, type ):
         self.function_type.record_arg_type( index + 1, type )
 
+    def record_call( self ):
+        self.function_type.record_call()
+
     def get_return_type( self ):
         return self.function_type.get_return_type()
 
@@ -184,11 +228,15 @@ class InstanceType(Type):
         super(InstanceType, self).__init__()
         self.class_type = class_type # rtype
         self.attribute_types = {} # dict{name: UnknownType}
+        self.attribute_access_counts = collections.Counter() # {name: count}
 
     def _repr_detail_str( self ):
         """Should be overridden by sub-classes that needs extra detail."""
         return ', class=%s' % self.class_type.py_class
 
+    def record_attribute_access( self, attribute_name ):
+        self.attribute_access_counts[attribute_name] += 1
+
     def get_known_attribute_type( self, attribute_name ):
         """Returns the rtype of an attribute.
            Warning: Should be use only during code generation."""
@@ -253,12 +301,192 @@ class ClassType(FunctionType): # Notes: should probably be a subclass of MethodT
     def is_constructor( self ):
         return True
 
+class BuiltinFunctionType(CallableType):
+    """A function implemented by the code generator (e.g. len, rpy.soa).
+       Its return type depends on the argument types of each call site, it is
+       computed by return_type_factory( type_registry, arg_types, location ).
+    """
+    def __init__( self, name, return_type_factory ):
+        super(BuiltinFunctionType, self).__init__()
+        self.name = name
+        self._return_type_factory = return_type_factory
+
+    def _repr_detail_str( self ):
+        return ', name=%s' % self.name
+
+    def record_arg_type( self, index, r_type ):
+        pass # see get_call_return_type()
+
+    def record_keyword_arg_type( self, param_name, param_type ):
+        raise ValueError( 'Keyword arguments are not supported by builtin %s()' %
+                          self.name )
+
+    def get_call_return_type( self, type_registry, arg_types, location ):
+        return self._return_type_factory( type_registry, arg_types, location )
+
 class DictType(Type):
-    pass
+    """A homogeneous dict with int, str or bytes keys. The types of the keys
+       and values are guessed from the subscripts and the stored values.
+    """
+    def __init__( self, key_type=None, value_type=None, location=None ):
+        super(DictType, self).__init__( location=location )
+        if key_type is None:
+            key_type = UnknownType( location=make_detailed_location( location, 'dict key type' ) )
+        if value_type is None:
+            value_type = UnknownType( location=make_detailed_location( location, 'dict value type' ) )
+        self.key_type = key_type
+        self.value_type = value_type
+        self._methods = { # dict {name: BuiltinMethodType}
+            'get': BuiltinMethodType( 'dict_get', self, self._get_return_type )
+            }
+
+    def _repr_detail_str( self ):
+        return ', key=%r, value=%r' % (self.key_type, self.value_type)
+
+    def _get_return_type( self, type_registry, arg_types, location ):
+        if len(arg_types) != 2:
+            raise ValueError( 'dict.get() takes exactly two arguments: key and default' )
+        self.record_index_type( arg_types[0] )
+        self.record_item_type( arg_types[1] )
+        return self.value_type
+
+    def record_index_type( self, r_type ):
+        self.key_type.add_candidate_type( r_type )
+
+    def record_item_type( self, r_type ):
+        self.value_type.add_candidate_type( r_type )
+
+    def get_item_type( self, type_registry ):
+        return self.value_type
+
+    def get_iteration_item_type( self, type_registry ):
+        return self.key_type
+
+    def get_instance_attribute_type( self, type_registry, attribute_name ):
+        if attribute_name in self._methods:
+            return self._methods[attribute_name]
+        return super(DictType, self).get_instance_attribute_type( type_registry,
+                                                                  attribute_name )
+
+    def merge( self, other_dict_type ):
+        """Records that values of both dict types are stored in the same
+           variable: their keys and values must have the same type.
+        """
+        for r_type, r_other_type in ((self.key_type, other_dict_type.key_type),
+                                     (self.value_type, other_dict_type.value_type)):
+            r_type.add_candidate_type( r_other_type )
+            r_other_type.add_candidate_type( r_type )
+
+class BuiltinMethodType(BuiltinFunctionType):
+    """A method of a builtin type implemented by the code generator (e.g.
+       list.append). instance_type is the type of the implied self parameter.
+    """
+    def __init__( self, name, instance_type, return_type_factory ):
+        super(BuiltinMethodType, self).__init__( name, return_type_factory )
+        self.instance_type = instance_type
 
 class ListType(Type):
+    """A homogeneous list. The type of its items is guessed from the items of
+       the list literals, the appended values and the stored values.
+    """
+    def __init__( self, item_type=None, location=None ):
+        super(ListType, self).__init__( location=location )
+        if item_type is None:
+            item_type = UnknownType( location=make_detailed_location( location, 'list item type' ) )
+        self.item_type = item_type
+        self._methods = { # dict {name: BuiltinMethodType}
+            'append': BuiltinMethodType( 'list_append', self, self._append_return_type )
+            }
+
+    def _repr_detail_str( self ):
+        return ', item=%r' % self.item_type
+
+    def _append_return_type( self, type_registry, arg_types, location ):
+        if len(arg_types) != 1:
+            raise ValueError( 'list.append() takes exactly one argument' )
+        self.record_item_type( arg_types[0] )
+        return NoneType( location )
+
+    def record_item_type( self, r_type ):
+        self.item_type.add_candidate_type( r_type )
+
+    def get_item_type( self, type_registry ):
+        return self.item_type
+
+    def get_instance_attribute_type( self, type_registry, attribute_name ):
+        if attribute_name in self._methods:
+            return self._methods[attribute_name]
+        return super(ListType, self).get_instance_attribute_type( type_registry,
+                                                                  attribute_name )
+
+    def merge( self, other_list_type ):
+        """Records that values of both list types are stored in the same
+           variable: their items must have the same type.
+        """
+        self.item_type.add_candidate_type( other_list_type.item_type )
+        other_list_type.item_type.add_candidate_type( self.item_type )
+
+class RangeType(Type):
+    """The value returned by range(). Only used as the iterable of a for
+       loop, which is lowered to a counted loop.
+    """
+    def get_item_type( self, type_registry ):
+        return IntType( location=self.get_location() )
+
+class IteratorType(Type):
+    """The iterator of a for loop over iterable_type (GET_ITER)."""
+    def __init__( self, iterable_type, location=None ):
+        super(IteratorType, self).__init__( location=location )
+        self.iterable_type = iterable_type
+
+    def _repr_detail_str( self ):
+        return ', iterable=%r' % self.iterable_type
+
+    def get_item_type( self, type_registry ):
+        return self.iterable_type.get_iteration_item_type( type_registry )
+
+class SliceType(Type):
+    """Slice subscript (start:stop). Only used as a subscript index."""
     pass
 
+class SoAType(ListType):
+    """A struct of arrays container of instances of a class (see rpy.soa).
+       Each attribute is stored in its own contiguous column. Items are views
+       (container, index) that support attribute access.
+    """
+    def __init__( self, class_type ):
+        super(SoAType, self).__init__( item_type=SoAItemType( self ) )
+        self.class_type = class_type
+        self._methods = {}
+
+    def _repr_detail_str( self ):
+        return ', class=%s' % self.class_type.py_class
+
+    def record_item_type( self, r_type ):
+        raise ValueError( 'Items of rpy.soa() can not be assigned, assign their attributes instead' )
+
+class SoAItemType(Type):
+    """An item of a SoAType container. Its attributes are the attributes of
+       the instances of the class.
+    """
+    def __init__( self, soa_type ):
+        super(SoAItemType, self).__init__()
+        self.soa_type = soa_type
+
+    def _get_instance_type( self ):
+        return self.soa_type.class_type.instance_type
+
+    def get_known_attribute_type( self, attribute_name ):
+        return self._get_instance_type().get_known_attribute_type( attribute_name )
+
+    def get_instance_attribute_type( self, type_registry, attribute_name ):
+        return self._get_instance_type().get_instance_attribute_type(
+            type_registry, attribute_name )
+
+    def record_attribute_type( self, attribute_name, attribute_type ):
+        self._get_instance_type().record_attribute_type( attribute_name,
+                                                         attribute_type )
+
 class IntegralType(PrimitiveType):
     pass
 
@@ -271,6 +499,235 @@ class BoolType(IntegralType):
 class FloatType(PrimitiveType):
     pass
 
+# ctypes of the fields supported in a ctypes.Structure: Type class
+# Notes: 64 bits unsigned fields are not supported, they do not fit IntType.
+_CTYPES_FIELD_TYPES = {
+    ctypes.c_int8: IntType,
+    ctypes.c_int16: IntType,
+    ctypes.c_int32: IntType,
+    ctypes.c_int64: IntType,
+    ctypes.c_uint8: IntType,
+    ctypes.c_uint16: IntType,
+    ctypes.c_uint32: IntType,
+    ctypes.c_bool: BoolType,
+    ctypes.c_float: FloatType,
+    ctypes.c_double: FloatType
+    }
+_CTYPES_UNSIGNED = (ctypes.c_uint8, ctypes.c_uint16, ctypes.c_uint32)
+
+class CStructType(Type):
+    """A ctypes.Structure subclass. Its instances are passed by address to
+       the compiled code: the fields are the attributes of the instances and
+       the LLVM structure has the same layout (see rpy.nativestruct).
+       Instances can not be created by the compiled code.
+    """
+    def __init__( self, py_class ):
+        super(CStructType, self).__init__()
+        self.py_class = py_class
+        self.instance_type = InstanceType( self )
+        self.fields = [] # list of (name, ctype), in order
+        self.unsigned_fields = set() # names of the unsigned integer fields
+        offset = 0
+        for field in py_class._fields_:
+            if len(field) != 2:
+                raise ValueError( 'Bit fields are not supported: %s.%s' %
+                                  (py_class.__name__, field[0]) )
+            name, ctype = field
+            if ctype not in _CTYPES_FIELD_TYPES:
+                raise ValueError( 'Unsupported field type %s.%s: %r' %
+                                  (py_class.__name__, name, ctype) )
+            # The LLVM structure only supports the natural alignment
+            alignment = ctypes.alignment( ctype )
+            offset = (offset + alignment - 1) // alignment * alignment
+            if getattr( py_class, name ).offset != offset:
+                raise ValueError( 'Unsupported layout (packed or derived structure): %s' %
+                                  py_class.__name__ )
+            offset += ctypes.sizeof( ctype )
+            self.fields.append( (name, ctype) )
+            if ctype in _CTYPES_UNSIGNED:
+                self.unsigned_fields.add( name )
+            self.instance_type.attribute_types[name] = _CTYPES_FIELD_TYPES[ctype]()
+
+    def _repr_detail_str( self ):
+        return ', class=%s' % self.py_class
+
+    def get_qualified_type_name( self ):
+        return self.py_class.__name__
+
+# Methods of the rpy_native classes lowered to OS calls, see rpy.nativeio
+NATIVE_FILE_METHODS = ('read', 'write', 'seek', 'tell', 'fileno')
+
+def _type_from_annotation( py_annotation, location ):
+    """Returns the Type of a rpy_return_type annotation (see
+       rpybuiltin.builtin).
+    """
+    if py_annotation in (int, bool, float):
+        return {int: IntType, bool: BoolType, float: FloatType}[py_annotation]( location=location )
+    if py_annotation is type(None):
+        return NoneType( location )
+    if py_annotation in (bytes, ('memoryview',)):
+        r_type = BytesType()
+        r_type.set_location( location )
+        return r_type
+    raise ValueError( 'Unsupported native return type annotation: %r' % (py_annotation,) )
+
+class NativeClassType(Type):
+    """A class implemented outside of rpy (rpy_native = True), such as
+       rpybuiltin.builtin.RawFile. Its instances are entry point parameters
+       (they can not be created by the compiled code), and the calls of
+       their methods are lowered to OS calls (see rpy.nativeio).
+    """
+    def __init__( self, py_class ):
+        super(NativeClassType, self).__init__()
+        self.py_class = py_class
+        self.instance_type = NativeInstanceType( self )
+
+    def _repr_detail_str( self ):
+        return ', class=%s' % self.py_class
+
+    def get_qualified_type_name( self ):
+        return self.py_class.__name__
+
+class NativeInstanceType(Type):
+    """Instance of a NativeClassType. Its methods are typed by their
+       rpy_return_type annotation.
+    """
+    def __init__( self, class_type ):
+        super(NativeInstanceType, self).__init__()
+        self.class_type = class_type
+        self._methods = {} # dict {name: BuiltinMethodType}
+
+    def _repr_detail_str( self ):
+        return ', class=%s' % self.class_type.py_class
+
+    def get_instance_attribute_type( self, type_registry, attribute_name ):
+        if attribute_name not in self._methods:
+            py_class = self.class_type.py_class
+            if attribute_name not in NATIVE_FILE_METHODS:
+                raise ValueError( 'Unsupported native method: %s.%s' %
+                                  (py_class.__name__, attribute_name) )
+            py_method = getattr( py_class, attribute_name )
+            self._methods[attribute_name] = BuiltinMethodType(
+                'native_' + attribute_name, self,
+                lambda type_registry, arg_types, location: _type_from_annotation(
+                    py_method.rpy_return_type, location ) )
+        return self._methods[attribute_name]
+
+class ForeignFunctionType(CallableType):
+    """A C function declared with rpy.foreign(), called directly by the
+       compiled code (see rpy.foreign). The return type is the declared one,
+       the arguments are converted to the declared parameter types by the
+       code generator.
+    """
+    def __init__( self, foreign_function ):
+        super(ForeignFunctionType, self).__init__()
+        self.foreign_function = foreign_function
+
+    def _repr_detail_str( self ):
+        return ', symbol=%s' % self.foreign_function.symbol
+
+    def get_arg_count( self ):
+        return len(self.foreign_function.argtypes)
+
+    def record_arg_type( self, index, r_type ):
+        pass # see get_call_return_type()
+
+    def record_keyword_arg_type( self, param_name, param_type ):
+        raise ValueError( 'Keyword arguments are not supported by foreign function %s()' %
+                          self.foreign_function.symbol )
+
+    def get_call_return_type( self, type_registry, arg_types, location ):
+        foreign_function = self.foreign_function
+        if len(arg_types) != self.get_arg_count():
+            raise ValueError( '%s() takes exactly %d arguments (%d given)' %
+                              (foreign_function.symbol, self.get_arg_count(), len(arg_types)) )
+        py_return_type = foreign_function.get_return_py_type()
+        if py_return_type is None:
+            return NoneType( location )
+        return _type_from_annotation( py_return_type, location )
+
+class _ResolutionTracker(object):
+    """Tracks nested type resolutions. When a type depends on itself
+       (x = x + 1), the types resolved while the recursive definition is being
+       resolved are incomplete and must not be cached.
+    """
+    depth = 0 # number of UnknownType being resolved
+    cycle_count = 0 # number of recursive definitions found
+
+    @classmethod
+    def is_complete( cls, cycle_count ):
+        """Returns True if no recursive definition was found since cycle_count
+           was read, or if the resolution is not nested.
+        """
+        return cls.depth == 0 or cls.cycle_count == cycle_count
+
+# Python numeric type promotion (see typeinference2._TYPE_PROMOTIONS).
+_TYPE_PROMOTIONS = {
+    (BoolType, BoolType): BoolType,
+    (BoolType, IntType): IntType,
+    (BoolType, FloatType): FloatType,
+    (IntType, BoolType): IntType,
+    (IntType, IntType): IntType,
+    (IntType, FloatType): FloatType,
+    (FloatType, BoolType): FloatType,
+    (FloatType, IntType): FloatType,
+    (FloatType, FloatType): FloatType
+    }
+
+def promote_primitive_types( r_types ):
+    """Returns the type among the resolved primitive r_types that all the
+       others types are promoted to, or None if they can not be promoted.
+    """
+    r_types = list( r_types )
+    promoted_class = r_types[0].__class__
+    for r_type in r_types[1:]:
+        promoted_class = _TYPE_PROMOTIONS.get( (promoted_class, r_type.__class__) )
+        if promoted_class is None:
+            return None
+    for r_type in r_types:
+        if r_type.__class__ is promoted_class:
+            return r_type
+
+class PromotedType(Type):
+    """Type of the result of an arithmetic operation: the promotion of the
+       types of its operands. Resolved once the operand types are known.
+    """
+    def __init__( self, operand_types, min_type_class=None, location=None ):
+        """Parameters:
+        min_type_class: the result is promoted at least to this type class.
+                        For example, True + True is an int.
+        """
+        super(PromotedType, self).__init__( location=location )
+        self.operand_types = tuple( operand_types )
+        self.min_type_class = min_type_class
+        self._resolved_type = None
+
+    def get_resolved_type( self, type_registry ):
+        if self._resolved_type is None:
+            cycle_count = _ResolutionTracker.cycle_count
+            r_types = [ r_type.get_resolved_type( type_registry )
+                        for r_type in self.operand_types ]
+            r_types = [ r_type for r_type in r_types if r_type is not None ]
+            if not r_types: # operand types depends on this expression
+                return None
+            if self.min_type_class is not None:
+                r_types.append( self.min_type_class( self.get_location() ) )
+            promoted_type = None
+            if all( r_type.is_primitive_type() for r_type in r_types ):
+                promoted_type = promote_primitive_types( r_types )
+            if promoted_type is None:
+                raise ValueError( 'Unsupported operand types%s: %r' %
+                                  (self.get_location_str(), r_types) )
+            # A distinct instance to keep the expression location
+            resolved_type = promoted_type.__class__( self.get_location() )
+            if not _ResolutionTracker.is_complete( cycle_count ):
+                return resolved_type
+            self._resolved_type = resolved_type
+        return self._resolved_type
+
+    def _repr_detail_str( self ):
+        return ', operands=%r' % (self.operand_types,)
+
 class StringType(Type):
     def __init__( self, length = -1 ):
         super(StringType, self).__init__()
@@ -282,15 +739,35 @@ class StringType(Type):
         return ''
 
 class BytesType(Type):
+    """bytes value. Entry point parameters of this type accept any object
+       supporting the buffer protocol (see rpy.nativebytes).
+    """
     def __init__( self, length = -1 ):
         super(BytesType, self).__init__()
         self.length = length
+        self._methods = { # dict {name: BuiltinMethodType}
+            'find': BuiltinMethodType( 'bytes_find', self, _bytes_find_return_type )
+            }
 
     def _repr_detail_str( self ):
         if self.length >= 0:
             return ', length=%d' % self.length
         return ''
 
+    def get_item_type( self, type_registry ):
+        return IntType( location=self.get_location() )
+
+    def get_instance_attribute_type( self, type_registry, attribute_name ):
+        if attribute_name in self._methods:
+            return self._methods[attribute_name]
+        return super(BytesType, self).get_instance_attribute_type( type_registry,
+                                                                   attribute_name )
+
+def _bytes_find_return_type( type_registry, arg_types, location ):
+    if not 1 <= len(arg_types) <= 2:
+        raise ValueError( 'bytes.find() takes a sub-sequence and an optional start' )
+    return IntType( location=location )
+
 class ModuleType(Type):
     def __init__( self, module ):
         super(ModuleType, self).__init__()
@@ -301,9 +778,13 @@ class ModuleType(Type):
         """
         if hasattr( self._module, attribute_name ):
             attribute = getattr( self._module, attribute_name )
-            attribute_type = type_registry.from_python_object( attribute )
+            attribute_type = type_registry.from_python_object( attribute,
+                                                               self.get_location() )
             return attribute_type
-        raise ValueError( "Unsupported module attribute: %r.%s" % (self.class_type, attribute_name) )
+        raise ValueError( "Unsupported module attribute: %r.%s" % (self._module, attribute_name) )
+
+    def get_module_object( self ):
+        return self._module
 
     def _repr_detail_str( self ):
         return ', module=%s' % self._module
@@ -316,7 +797,9 @@ class UnknownType(Type):
         super(UnknownType, self).__init__( location=location )
         self.candidates = []
         self._resolved_type = None
+        self._resolving = False
         self.attribute_types = {} # dict{name: UnknownType}
+        self.attribute_access_counts = collections.Counter() # {name: count}
 
     def add_candidate_type( self, candidate_type ):
         if self._resolved_type is None:
@@ -333,29 +816,60 @@ class UnknownType(Type):
         for attribute_name, attribute_types in self.attribute_types.items():
             for attribute_type in attribute_types:
                 r_type.record_attribute_type( attribute_name, attribute_type )
+        for attribute_name, count in self.attribute_access_counts.items():
+            for index in range(0, count):
+                r_type.record_attribute_access( attribute_name )
 
     def get_resolved_type( self, type_registry ):
         if self._resolved_type is None:
-            types = set( r_type.get_resolved_type(type_registry)
-                         for r_type in self.candidates )
-##            if len(self.candidates) == 0:
-##                print( "**** Can not resolve self:")
-            
+            if self._resolving:
+                # Recursive definition such as x = x + 1: this candidate does
+                # not bring any new type information.
+                _ResolutionTracker.cycle_count += 1
+                return None
+            cycle_count = _ResolutionTracker.cycle_count
+            self._resolving = True
+            _ResolutionTracker.depth += 1
+            try:
+                types = set( r_type.get_resolved_type(type_registry)
+                             for r_type in self.candidates )
+            finally:
+                self._resolving = False
+                _ResolutionTracker.depth -= 1
+            types.discard( None )
+            if not types:
+                if not self.candidates and _ResolutionTracker.depth > 0:
+                    # e.g. parameter of a function that is never called:
+                    # it does not bring any type information.
+                    _ResolutionTracker.cycle_count += 1
+                    return None
+                if not self.candidates:
+                    raise ValueError( 'Can not resolve unknown type%s: no candidate type' %
+                                      self.get_location_str() )
+                return None
+            container_types = [t for t in types if type(t) in (ListType, DictType)]
+            if (len(container_types) > 1 and len(container_types) == len(types) and
+                len(set( type(t) for t in container_types )) == 1):
+                # Containers built at distinct places: unify their item type
+                for container_type in container_types[1:]:
+                    container_types[0].merge( container_type )
+                types = set( container_types[:1] )
             first_type = next(iter(types))
             if len(types) == 1:
-                self.set_resolved_type( first_type )
+                resolved_type = first_type
             else:
                 primitive_types = [t for t in types if t.is_primitive_type()]
                 if len(primitive_types) == len(types):
-                    same_types = [t for t in types
-                                  if isinstance(t, first_type.__class__)]
-                    if len(same_types) != len(types):
+                    resolved_type = promote_primitive_types( types )
+                    if resolved_type is None:
                         raise ValueError( 'Can not resolve unknown type%s because it is made of distinct primitive types: %r' %
                                           (self.get_location_str(), self) )
-                    self.set_resolved_type( first_type )
                 else:
                     raise ValueError( 'Can not resolve unknown type%s (made of distinct non primitive types): %r' %
                                       (self.get_location_str(), self) )
+            if _ResolutionTracker.is_complete( cycle_count ):
+                self.set_resolved_type( resolved_type )
+            return resolved_type
         return self._resolved_type
 
     def get_known_attribute_type( self, attribute_name ):
@@ -374,6 +888,15 @@ class UnknownType(Type):
         else:
             self.attribute_types[attribute_name] = [ attribute_type ]
 
+    def record_attribute_access( self, attribute_name ):
+        """Records attribute's accesses. They are "replayed" when the type is
+           resolved.
+        """
+        if self._resolved_type:
+            self._resolved_type.record_attribute_access( attribute_name )
+        else:
+            self.attribute_access_counts[attribute_name] += 1
+
     def get_instance_attribute_type( self, type_registry, attribute_name ):
         """Gets the type of a class/instance attribute.
         """
@@ -383,10 +906,92 @@ class UnknownType(Type):
             return self.candidates[0].get_instance_attribute_type( type_registry, attribute_name )
         return super(UnknownType, self).get_instance_attribute_type( type_registry, attribute_name )
 
+    def get_item_type( self, type_registry ):
+        if self._resolved_type:
+            return self._resolved_type.get_item_type( type_registry )
+        if len(self.candidates) == 1:
+            return self.candidates[0].get_item_type( type_registry )
+        return super(UnknownType, self).get_item_type( type_registry )
+
+    def record_item_type( self, r_type ):
+        if self._resolved_type:
+            return self._resolved_type.record_item_type( r_type )
+        if len(self.candidates) == 1:
+            return self.candidates[0].record_item_type( r_type )
+        return super(UnknownType, self).record_item_type( r_type )
+
+    def record_index_type( self, r_type ):
+        if self._resolved_type:
+            return self._resolved_type.record_index_type( r_type )
+        if len(self.candidates) == 1:
+            return self.candidates[0].record_index_type( r_type )
+
+    def get_iteration_item_type( self, type_registry ):
+        if self._resolved_type:
+            return self._resolved_type.get_iteration_item_type( type_registry )
+        if len(self.candidates) == 1:
+            return self.candidates[0].get_iteration_item_type( type_registry )
+        return super(UnknownType, self).get_iteration_item_type( type_registry )
+
     def _repr_detail_str( self ):
         resolved = ', resolved=%s' % repr(self._resolved_type) if self._resolved_type else ''
         return resolved + ', candidates=%s' % ', '.join( repr(c) for c in self.candidates )
 
+def _len_return_type( type_registry, arg_types, location ):
+    if len(arg_types) != 1:
+        raise ValueError( 'len() takes exactly one argument' )
+    return IntType( location=location )
+
+def _range_return_type( type_registry, arg_types, location ):
+    if not 1 <= len(arg_types) <= 3:
+        raise ValueError( 'range() takes from 1 to 3 arguments' )
+    return RangeType( location=location )
+
+def _soa_return_type( type_registry, arg_types, location ):
+    if len(arg_types) != 2:
+        raise ValueError( 'rpy.soa() takes exactly two arguments: class and length' )
+    if not isinstance( arg_types[0], ClassType ):
+        raise ValueError( 'rpy.soa() first argument must be a class, not %r' %
+                          arg_types[0] )
+    return type_registry.get_soa_type( arg_types[0] )
+
+def _make_math_return_type( name, arg_count, r_type_class ):
+    """Returns the return type factory of a math function taking arg_count
+       numeric arguments.
+    """
+    def return_type_factory( type_registry, arg_types, location ):
+        if len(arg_types) != arg_count:
+            raise ValueError( 'Only %s() with %d argument(s) is supported' % (name, arg_count) )
+        return r_type_class( location=location )
+    return return_type_factory
+
+def _abs_return_type( type_registry, arg_types, location ):
+    if len(arg_types) != 1:
+        raise ValueError( 'abs() takes exactly one argument' )
+    return PromotedType( arg_types, IntType, location=location ) # abs(True) is 1
+
+def _min_max_return_type( type_registry, arg_types, location ):
+    if len(arg_types) < 2:
+        raise ValueError( 'min() and max() of an iterable are not supported' )
+    return PromotedType( arg_types, location=location )
+
+# Python functions lowered to LLVM intrinsics or inline IR: (builtin name,
+# return type factory). See CodeGenerator.generate_builtin_<builtin name>.
+_NUMERIC_BUILTINS = {
+    abs: ('abs', _abs_return_type),
+    min: ('min', _min_max_return_type),
+    max: ('max', _min_max_return_type),
+    math.sqrt: ('math_sqrt', _make_math_return_type( 'math.sqrt', 1, FloatType )),
+    math.exp: ('math_exp', _make_math_return_type( 'math.exp', 1, FloatType )),
+    math.log: ('math_log', _make_math_return_type( 'math.log', 1, FloatType )),
+    math.sin: ('math_sin', _make_math_return_type( 'math.sin', 1, FloatType )),
+    math.cos: ('math_cos', _make_math_return_type( 'math.cos', 1, FloatType )),
+    math.pow: ('math_pow', _make_math_return_type( 'math.pow', 2, FloatType )),
+    math.fabs: ('math_fabs', _make_math_return_type( 'math.fabs', 1, FloatType )),
+    math.floor: ('math_floor', _make_math_return_type( 'math.floor', 1, IntType )),
+    math.ceil: ('math_ceil', _make_math_return_type( 'math.ceil', 1, IntType ))
+    }
+
 ##PREDEFINED_MODULES = {
 ##    'codecs': native_module( {
 ##        'open': native_function( [('filename': StringType())], [(
@@ -397,14 +1002,28 @@ class ConstantTypeRegistry(object):
     """Deduces and remember the RPython type associated to a python object (type or constant value).
     """
     def __init__( self ):
-        self.constant_types = {} # dict {object: Type}
+        self.constant_types = { # dict {object: Type}
+            len: BuiltinFunctionType( 'len', _len_return_type ),
+            range: BuiltinFunctionType( 'range', _range_return_type ),
+            rpy.structofarrays.soa: BuiltinFunctionType( 'soa', _soa_return_type )
+            }
+        for py_function, (name, return_type_factory) in _NUMERIC_BUILTINS.items():
+            self.constant_types[py_function] = BuiltinFunctionType( name, return_type_factory )
+        self.soa_types = {} # dict {ClassType: SoAType}
         self.instance_types = {} # dict {id(object): Type} for non-hashable object
         self.on_referenced_callable = None
         self.primitive_factories = {
             list: lambda o: ListType(),
             str: lambda obj: StringType( len(obj) ),
             bytes: lambda obj: BytesType( len(obj) ),
-            int: lambda obj: IntType()
+            int: lambda obj: IntType(),
+            bool: lambda obj: BoolType(),
+            float: lambda obj: FloatType()
+            }
+        self.primitive_types = { # dict {python type: Type class}
+            int: IntType,
+            bool: BoolType,
+            float: FloatType
             }
 
     def set_callable_listener( self, listener ):
@@ -439,6 +1058,12 @@ class ConstantTypeRegistry(object):
 ##            obj_type = FunctionType( obj )
 ##            if self.on_referenced_callable:
 ##                self.on_referenced_callable( obj_type )
+        elif isinstance( obj, rpy.foreign.ForeignFunction ):
+            obj_type = ForeignFunctionType( obj )
+        elif isinstance( obj, type ) and issubclass( obj, ctypes.Structure ):
+            obj_type = CStructType( obj )
+        elif isinstance( obj, type ) and getattr( obj, 'rpy_native', False ):
+            obj_type = NativeClassType( obj )
         elif isinstance( obj, type ):
             obj_type = ClassType( obj )
             if self.on_referenced_callable:
@@ -460,4 +1085,43 @@ class ConstantTypeRegistry(object):
         obj_type.set_location( location )
         return obj_type
 
-#    def get_builtin_type( self, name ):
\ No newline at end of file
+    def from_python_type( self, py_type, location ):
+        """Returns the Type of the values of the given python type.
+           Used to declare the entry point parameter types without sample
+           values. For a class, the type of its instances is returned.
+        """
+        if py_type in self.primitive_types:
+            obj_type = self.primitive_types[py_type]()
+            obj_type.set_location( location )
+            return obj_type
+        if py_type in (bytes, bytearray, memoryview): # buffer, see rpy.nativebytes
+            return BytesType()
+        if isinstance( py_type, rpy.nativelist.ListSignature ):
+            r_item_type = self.from_python_type( py_type.item_py_type, location )
+            obj_type = ListType( location=location )
+            obj_type.record_item_type( r_item_type )
+            return obj_type
+        if isinstance( py_type, type ):
+            class_type = self.from_python_object( py_type, location )
+            return class_type.instance_type
+        raise ValueError( "Unsupported python type for parameter: %r" % (py_type,) )
+
+    def get_builtin_type( self, name ):
+        """Returns the type of a python builtin (global variable not defined
+           in the module of the function).
+        """
+        if not hasattr( builtins, name ):
+            raise ValueError( 'Undefined global variable: %s' % name )
+        py_object = getattr( builtins, name )
+        try:
+            return self.constant_types[py_object]
+        except (KeyError, TypeError):
+            raise ValueError( 'Unsupported builtin: %s' % name )
+
+    def get_soa_type( self, class_type ):
+        """Returns the SoAType of the struct of arrays containers of instances
+           of class_type.
+        """
+        if class_type not in self.soa_types:
+            self.soa_types[class_type] = SoAType( class_type )
+        return self.soa_types[class_type]
@@ -0,0 +1,168 @@
+"""Double-buffered streaming of a file through a compiled kernel.
+
+    def count_lines(data):
+        count = 0
+        start = data.find( 10 )
+        while start >= 0:
+            count = count + 1
+            start = data.find( 10, start + 1 )
+        return count
+
+    with RawFile( path, 'rb' ) as f:
+        total = rpy.stream( count_lines, f, reducer=operator.add )
+
+The file is read in chunks of chunk_size bytes by a background thread into
+one of two buffers while the kernel processes the other one, so I/O and
+compute overlap. The kernel receives each chunk as a bytes parameter, passed
+to the native code without copy (see rpy.nativebytes). The buffers are
+reused: the kernel must not keep references to the chunk. If the compiled
+kernel bails out, CPython re-executes it with a bytes copy of the chunk.
+
+If delimiter is specified, chunks end after the last delimiter they contain
+and the incomplete record is moved to the start of the next chunk, so the
+kernel only sees whole records (lines for b'\\n').
+"""
+import threading
+import types
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+_NO_INITIAL = object()
+
+def stream( kernel, rawfile, chunk_size=DEFAULT_CHUNK_SIZE, reducer=None,
+            initial=_NO_INITIAL, delimiter=None ):
+    """Calls kernel on each chunk of rawfile (a RawFile, or any file object
+       with readinto()) from the current position until EOF.
+       kernel is a python function, compiled for a bytes parameter, or a
+       CompiledFunction. If reducer is None, returns the list of the kernel
+       results, otherwise returns their reduction by
+       reducer( accumulated, result ), starting with initial if specified.
+    """
+    if chunk_size <= 0:
+        raise ValueError( 'Invalid chunk size: %r' % chunk_size )
+    if isinstance( kernel, types.FunctionType ):
+        import rpy
+        kernel = rpy.compile( kernel, (bytes,) )
+    reader = ChunkReader( rawfile, chunk_size, delimiter )
+    reader.start()
+    results = []
+    accumulated = initial
+    try:
+        while True:
+            chunk = reader.get_chunk()
+            if chunk is None:
+                break
+            try:
+                result = kernel( chunk )
+            finally:
+                reader.release_chunk( chunk )
+            if reducer is None:
+                results.append( result )
+            elif accumulated is _NO_INITIAL:
+                accumulated = result
+            else:
+                accumulated = reducer( accumulated, result )
+    finally:
+        reader.stop()
+    if reducer is None:
+        return results
+    if accumulated is _NO_INITIAL:
+        raise TypeError( 'stream() of an empty file with no initial value' )
+    return accumulated
+
+
+class ChunkReader(object):
+    """Background thread filling the buffers of stream(). A buffer is either
+       owned by the reader thread, or holds a chunk waiting for or processed
+       by the kernel.
+    """
+    def __init__( self, rawfile, chunk_size, delimiter=None, buffer_count=2 ):
+        self.rawfile = rawfile
+        self.chunk_size = chunk_size
+        self.delimiter = delimiter
+        self._condition = threading.Condition()
+        self._free_buffers = [ bytearray( chunk_size ) for index in range(buffer_count) ]
+        self._chunks = [] # memoryviews of the filled buffers, in file order
+        self._buffer_by_chunk = {} # dict {id(memoryview): bytearray}
+        self._done = False # EOF reached or error
+        self._error = None # exception raised by the reader thread
+        self._stopped = False
+        self._thread = threading.Thread( target=self._run, name='rpy-stream-reader' )
+        self._thread.daemon = True
+
+    def start( self ):
+        self._thread.start()
+
+    def get_chunk( self ):
+        """Waits for the next chunk. Returns None at EOF."""
+        with self._condition:
+            while not self._chunks and not self._done:
+                self._condition.wait()
+            if self._chunks:
+                return self._chunks.pop( 0 )
+            if self._error is not None:
+                raise self._error
+            return None
+
+    def release_chunk( self, chunk ):
+        """Gives the buffer of chunk back to the reader thread."""
+        with self._condition:
+            buffer = self._buffer_by_chunk.pop( id(chunk) )
+            chunk.release()
+            self._free_buffers.append( buffer )
+            self._condition.notify_all()
+
+    def stop( self ):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _run( self ):
+        carry = b'' # incomplete record at the end of the previous chunk
+        try:
+            while True:
+                with self._condition:
+                    while not self._free_buffers and not self._stopped:
+                        self._condition.wait()
+                    if self._stopped:
+                        return
+                    buffer = self._free_buffers.pop()
+                size, carry = self._fill( buffer, carry )
+                with self._condition:
+                    if size:
+                        chunk = memoryview( buffer )[:size]
+                        self._buffer_by_chunk[id(chunk)] = buffer
+                        self._chunks.append( chunk )
+                    else:
+                        self._done = True
+                    self._condition.notify_all()
+                    if self._done:
+                        return
+        except BaseException as e:
+            with self._condition:
+                self._error = e
+                self._done = True
+                self._condition.notify_all()
+
+    def _fill( self, buffer, carry ):
+        """Fills buffer with carry followed by the file data. Returns the
+           size of the chunk and the data to carry to the next chunk.
+        """
+        view = memoryview( buffer )
+        try:
+            size = len(carry)
+            view[:size] = carry
+            while size < len(buffer):
+                count = self.rawfile.readinto( view[size:] )
+                if not count: # EOF
+                    return size, b''
+                size += count
+        finally:
+            view.release()
+        if self.delimiter is None:
+            return size, b''
+        end = buffer.rfind( self.delimiter, 0, size ) + len(self.delimiter)
+        if end < len(self.delimiter):
+            raise ValueError( 'Record larger than the chunk size (%d bytes)' % self.chunk_size )
+        return end, bytes( buffer[end:size] )
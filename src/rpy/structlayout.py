@@ -0,0 +1,66 @@
+"""Layout of the LLVM structures generated for compiled classes.
+
+The layout of a class is selected by its rpy_layout class attribute:
+
+    class Particle:
+        rpy_layout = rpy.LAYOUT_HOT_FIRST
+
+- LAYOUT_PACKED (default): attributes are sorted by decreasing alignment then
+  size, which removes the padding between fields.
+- LAYOUT_HOT_FIRST: the most accessed attributes (static count of the
+  attribute loads and stores in the compiled call graph) are placed first,
+  so that they share the first cache line of the instance. Attributes
+  accessed the same number of times are packed.
+- LAYOUT_DECLARED: attributes are kept in the order they are first seen by
+  the type inference.
+"""
+import collections
+
+LAYOUT_PACKED = 'packed'
+LAYOUT_HOT_FIRST = 'hot_first'
+LAYOUT_DECLARED = 'declared'
+
+DEFAULT_LAYOUT = LAYOUT_PACKED
+
+StructField = collections.namedtuple( 'StructField',
+    'name size alignment access_count' )
+
+def get_class_layout( py_class ):
+    layout = getattr( py_class, 'rpy_layout', DEFAULT_LAYOUT )
+    if layout not in (LAYOUT_PACKED, LAYOUT_HOT_FIRST, LAYOUT_DECLARED):
+        raise ValueError( 'Unsupported rpy_layout for class %s: %r' %
+                          (py_class.__name__, layout) )
+    return layout
+
+def _packed_key( field ):
+    # The name makes the order deterministic
+    return (-field.alignment, -field.size, field.name)
+
+def order_fields( fields, layout ):
+    """Returns the list of StructField fields in the order they should be
+       laid out in the structure.
+    """
+    if layout == LAYOUT_DECLARED:
+        return list(fields)
+    if layout == LAYOUT_HOT_FIRST:
+        return sorted( fields, key=lambda field: (-field.access_count,) +
+                                                 _packed_key( field ) )
+    return sorted( fields, key=_packed_key )
+
+def get_padding_size( fields ):
+    """Returns the number of padding bytes of a structure made of fields
+       (in order), including the tail padding.
+    """
+    offset = 0
+    max_alignment = 1
+    padding = 0
+    for field in fields:
+        misalignment = offset % field.alignment
+        if misalignment:
+            padding += field.alignment - misalignment
+            offset += field.alignment - misalignment
+        offset += field.size
+        max_alignment = max( max_alignment, field.alignment )
+    if offset % max_alignment:
+        padding += max_alignment - offset % max_alignment
+    return padding
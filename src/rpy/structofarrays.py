@@ -0,0 +1,71 @@
+"""Struct of arrays containers.
+
+    points = rpy.soa( Point, n )
+    for index in range(n):
+        points[index].x = index
+    total = 0
+    for p in points:
+        total += p.x
+
+rpy.soa() returns a container of n instances of a class where each attribute
+is stored in its own contiguous column instead of storing each instance
+separately. Items are views (container, index) supporting the attribute
+syntax of the instances. Attributes are initialized to 0 and the class
+constructor is never called.
+
+In compiled code, the columns are native arrays: iterating over the items
+while reading an attribute is a unit-stride loop. This module provides the
+implementation used when the code is executed by CPython.
+"""
+
+class StructOfArrays(object):
+    def __init__( self, item_class, length ):
+        if length < 0:
+            raise ValueError( 'Negative struct of arrays length: %d' % length )
+        self.item_class = item_class
+        self._length = length
+        self._columns = {} # dict {attribute_name: list}
+
+    def __len__( self ):
+        return self._length
+
+    def get_column( self, attribute_name ):
+        """Returns the list of the values of an attribute."""
+        column = self._columns.get( attribute_name )
+        if column is None:
+            column = [0] * self._length
+            self._columns[attribute_name] = column
+        return column
+
+    def __getitem__( self, index ):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError( 'struct of arrays index out of range' )
+        return StructOfArraysItem( self, index )
+
+    def __iter__( self ):
+        for index in range(0, self._length):
+            yield StructOfArraysItem( self, index )
+
+    def __repr__( self ):
+        return 'soa(%s, %d)' % (self.item_class.__name__, self._length)
+
+class StructOfArraysItem(object):
+    """View on an item of a StructOfArrays."""
+    __slots__ = ('_soa', '_index')
+
+    def __init__( self, soa, index ):
+        object.__setattr__( self, '_soa', soa )
+        object.__setattr__( self, '_index', index )
+
+    def __getattr__( self, attribute_name ):
+        return self._soa.get_column( attribute_name )[self._index]
+
+    def __setattr__( self, attribute_name, value ):
+        self._soa.get_column( attribute_name )[self._index] = value
+
+def soa( item_class, length ):
+    """Returns a struct of arrays container of length instances of item_class.
+    """
+    return StructOfArrays( item_class, length )
@@ -0,0 +1,111 @@
+"""Tiered execution of entry points.
+
+A function decorated with rpy.jit is first executed by CPython while the
+number of calls is tracked for each signature (the tuple of the argument
+types). Once a signature becomes hot, the function is compiled in a background
+thread (see rpy.compile_async) and the native implementation is used for the
+following calls with that signature.
+"""
+import concurrent.futures
+import functools
+import threading
+import warnings
+
+DEFAULT_HOT_THRESHOLD = 1000
+
+class TieredFunction(object):
+    """Wraps a python function executed by CPython until it gets hot.
+    """
+    def __init__( self, py_func, threshold=DEFAULT_HOT_THRESHOLD ):
+        self.py_func = py_func
+        self.threshold = threshold
+        self._call_counts = {} # dict {signature: call count}
+        self._native_by_signature = {} # dict {signature: CompiledFunction}
+        self._compile_futures = {} # dict {signature: concurrent.futures.Future}
+        self._failed_signatures = {} # dict {signature: exception}
+        self._lock = threading.Lock()
+        functools.update_wrapper( self, py_func )
+
+    def __call__( self, *call_args, **kw_args ):
+        if kw_args: # keywords argument are not supported by compiled code
+            return self.py_func( *call_args, **kw_args )
+        import rpy
+        signature = rpy.get_signature( call_args )
+        native_func = self._native_by_signature.get( signature )
+        if native_func is not None:
+            return native_func( *call_args )
+        # Notes: the count is not updated atomically. Missing a few calls
+        # only delays the compilation.
+        call_count = self._call_counts.get( signature, 0 ) + 1
+        self._call_counts[signature] = call_count
+        if call_count >= self.threshold:
+            self._start_compilation( signature )
+        return self.py_func( *call_args )
+
+    def get_call_count( self, signature ):
+        """Returns the number of calls executed by CPython for the signature.
+        """
+        return self._call_counts.get( signature, 0 )
+
+    def is_compiled( self, signature ):
+        return signature in self._native_by_signature
+
+    def get_compilation_error( self, signature ):
+        """Returns the exception raised while compiling the signature, or None.
+        """
+        return self._failed_signatures.get( signature )
+
+    def wait_for_compilation( self, timeout=None ):
+        """Waits for all pending background compilations to complete.
+        """
+        with self._lock:
+            futures = list( self._compile_futures.items() )
+        concurrent.futures.wait( [future for _, future in futures], timeout )
+        # Notes: waiters may be notified before done callbacks are invoked
+        for signature, future in futures:
+            if future.done():
+                self._on_compiled( signature, future )
+
+    def _start_compilation( self, signature ):
+        import rpy
+        with self._lock:
+            if (signature in self._compile_futures or
+                signature in self._failed_signatures):
+                return
+            future = rpy.compile_async( self.py_func, signature )
+            self._compile_futures[signature] = future
+        future.add_done_callback(
+            lambda future: self._on_compiled( signature, future ) )
+
+    def _on_compiled( self, signature, future ):
+        """Called by the done callback of the future and by
+           wait_for_compilation(): only the first call records the result.
+        """
+        error = future.exception()
+        with self._lock:
+            if (signature in self._native_by_signature or
+                signature in self._failed_signatures):
+                return
+            if error is not None:
+                # The function keeps running in CPython for that signature
+                self._failed_signatures[signature] = error
+                warnings.warn( 'rpy.jit: failed to compile %s%r: %s' % (
+                    self.py_func.__name__, signature, error ), RuntimeWarning )
+            else:
+                # Dictionary item assignment is atomic: next calls use the native code
+                self._native_by_signature[signature] = future.result()
+
+    def __repr__( self ):
+        return '<TieredFunction %s, threshold=%d, compiled=%d>' % (
+            self.py_func.__name__, self.threshold,
+            len(self._native_by_signature) )
+
+def jit( py_func=None, threshold=DEFAULT_HOT_THRESHOLD ):
+    """Function decorator enabling tiered execution. May be used as @rpy.jit or
+       @rpy.jit( threshold=100 ).
+    """
+    if py_func is None:
+        def decorator( f ):
+            return TieredFunction( f, threshold )
+        return decorator
+    return TieredFunction( py_func, threshold )
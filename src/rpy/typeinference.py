@@ -1,4 +1,5 @@
 from rpy.opcodedecoder import make_opcode_functions_map, opname, make_opcode_functions_map, opcode_decoder
+from rpy.opcodedecoder import CMP_IN, CMP_NOT_IN
 import sys
 import rpy.rtypes as rtypes
 import bisect
@@ -56,6 +57,7 @@ class TypeAnnotator(object):
         self.local_vars = {} # Dict {local_var_index : [ rtypes.Type ] }
         self.global_types = {} # Dict {global_index: rtypes.Type}
         self.constant_types = {} # Dict {constant_index: rtypes.Type}
+        self.site_types = {} # Dict {opcode_index: rtypes.Type} of the values created by calls, list literals...
         # Function parameters are the first local variables. Initialize their types
         for index, arg_type in enumerate( self.r_func_type.get_arg_types() ):
             self.local_vars[index] = arg_type
@@ -75,6 +77,12 @@ class TypeAnnotator(object):
     def get_global_type( self, global_index ):
         return self.global_types[global_index]
 
+    def get_site_type( self, opcode_index ):
+        """Returns the type of the value created by the opcode at opcode_index
+           (value returned by a call, list literal...).
+        """
+        return self.site_types[opcode_index]
+
     def report( self ):
         print( 'Type for function', self.py_func )
         for index in range(0,self.func_code.co_nlocals):
@@ -192,11 +200,15 @@ class TypeAnnotator(object):
         arg_types = self.pop_types( nb_arg )
         print( '#'*10, 'Calling function with', arg_types )
         func_type = self.pop_type()
+        func_type.record_call()
         for index, arg_type in enumerate(arg_types):
             func_type.record_arg_type( index, arg_type )
         for parameter_name, parameter_type in kw_args.items():
             func_type.record_keyword_arg_type( parameter_name, parameter_type )
-        self.push_type( func_type.get_return_type() )
+        return_type = func_type.get_call_return_type( self.type_registry, arg_types,
+                                                      self.get_opcode_location() )
+        self.site_types[self.current_opcode_index] = return_type
+        self.push_type( return_type )
         return -1
 
     def opcode_store_fast( self, oparg ):
@@ -212,6 +224,7 @@ class TypeAnnotator(object):
     def opcode_load_attr( self, oparg ):
         attribute_name = self.func_code.co_names[oparg]
         self_type = self.pop_type()
+        self_type.record_attribute_access( attribute_name )
         attribute_type = self_type.get_instance_attribute_type(
             self.type_registry, attribute_name )
         self.push_type( attribute_type )
@@ -221,10 +234,73 @@ class TypeAnnotator(object):
         attribute_name = self.func_code.co_names[oparg]
         self_type = self.pop_type()
         attribute_type = self.pop_type()
+        self_type.record_attribute_access( attribute_name )
         print( 'Storing attribute %s of type %r' % (attribute_name, attribute_type) )
         self_type.record_attribute_type( attribute_name, attribute_type )
         return -1
 
+    def opcode_binary_subscr( self, oparg ):
+        index_type = self.pop_type()
+        container_type = self.pop_type()
+        if isinstance( index_type, rtypes.SliceType ):
+            self.push_type( container_type ) # a slice is a copy of the list
+        else:
+            container_type.record_index_type( index_type )
+            self.push_type( container_type.get_item_type( self.type_registry ) )
+        return -1
+
+    def opcode_store_subscr( self, oparg ):
+        index_type = self.pop_type()
+        container_type = self.pop_type()
+        value_type = self.pop_type()
+        container_type.record_index_type( index_type )
+        container_type.record_item_type( value_type )
+        return -1
+
+    def opcode_build_map( self, oparg ):
+        dict_type = rtypes.DictType( location=self.get_opcode_location() )
+        self.site_types[self.current_opcode_index] = dict_type
+        self.push_type( dict_type )
+        return -1
+
+    def opcode_store_map( self, oparg ):
+        key_type = self.pop_type()
+        value_type = self.pop_type()
+        dict_type = self.type_stack[-1][0]
+        dict_type.record_index_type( key_type )
+        dict_type.record_item_type( value_type )
+        return -1
+
+    def opcode_build_list( self, oparg ):
+        item_types = self.pop_types( oparg )
+        list_type = rtypes.ListType( location=self.get_opcode_location() )
+        for item_type in item_types:
+            list_type.record_item_type( item_type )
+        self.site_types[self.current_opcode_index] = list_type
+        self.push_type( list_type )
+        return -1
+
+    def opcode_build_slice( self, oparg ):
+        if oparg != 2:
+            raise ValueError( 'Slice step is not supported' )
+        self.pop_types( 2 )
+        self.push_type( rtypes.SliceType( location=self.get_opcode_location() ) )
+        return -1
+
+    def opcode_get_iter( self, oparg ):
+        iterable_type = self.pop_type()
+        self.push_type( rtypes.IteratorType( iterable_type,
+                                             location=self.get_opcode_location() ) )
+        return -1
+
+    def opcode_for_iter( self, oparg ):
+        """The code generator lowers for loops to counted loops: the iterator
+           is not kept on the stack during the loop body.
+        """
+        iterator_type = self.pop_type()
+        self.push_type( iterator_type.get_item_type( self.type_registry ) )
+        return -1
+
     def opcode_pop_top( self, oparg ):
         self.pop_type()
         return -1
@@ -234,8 +310,38 @@ class TypeAnnotator(object):
         self.r_func_type.record_return_type( return_type )
         return -1
 
+    def opcode_binary_add( self, oparg ):
+        return self.generic_binary_op()
+
+    opcode_binary_subtract = opcode_binary_add
+    opcode_binary_multiply = opcode_binary_add
+    opcode_binary_floor_divide = opcode_binary_add
+    opcode_binary_modulo = opcode_binary_add
+
+    def opcode_binary_true_divide( self, oparg ):
+        return self.generic_binary_op( min_type_class=rtypes.FloatType )
+
+    opcode_inplace_add = opcode_binary_add
+    opcode_inplace_subtract = opcode_binary_subtract
+    opcode_inplace_multiply = opcode_binary_multiply
+    opcode_inplace_floor_divide = opcode_binary_floor_divide
+    opcode_inplace_modulo = opcode_binary_modulo
+    opcode_inplace_true_divide = opcode_binary_true_divide
+
+    def generic_binary_op( self, min_type_class=rtypes.IntType ):
+        """The result type is the promotion of the operand types.
+           Notes: arithmetic operations on bool returns an int.
+        """
+        operand_types = self.pop_types( 2 )
+        opcode_location = self.get_opcode_location()
+        self.push_type( rtypes.PromotedType( operand_types, min_type_class,
+                                             location=opcode_location ) )
+        return -1
+
     def opcode_compare_op( self, oparg ):
         cmp_types = self.pop_types( 2 )
+        if oparg in (CMP_IN, CMP_NOT_IN): # key in dict
+            cmp_types[1].record_index_type( cmp_types[0] )
         opcode_location = self.get_opcode_location()
         self.push_type( rtypes.BoolType( location=opcode_location ) )
         return -1
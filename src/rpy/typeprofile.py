@@ -0,0 +1,151 @@
+"""Runtime type profile recording.
+
+Functions wrapped by a TypeProfiler are executed by CPython while the
+signatures (tuple of the argument types) they are called with are counted.
+The signatures are those of rpy.get_signature() (e.g. an array.array
+argument is recorded as a ListSignature), the ones looked up by rpy.jit.
+The profile is saved as a JSON manifest that is used at deployment time to
+precompile only the signatures seen in production:
+
+    profiler = rpy.TypeProfiler()
+
+    @profiler.profile
+    def kernel( x, y ):
+        ...
+
+    profiler.save_manifest( 'types.json' )
+    # later...
+    futures = rpy.precompile_manifest( 'types.json' )
+"""
+import collections
+import functools
+import importlib
+import json
+import threading
+from rpy.nativelist import ListSignature
+
+MANIFEST_VERSION = 1
+
+def get_qualified_name( obj ):
+    """Returns the name 'module.qualified_name' of a function or class.
+    """
+    name = getattr( obj, '__qualname__', obj.__name__ )
+    return '%s.%s' % (obj.__module__, name)
+
+def resolve_qualified_name( qualified_name ):
+    """Returns the function or class corresponding to the name returned by
+       get_qualified_name(). Only objects reachable from their module globals
+       (no nested function) can be resolved.
+    """
+    parts = qualified_name.split( '.' )
+    for index in range(len(parts) - 1, 0, -1):
+        try:
+            obj = importlib.import_module( '.'.join( parts[:index] ) )
+        except ImportError:
+            continue
+        for name in parts[index:]:
+            obj = getattr( obj, name )
+        return obj
+    raise ValueError( 'Can not resolve "%s"' % qualified_name )
+
+def _get_type_name( py_type ):
+    """Returns the JSON representation of a signature type: its qualified
+       name, or {"list": item type name} for a ListSignature.
+    """
+    if isinstance( py_type, ListSignature ):
+        return { 'list': _get_type_name( py_type.item_py_type ) }
+    return get_qualified_name( py_type )
+
+def _resolve_type_name( type_name ):
+    """Returns the signature type represented by _get_type_name()."""
+    if isinstance( type_name, dict ):
+        return ListSignature( _resolve_type_name( type_name['list'] ) )
+    return resolve_qualified_name( type_name )
+
+class TypeProfiler(object):
+    """Records the signatures of the calls made to profiled functions.
+    """
+    def __init__( self, enabled=True ):
+        self.enabled = enabled
+        self._signature_counts = {} # dict {py_func: collections.Counter {signature: count}}
+        self._lock = threading.Lock()
+
+    def profile( self, py_func ):
+        """Function decorator recording the signature of each call.
+        """
+        import rpy
+        signature_counts = collections.Counter()
+        with self._lock:
+            self._signature_counts[py_func] = signature_counts
+        @functools.wraps( py_func )
+        def profiled_func( *call_args, **kw_args ):
+            if self.enabled and not kw_args:
+                signature = rpy.get_signature( call_args )
+                with self._lock:
+                    signature_counts[signature] += 1
+            return py_func( *call_args, **kw_args )
+        return profiled_func
+
+    def get_signature_counts( self, py_func ):
+        """Returns a list of tuple (signature, count) sorted by decreasing count.
+        """
+        with self._lock:
+            return self._signature_counts[py_func].most_common()
+
+    def reset( self ):
+        with self._lock:
+            for signature_counts in self._signature_counts.values():
+                signature_counts.clear()
+
+    def make_manifest( self ):
+        """Returns the profile as a JSON serializable dictionary.
+        """
+        functions = {}
+        with self._lock:
+            for py_func, signature_counts in self._signature_counts.items():
+                if not signature_counts:
+                    continue
+                functions[get_qualified_name( py_func )] = [
+                    { 'arg_types': [_get_type_name( py_type )
+                                    for py_type in signature],
+                      'count': count }
+                    for signature, count in signature_counts.most_common() ]
+        return { 'version': MANIFEST_VERSION, 'functions': functions }
+
+    def save_manifest( self, path ):
+        with open( path, 'wt', encoding='utf-8' ) as f:
+            json.dump( self.make_manifest(), f, indent=2, sort_keys=True )
+
+def load_manifest( path ):
+    """Loads a manifest saved by TypeProfiler.save_manifest().
+       Returns a dict {qualified function name: [(signature, count)]} where
+       signature is a tuple of python types and ListSignature.
+    """
+    with open( path, 'rt', encoding='utf-8' ) as f:
+        manifest = json.load( f )
+    if manifest.get( 'version' ) != MANIFEST_VERSION:
+        raise ValueError( 'Unsupported type manifest version: %r' %
+                          manifest.get( 'version' ) )
+    signatures_by_function = {}
+    for function_name, entries in manifest['functions'].items():
+        signatures_by_function[function_name] = [
+            (tuple( _resolve_type_name( type_name )
+                    for type_name in entry['arg_types'] ), entry['count'])
+            for entry in entries ]
+    return signatures_by_function
+
+def precompile_manifest( path, min_count=1 ):
+    """Schedules the compilation of all the signatures of the manifest called
+       at least min_count times.
+       Returns the list of concurrent.futures.Future (see rpy.compile_async).
+    """
+    import rpy
+    futures = []
+    for function_name, signatures in load_manifest( path ).items():
+        py_func = resolve_qualified_name( function_name )
+        # Gets the python function wrapped by the profiler or rpy.jit
+        py_func = getattr( py_func, '__wrapped__', py_func )
+        for signature, count in signatures:
+            if count >= min_count:
+                futures.append( rpy.compile_async( py_func, signature ) )
+    return futures
@@ -0,0 +1,64 @@
+import rpy
+import rpy.arena
+import unittest
+import threading
+
+class Point:
+    def __init__( self, xparam, yparam ):
+        self.x = xparam
+        self.y = yparam
+
+def make_point( x, y ):
+    return Point( x, y )
+
+def sum_points( n ):
+    total = 0
+    while n > 0:
+        p = make_point( n, n )
+        total = total + p.x + p.y
+        n = n - 1
+    return total
+
+class TestArena(unittest.TestCase):
+    def test_allocation_statistics( self ):
+        compiled_func = rpy.compile( sum_points, (int,) )
+        stats_before = compiled_func.get_allocation_statistics()
+        self.assertEqual( 12, compiled_func( 3 ) )
+        stats = compiled_func.get_allocation_statistics()
+        self.assertEqual( 3, stats.allocation_count - stats_before.allocation_count )
+        self.assertTrue( stats.allocated_bytes > stats_before.allocated_bytes )
+        self.assertEqual( 1, stats.release_count - stats_before.release_count )
+        self.assertEqual( 0, stats.chunk_count ) # released when the call returns
+
+    def test_chunk_refill( self ):
+        # Allocates more than a chunk
+        compiled_func = rpy.compile( sum_points, (int,) )
+        n = 10000
+        self.assertEqual( n * (n + 1), compiled_func( n ) )
+        self.assertEqual( 0, compiled_func.get_allocation_statistics().chunk_count )
+
+    def test_thread_arenas( self ):
+        compiled_func = rpy.compile( sum_points, (int,) )
+        results = []
+        # The threads stay alive until all of them got their arena slot: a slot
+        # released by a finished thread would be reused by the next one.
+        barrier = threading.Barrier( 4 )
+        def call():
+            barrier.wait()
+            stats_before = compiled_func.get_allocation_statistics()
+            result = compiled_func( 100 )
+            stats = compiled_func.get_allocation_statistics()
+            results.append( (result, stats.allocation_count - stats_before.allocation_count,
+                             rpy.arena.get_thread_arena_slot()) )
+            barrier.wait()
+        threads = [threading.Thread( target=call ) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual( [(10100, 100)] * 4, [result[:2] for result in results] )
+        self.assertEqual( 4, len(set( result[2] for result in results )) )
+
+
+if __name__ == '__main__':
+    unittest.main()
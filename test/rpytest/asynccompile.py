@@ -0,0 +1,27 @@
+import rpy
+import unittest
+
+def add2i( x, y ):
+    return x + y
+
+class TestAsyncCompile(unittest.TestCase):
+    def test_compile_async( self ):
+        future = rpy.compile_async( add2i, (int, int) )
+        self.assertEqual( 5, future.result()( 2, 3 ) )
+
+    def test_compile_async_joins_same_signature( self ):
+        future1 = rpy.compile_async( add2i, (int, int) )
+        future2 = rpy.compile_async( add2i, [int, int] )
+        self.assertTrue( future1 is future2 )
+        future3 = rpy.compile_async( add2i, (bool, bool) )
+        self.assertTrue( future1 is not future3 )
+
+    def test_compile_awaitable( self ):
+        import asyncio
+        loop = asyncio.get_event_loop()
+        compiled_func = loop.run_until_complete( rpy.compile_awaitable( add2i, (int, int) ) )
+        self.assertEqual( 7, compiled_func( 3, 4 ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
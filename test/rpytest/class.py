@@ -6,6 +6,14 @@ class Point:
         self.x = xparam
         self.y = yparam
 
+class Counter:
+    count = 0 # class default shadowed by the instance attribute
+    def __init__( self, start ):
+        self.count = start
+
+    def increment( self ):
+        self.count = self.count + 1
+
 class TestClass(unittest.TestCase):
     def test_class_decl( self ):
         def main_class_decl(x, y):
@@ -13,6 +21,13 @@ class TestClass(unittest.TestCase):
             return p.x + p.y
         self.assertEqual( 5, rpy.run( main_class_decl, 2, 3 ) )
 
+    def test_class_default_shadowed( self ):
+        def main_counter(start):
+            counter = Counter( start )
+            counter.increment()
+            return counter.count
+        self.assertEqual( 4, rpy.run( main_counter, 3 ) )
+
 
 if __name__ == '__main__':
     unittest.main()
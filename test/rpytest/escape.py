@@ -0,0 +1,74 @@
+import rpy
+import unittest
+from rpy.escapeanalysis import EscapeAnalysis, ALLOC_STACK, ALLOC_HEAP
+
+class Point:
+    def __init__( self, xparam, yparam ):
+        self.x = xparam
+        self.y = yparam
+
+class Segment:
+    def __init__( self, start, end ):
+        self.start = start
+        self.end = end
+
+def make_point( x, y ):
+    return Point( x, y )
+
+def norm1( p ):
+    return p.x + p.y
+
+def local_point( x, y ):
+    p = Point( x, y )
+    return norm1( p )
+
+def segment_length( x1, x2 ):
+    s = Segment( Point( x1, 0 ), Point( x2, 0 ) )
+    return s.end.x - s.start.x
+
+def get_allocation_strategies( py_func, py_funcs ):
+    escape_analysis = EscapeAnalysis( py_funcs )
+    escape_analysis.run()
+    analyzer = escape_analysis._analyzers[py_func]
+    return sorted( escape_analysis.get_allocation_strategy( py_func, index )
+                   for index in analyzer.allocation_sites )
+
+ALL_FUNCS = [Point.__init__, Segment.__init__, make_point, norm1,
+             local_point, segment_length]
+
+class TestEscapeAnalysis(unittest.TestCase):
+    def test_returned_instance_escapes( self ):
+        self.assertEqual( [ALLOC_HEAP],
+                          get_allocation_strategies( make_point, ALL_FUNCS ) )
+
+    def test_local_instance( self ):
+        self.assertEqual( [ALLOC_STACK],
+                          get_allocation_strategies( local_point, ALL_FUNCS ) )
+
+    def test_stored_instance_escapes( self ):
+        self.assertEqual( [ALLOC_HEAP, ALLOC_HEAP, ALLOC_STACK],
+                          get_allocation_strategies( segment_length, ALL_FUNCS ) )
+
+class TestHeapInstance(unittest.TestCase):
+    def test_factory( self ):
+        def main(x, y):
+            p = make_point( x, y )
+            return p.x * p.y
+        self.assertEqual( 6, rpy.run( main, 2, 3 ) )
+
+    def test_nested_instances( self ):
+        self.assertEqual( 5, rpy.run( segment_length, 2, 7 ) )
+
+    def test_stack_instance_in_loop( self ):
+        def main(n):
+            total = 0
+            while n > 0:
+                p = Point( n, 1 )
+                total = total + norm1( p )
+                n = n - 1
+            return total
+        self.assertEqual( 9, rpy.run( main, 3 ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
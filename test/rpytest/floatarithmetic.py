@@ -0,0 +1,70 @@
+import rpy
+import unittest
+
+@rpy.fast_math
+def fast_modulo( x, y ):
+    return x % y
+
+class TestFloatArithmetic(unittest.TestCase):
+    def test_add_sub_mul( self ):
+        def main(x, y):
+            return (x + y) * y - x
+        self.assertEqual( 8.25, rpy.run( main, 1.5, 2.5 ) )
+
+    def test_int_promotion( self ):
+        def main(x, y):
+            return x + y
+        self.assertEqual( 3.5, rpy.run( main, 1, 2.5 ) )
+        self.assertEqual( 3.5, rpy.run( main, 2.5, 1 ) )
+
+    def test_loop_variable_promotion( self ):
+        def main(x):
+            y = 0
+            y = y + x
+            return y
+        self.assertEqual( 1.5, rpy.run( main, 1.5 ) )
+
+    def test_true_division( self ):
+        def main(x, y):
+            return x / y
+        self.assertEqual( 3.5, rpy.run( main, 7, 2 ) )
+        self.assertEqual( 0.25, rpy.run( main, 0.5, 2.0 ) )
+
+    def test_true_division_by_zero( self ):
+        def main(x, y):
+            return x / y
+        self.assertRaises( ZeroDivisionError, rpy.run, main, 1.0, 0.0 )
+
+    def test_floor_division( self ):
+        def main(x, y):
+            return x // y
+        self.assertEqual( -4.0, rpy.run( main, -7.0, 2.0 ) )
+        self.assertEqual( -4.0, rpy.run( main, 7.0, -2.0 ) )
+        self.assertEqual( 3.0, rpy.run( main, 7.5, 2.0 ) )
+
+    def test_modulo_sign( self ):
+        def main(x, y):
+            return x % y
+        self.assertEqual( 1.0, rpy.run( main, -7.0, 2.0 ) )
+        self.assertEqual( -1.0, rpy.run( main, 7.0, -2.0 ) )
+        self.assertEqual( -1.5, rpy.run( main, -7.5, -2.0 ) )
+
+    def test_fast_math_modulo( self ):
+        # C fmod semantic: the result has the sign of the dividend
+        self.assertEqual( -1.0, rpy.run( fast_modulo, -7.0, 2.0 ) )
+
+    def test_compare( self ):
+        def main(x, y):
+            return x < y
+        self.assertEqual( True, rpy.run( main, 1.5, 2.0 ) )
+        self.assertEqual( False, rpy.run( main, 2.5, 2 ) )
+
+    def test_not_equal_nan( self ):
+        def main(x):
+            return x != x
+        self.assertEqual( True, rpy.run( main, float('nan') ) )
+        self.assertEqual( False, rpy.run( main, 1.0 ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import ctypes
+import rpy
+import unittest
+from rpy.foreign import ForeignFunction
+
+@rpy.foreign( library='m', return_type=float, parameter_types={'x': float} )
+def cbrt(x):
+    pass
+
+@rpy.foreign( symbol='abs', return_type=ctypes.c_int32, parameter_types={'n': ctypes.c_int32} )
+def c_abs(n):
+    pass
+
+@rpy.foreign( symbol='memchr', return_type=ctypes.c_size_t,
+              parameter_types={'data': bytes, 'c': ctypes.c_int32, 'size': ctypes.c_size_t} )
+def find_address(data, c, size):
+    pass
+
+@rpy.foreign( library='m', return_type=ctypes.c_float, parameter_types={'x': ctypes.c_float} )
+def floorf(x):
+    pass
+
+class TestDeclaration(unittest.TestCase):
+    def test_python_call( self ):
+        self.assertAlmostEqual( 3.0, cbrt( 27.0 ) )
+        self.assertEqual( 5, c_abs( -5 ) )
+        self.assertEqual( 2.0, floorf( 2.5 ) )
+        self.assertRaises( TypeError, cbrt, 1.0, 2.0 )
+
+    def test_stub_annotations( self ):
+        def strlen(s):
+            pass
+        strlen.rpy_return_type = ctypes.c_size_t
+        strlen.rpy_parameter_types = {'s': bytes}
+        strlen = rpy.foreign()( strlen )
+        self.assertEqual( 'strlen', strlen.__name__ )
+        self.assertEqual( [bytes], strlen.argtypes )
+        self.assertEqual( 3, strlen( b'abc' ) )
+        self.assertTrue( strlen.is_unsigned_return() )
+        self.assertNotEqual( None, strlen.get_address() )
+
+    def test_invalid_declarations( self ):
+        def stub(x):
+            pass
+        self.assertRaises( ValueError, ForeignFunction, stub, 'stub' ) # undeclared x
+        self.assertRaises( ValueError, ForeignFunction, stub, 'stub', None, str, {'x': int} )
+        self.assertRaises( ValueError, ForeignFunction, stub, 'stub', None, bytes, {'x': int} )
+        self.assertRaises( ValueError, ForeignFunction, stub, 'stub', None, int, {'x': None} )
+        missing = ForeignFunction( stub, 'rpy_no_such_symbol', None, int, {'x': int} )
+        self.assertRaises( AttributeError, missing, 1 )
+
+class TestCompiledCall(unittest.TestCase):
+    def test_double( self ):
+        def sum_cbrt(n):
+            total = 0.0
+            for i in range(n):
+                total = total + cbrt( i * i * i )
+            return total
+        self.assertAlmostEqual( 45.0, rpy.run( sum_cbrt, 10 ) )
+
+    def test_narrow_types( self ):
+        def narrow(n):
+            return c_abs( n ) + floorf( 1.75 )
+        self.assertEqual( 8.0, rpy.run( narrow, -7 ) )
+
+    def test_bytes_argument( self ):
+        def find_offset(data, first, c):
+            address = find_address( data, c, len(data) )
+            if address == 0:
+                return -1
+            return address - find_address( data, first, len(data) )
+        self.assertEqual( 3, rpy.run( find_offset, b'abcdef', ord('a'), ord('d') ) )
+        self.assertEqual( -1, rpy.run( find_offset, b'abcdef', ord('a'), ord('z') ) )
+
+if __name__ == '__main__':
+    unittest.main()
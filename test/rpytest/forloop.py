@@ -0,0 +1,98 @@
+import rpy
+import unittest
+from rpy import soa
+
+class Point:
+    def __init__( self, xparam, yparam ):
+        self.x = xparam
+        self.y = yparam
+
+class TestRangeLoop(unittest.TestCase):
+    def test_range_stop( self ):
+        def main(n):
+            total = 0
+            for i in range(n):
+                total = total + i
+            return total
+        self.assertEqual( 45, rpy.run( main, 10 ) )
+        self.assertEqual( 0, rpy.run( main, -3 ) )
+
+    def test_range_start_step( self ):
+        def main(n):
+            total = 0
+            for i in range(n, 0, -2):
+                total = total + i
+            return total
+        self.assertEqual( 9 + 7 + 5 + 3 + 1, rpy.run( main, 9 ) )
+
+    def test_range_zero_step( self ):
+        def main(n):
+            total = 0
+            for i in range(0, 10, n):
+                total = total + i
+            return total
+        self.assertRaises( ValueError, rpy.run, main, 0 )
+
+    def test_range_int64_bounds( self ):
+        def up(start, stop):
+            count = 0
+            for i in range(start, stop, 2):
+                count = count + 1
+            return count
+        def down(start, stop):
+            count = 0
+            for i in range(start, stop, -2):
+                count = count + 1
+            return count
+        self.assertEqual( 1, rpy.run( up, 2**63 - 3, 2**63 - 1 ) )
+        self.assertEqual( 2, rpy.run( up, 2**63 - 4, 2**63 - 1 ) )
+        self.assertEqual( 1, rpy.run( down, -2**63 + 2, -2**63 ) )
+        self.assertEqual( 2, rpy.run( down, -2**63 + 3, -2**63 ) )
+
+    def test_break_continue( self ):
+        def main(n):
+            total = 0
+            for i in range(n):
+                if i % 2:
+                    continue
+                if i > 6:
+                    break
+                total = total + i
+            return total
+        self.assertEqual( 0 + 2 + 4 + 6, rpy.run( main, 100 ) )
+
+    def test_nested_loops( self ):
+        def main(n):
+            total = 0
+            for i in range(n):
+                for j in range(i):
+                    total = total + j
+            return total
+        self.assertEqual( 0 + 0 + 1 + 3, rpy.run( main, 4 ) )
+
+class TestContainerLoop(unittest.TestCase):
+    def test_list( self ):
+        def main(n):
+            values = [1.5, 2.5]
+            total = 0.0
+            for value in values:
+                if len(values) < n:
+                    values.append( value )
+                total = total + value
+            return total
+        self.assertEqual( 1.5 + 2.5 + 1.5 + 2.5, rpy.run( main, 4 ) )
+
+    def test_soa( self ):
+        def main(n):
+            points = soa( Point, n )
+            for i in range(n):
+                points[i].x = i
+            total = 0
+            for point in points:
+                total = total + point.x
+            return total
+        self.assertEqual( 10, rpy.run( main, 5 ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
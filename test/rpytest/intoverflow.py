@@ -0,0 +1,74 @@
+import rpy
+import unittest
+
+MIN_INT64 = -2**63
+MAX_INT64 = 2**63 - 1
+
+def square( x ):
+    return x * x
+
+class TestInt64(unittest.TestCase):
+    def test_64_bits_param( self ):
+        def main(x, y):
+            return x + y
+        self.assertEqual( 2**40 + 3, rpy.run( main, 2**40, 3 ) )
+        self.assertEqual( MAX_INT64, rpy.run( main, MAX_INT64 - 1, 1 ) )
+
+    def test_floor_division_sign( self ):
+        def main(x, y):
+            return x // y
+        self.assertEqual( -4, rpy.run( main, -7, 2 ) )
+        self.assertEqual( -4, rpy.run( main, 7, -2 ) )
+        self.assertEqual( 3, rpy.run( main, -7, -2 ) )
+
+    def test_modulo_sign( self ):
+        def main(x, y):
+            return x % y
+        self.assertEqual( 1, rpy.run( main, -7, 2 ) )
+        self.assertEqual( -1, rpy.run( main, 7, -2 ) )
+        self.assertEqual( -1, rpy.run( main, -7, -2 ) )
+
+class TestIntOverflow(unittest.TestCase):
+    def test_add_overflow( self ):
+        def main(x, y):
+            return x + y
+        self.assertEqual( MAX_INT64 + 1, rpy.run( main, MAX_INT64, 1 ) )
+
+    def test_sub_overflow( self ):
+        def main(x, y):
+            return x - y
+        self.assertEqual( MIN_INT64 - 1, rpy.run( main, MIN_INT64, 1 ) )
+
+    def test_mul_overflow( self ):
+        def main(x, y):
+            return x * y
+        self.assertEqual( 2**64, rpy.run( main, 2**32, 2**32 ) )
+
+    def test_division_overflow( self ):
+        def main(x, y):
+            return x // y
+        self.assertEqual( 2**63, rpy.run( main, MIN_INT64, -1 ) )
+
+    def test_division_by_zero( self ):
+        def main(x, y):
+            return x // y
+        self.assertRaises( ZeroDivisionError, rpy.run, main, 1, 0 )
+
+    def test_big_int_param( self ):
+        def main(x, y):
+            return x + y
+        self.assertEqual( 2**70 + 1, rpy.run( main, 2**70, 1 ) )
+
+    def test_overflow_in_called_function( self ):
+        def main(x, y):
+            return square(x) + y
+        self.assertEqual( 2**64 + 1, rpy.run( main, 2**32, 1 ) )
+        compiled_func = rpy.compile( main, (int, int) )
+        self.assertEqual( 10, compiled_func( 3, 1 ) )
+        self.assertEqual( 0, compiled_func.deoptimization_count )
+        self.assertEqual( 2**64 + 1, compiled_func( 2**32, 1 ) )
+        self.assertEqual( 1, compiled_func.deoptimization_count )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import math
+import rpy
+import unittest
+
+class TestMathFunctions(unittest.TestCase):
+    def test_float_functions( self ):
+        def main(x):
+            return math.sqrt( x ) + math.exp( 0.0 ) + math.log( x ) * 0.0 + \
+                   math.sin( 0.0 ) + math.cos( 0.0 ) + math.pow( x, 0.5 ) + math.fabs( -x )
+        self.assertEqual( 3.0 + 1.0 + 1.0 + 3.0 + 9.0, rpy.run( main, 9.0 ) )
+
+    def test_int_argument( self ):
+        def main(x):
+            return math.sqrt( x )
+        self.assertEqual( 4.0, rpy.run( main, 16 ) )
+
+    def test_hot_loop( self ):
+        def main(n):
+            total = 0.0
+            for i in range(n):
+                total = total + math.sqrt( i * 1.0 ) * math.sqrt( i * 1.0 )
+            return total
+        self.assertAlmostEqual( 4950.0, rpy.run( main, 100 ) )
+
+    def test_domain_errors( self ):
+        def sqrt(x):
+            return math.sqrt( x )
+        def log(x):
+            return math.log( x )
+        def sin(x):
+            return math.sin( x )
+        def exp(x):
+            return math.exp( x )
+        self.assertRaises( ValueError, rpy.run, sqrt, -1.0 )
+        self.assertRaises( ValueError, rpy.run, log, 0.0 )
+        self.assertRaises( ValueError, rpy.run, sin, float('inf') )
+        self.assertRaises( OverflowError, rpy.run, exp, 1000.0 )
+        self.assertTrue( math.isnan( rpy.run( sqrt, float('nan') ) ) )
+
+    def test_floor_ceil( self ):
+        def main(x):
+            return math.floor( x ) * 1000 + math.ceil( x )
+        self.assertEqual( -3000 - 2, rpy.run( main, -2.5 ) )
+        self.assertEqual( 7007, rpy.run( main, 7 ) )
+        self.assertEqual( 2**64 * 1000 + 2**64, rpy.run( main, 2.0**64 ) ) # big int
+
+    def test_abs( self ):
+        def main(x):
+            return abs( x )
+        self.assertEqual( 5, rpy.run( main, -5 ) )
+        self.assertEqual( 2.5, rpy.run( main, -2.5 ) )
+        self.assertEqual( 1, rpy.run( main, True ) )
+        self.assertEqual( 2**63, rpy.run( main, -2**63 ) ) # big int
+
+    def test_min_max( self ):
+        def main(x, y, z):
+            return min( x, y, z ) * 100 + max( x, y )
+        self.assertEqual( -95, rpy.run( main, 5, 3, -1 ) )
+        self.assertEqual( 152.5, rpy.run( main, 1.5, 2.5, 3 ) )
+
+    def test_min_max_nan( self ):
+        def main(x, y):
+            return min( x, y )
+        self.assertEqual( 1.0, rpy.run( main, 1.0, float('nan') ) )
+        self.assertTrue( math.isnan( rpy.run( main, float('nan'), 1.0 ) ) )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import ctypes
+import rpy
+import unittest
+from rpy import nativebytes
+
+class TestBufferHandle(unittest.TestCase):
+    def test_bytearray( self ):
+        py_value = bytearray( b'abc' )
+        handle = nativebytes.BufferHandle( py_value )
+        header = nativebytes.NativeBytes.from_address( handle.address )
+        self.assertEqual( 3, header.length )
+        self.assertEqual( b'abc', ctypes.string_at( header.data, header.length ) )
+        # The buffer is held: the bytearray can not be resized
+        self.assertRaises( BufferError, py_value.append, 100 )
+        handle.release( True )
+        py_value.append( 100 )
+
+    def test_memoryview( self ):
+        py_value = memoryview( b'0123456789' )[2:5]
+        handle = nativebytes.BufferHandle( py_value )
+        header = nativebytes.NativeBytes.from_address( handle.address )
+        self.assertEqual( b'234', ctypes.string_at( header.data, header.length ) )
+        handle.release( True )
+
+    def test_unsupported( self ):
+        self.assertRaises( ValueError, nativebytes.BufferHandle, 'text' )
+        self.assertRaises( ValueError, nativebytes.BufferHandle, 3 )
+
+    def test_signature( self ):
+        self.assertEqual( (bytes, bytes, bytes),
+                          rpy.get_signature( (b'', bytearray(), memoryview( b'' )) ) )
+
+class TestCompiledBytes(unittest.TestCase):
+    def test_index_and_slice( self ):
+        def main(n):
+            data = b'hello world'
+            word = data[n:]
+            return word[0] + len(word)
+        self.assertEqual( ord('w') + 5, rpy.run( main, 6 ) )
+
+    def test_find( self ):
+        def main(n):
+            data = b'key=value;key=other'
+            return data.find( b'key', n ) * 100 + data.find( 61 )
+        self.assertEqual( 10 * 100 + 3, rpy.run( main, 1 ) )
+        self.assertEqual( -100 + 3, rpy.run( main, 11 ) )
+
+    def test_compare( self ):
+        def main(n):
+            data = b'abcdef'
+            count = 0
+            if data[:n] == b'abc':
+                count = count + 1
+            if data[:n] < b'abd':
+                count = count + 10
+            if b'cd' in data[:n]:
+                count = count + 100
+            return count
+        self.assertEqual( 11, rpy.run( main, 3 ) )
+        self.assertEqual( 110, rpy.run( main, 4 ) )
+
+    def test_buffer_parameter( self ):
+        def count_lines(data):
+            count = 0
+            start = data.find( 10 )
+            while start >= 0:
+                count = count + 1
+                start = data.find( 10, start + 1 )
+            return count
+        text = b'a\nbb\n\nccc\n'
+        self.assertEqual( 4, rpy.run( count_lines, text ) )
+        self.assertEqual( 4, rpy.run( count_lines, bytearray( text ) ) )
+        self.assertEqual( 2, rpy.run( count_lines, memoryview( text )[:5] ) )
+
+    def test_buffer_released_for_big_int( self ):
+        def shift(data, offset):
+            return data.find( 10 ) + offset
+        compiled_func = rpy.compile( shift, (bytes, int) )
+        py_value = bytearray( b'a\n' )
+        self.assertEqual( 2**64 + 1, compiled_func( py_value, 2**64 ) ) # re-executed by CPython
+        py_value.append( 0 ) # the buffer was released
+
+
+if __name__ == '__main__':
+    unittest.main()
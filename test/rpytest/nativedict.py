@@ -0,0 +1,80 @@
+import ctypes
+import rpy
+import unittest
+from rpy import nativedict
+
+class TestDictHeader(unittest.TestCase):
+    def test_dict_from_header( self ):
+        entry_ctype = nativedict.get_entry_ctype( str, float )
+        key = ctypes.create_string_buffer( 'clé'.encode( 'utf-8' ) )
+        entries = (entry_ctype * 2)()
+        entries[1].state = nativedict.ENTRY_USED
+        entries[1].key = nativedict.NativeBytes( ctypes.addressof( key ), len(key) - 1 )
+        entries[1].value = 2.5
+        header = nativedict.DictHeader( ctypes.addressof( entries ), 1, 2 )
+        self.assertEqual( {'clé': 2.5},
+                          nativedict.dict_from_header_address( ctypes.addressof( header ),
+                                                               str, float ) )
+
+class TestCompiledDict(unittest.TestCase):
+    def test_int_keys( self ):
+        def main(n):
+            counts = {}
+            for i in range(n):
+                key = i % 7
+                if key in counts:
+                    counts[key] = counts[key] + 1
+                else:
+                    counts[key] = 1
+            return counts[3] * 100 + len(counts)
+        self.assertEqual( 15 * 100 + 7, rpy.run( main, 100 ) )
+
+    def test_missing_key( self ):
+        def main(n):
+            values = {1: 2.5, 2: 3.5}
+            return values[n]
+        self.assertEqual( 3.5, rpy.run( main, 2 ) )
+        self.assertRaises( KeyError, rpy.run, main, 3 )
+
+    def test_get_and_iteration( self ):
+        def main(n):
+            squares = {}
+            for i in range(n):
+                squares[i] = i * i
+            total = 0
+            for key in squares:
+                total = total + squares.get( key, 0 ) + squares.get( -key - 1, 1000 )
+            return total
+        self.assertEqual( 0 + 1 + 4 + 9 + 4 * 1000, rpy.run( main, 4 ) )
+
+    def test_changed_during_iteration( self ):
+        def main(n):
+            values = {1: 1, 2: 2}
+            for key in values:
+                values[key + n] = key
+            return len(values)
+        self.assertEqual( 2, rpy.run( main, 0 ) ) # same keys, same size
+        self.assertRaises( RuntimeError, rpy.run, main, 10 )
+
+    def test_str_keys( self ):
+        def main(n):
+            prices = {'apple': 2, 'pear': 3}
+            if n > 0:
+                prices['apple'] = n
+            return prices['apple'] + prices['pear']
+        self.assertEqual( 10 + 3, rpy.run( main, 10 ) )
+
+    def test_return_dict( self ):
+        def main(n):
+            counts = {}
+            for i in range(n):
+                if i % 2 == 0:
+                    counts[b'even'] = i
+                else:
+                    counts[b'odd'] = i
+            return counts
+        self.assertEqual( {b'even': 4, b'odd': 3}, rpy.run( main, 5 ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import rpy
+import tempfile
+import unittest
+from rpy import nativeio
+from rpybuiltin import builtin
+
+class TestFileHandle(unittest.TestCase):
+    def setUp( self ):
+        fd, self.path = tempfile.mkstemp()
+        os.write( fd, b'0123456789' )
+        os.close( fd )
+
+    def tearDown( self ):
+        os.unlink( self.path )
+
+    def test_position( self ):
+        with builtin.RawFile( self.path, 'rb' ) as f:
+            self.assertEqual( b'0123', f.readline( 4 ) ) # read ahead is dropped
+            handle = nativeio.FileHandle( f )
+            native = nativeio.NativeFile.from_address( handle.address )
+            self.assertEqual( (f.fileno(), 4), (native.fd, native.position) )
+            native.position = 7
+            handle.release( False )
+            self.assertEqual( 4, f.tell() )
+            handle.release( True )
+            self.assertEqual( 7, f.tell() )
+
+    def test_written_not_re_executed( self ):
+        with builtin.RawFile( self.path, 'r+b' ) as f:
+            handle = nativeio.FileHandle( f )
+            native = nativeio.NativeFile.from_address( handle.address )
+            self.assertEqual( 0, native.written )
+            native.written = 3
+            self.assertRaises( IOError, handle.release, False )
+            handle.release( True )
+
+    def test_unsupported( self ):
+        self.assertRaises( ValueError, nativeio.FileHandle, open( self.path, 'rb' ) )
+        with builtin.RawFile( self.path, 'ab' ) as f:
+            self.assertRaises( ValueError, nativeio.FileHandle, f )
+
+class TestCompiledFile(unittest.TestCase):
+    def setUp( self ):
+        fd, self.path = tempfile.mkstemp()
+        os.write( fd, b'line one\nline two\n' * 1000 )
+        os.close( fd )
+
+    def tearDown( self ):
+        os.unlink( self.path )
+
+    def test_read_loop( self ):
+        def count_lines(f):
+            count = 0
+            data = f.read( 4096 )
+            while len(data) > 0:
+                start = data.find( 10 )
+                while start >= 0:
+                    count = count + 1
+                    start = data.find( 10, start + 1 )
+                data = f.read( 4096 )
+            return count
+        with builtin.RawFile( self.path, 'rb' ) as f:
+            self.assertEqual( 2000, rpy.run( count_lines, f ) )
+            self.assertEqual( os.path.getsize( self.path ), f.tell() )
+
+    def test_read_all_and_seek( self ):
+        def tail_length(f, offset):
+            f.seek( -offset, builtin.SEEK_END )
+            data = f.read()
+            return len(data) * 1000 + f.tell() - f.seek( 0, builtin.SEEK_CUR )
+        with builtin.RawFile( self.path, 'rb' ) as f:
+            self.assertEqual( 9000, rpy.run( tail_length, f, 9 ) )
+
+    def test_write( self ):
+        def write_records(f, n):
+            total = 0
+            for i in range(n):
+                total = total + f.write( b'record\n' )
+            return total
+        with builtin.RawFile( self.path, 'r+b' ) as f:
+            f.write( b'head\n' ) # buffered, written before the call
+            self.assertEqual( 21, rpy.run( write_records, f, 3 ) )
+            self.assertEqual( 26, f.tell() )
+            f.seek( 0 )
+            self.assertEqual( b'head\nrecord\nrecord\nrecord\n', f.read( 26 ) )
+
+    def test_invalid_seek_deoptimizes( self ):
+        def seek_before_start(f):
+            return f.seek( -1 )
+        with builtin.RawFile( self.path, 'rb' ) as f:
+            compiled = rpy.compile( seek_before_start, rpy.get_signature( (f,) ) )
+            self.assertRaises( IOError, compiled, f )
+        self.assertEqual( 1, compiled.deoptimization_count )
+
+    def test_deoptimized_after_write( self ):
+        def append_square(f, n):
+            f.seek( 0, builtin.SEEK_END )
+            f.write( b'square\n' )
+            return n * n # overflows: the call bails out after the write
+        size = os.path.getsize( self.path )
+        with builtin.RawFile( self.path, 'r+b' ) as f:
+            self.assertEqual( 9, rpy.run( append_square, f, 3 ) )
+            self.assertRaises( IOError, rpy.run, append_square, f, 2**40 )
+        self.assertEqual( size + 14, os.path.getsize( self.path ) ) # not written again
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import array
+import ctypes
+import rpy
+import unittest
+from rpy import nativelist
+
+class TestListHeader(unittest.TestCase):
+    def test_array_round_trip( self ):
+        py_array = array.array( 'd', [1.0, 2.5] )
+        header = nativelist.make_list_header( py_array, float )
+        self.assertEqual( 2, header.length )
+        self.assertEqual( py_array, nativelist.array_from_header( header, 'd' ) )
+
+    def test_unsupported_array( self ):
+        self.assertRaises( ValueError, nativelist.get_array_signature_type,
+                           array.array( 'b' ) )
+        self.assertRaises( ValueError, nativelist.make_list_header,
+                           array.array( 'd' ), int )
+
+    def test_signature( self ):
+        self.assertEqual( (nativelist.ListSignature( float ), int),
+                          rpy.get_signature( (array.array( 'd' ), 3) ) )
+
+    def test_ctypes_array( self ):
+        py_array = (ctypes.c_double * 2)( 1.0, 2.5 )
+        self.assertEqual( (nativelist.ListSignature( float ),), rpy.get_signature( (py_array,) ) )
+        header = nativelist.make_list_header( py_array, float )
+        self.assertEqual( ctypes.addressof( py_array ), header.data )
+        self.assertRaises( ValueError, nativelist.make_list_header,
+                           (ctypes.c_int32 * 2)(), int )
+
+    def test_copy_on_write( self ):
+        py_array = array.array( 'd', [1.0, 2.5] )
+        header = nativelist.make_list_header( py_array, float )
+        self.assertEqual( nativelist.SHARED_CAPACITY, header.capacity )
+        nativelist.copy_back( header, py_array ) # not modified
+        self.assertEqual( array.array( 'd', [1.0, 2.5] ), py_array )
+        items = (ctypes.c_double * 2)( 3.0, 4.0 ) # copy modified by the native code
+        header.data, header.capacity = ctypes.addressof( items ), 2
+        nativelist.copy_back( header, py_array )
+        self.assertEqual( array.array( 'd', [3.0, 4.0] ), py_array )
+        ctypes_array = (ctypes.c_double * 2)()
+        header = nativelist.make_list_header( ctypes_array, float )
+        header.data = ctypes.addressof( items )
+        nativelist.copy_back( header, ctypes_array )
+        self.assertEqual( [3.0, 4.0], list(ctypes_array) )
+
+class TestCompiledList(unittest.TestCase):
+    def test_append_index_len( self ):
+        def main(n):
+            values = [1, 2]
+            index = 0
+            while index < n:
+                values.append( index * index )
+                index = index + 1
+            return values[-1] + values[1] + len(values)
+        self.assertEqual( 49 + 2 + 10, rpy.run( main, 8 ) )
+
+    def test_slice( self ):
+        def main(n):
+            values = [1.0, 2.0, 3.0, 4.0]
+            head = values[:n]
+            tail = values[n:]
+            return len(head) * 10 + len(tail) + tail[0]
+        self.assertEqual( 10 + 3 + 2.0, rpy.run( main, 1 ) )
+
+    def test_array_parameter( self ):
+        def scale(values, factor):
+            index = 0
+            while index < len(values):
+                values[index] = values[index] * factor
+                index = index + 1
+            values.append( factor )
+        py_array = array.array( 'd', [1.0, 2.0] )
+        rpy.run( scale, py_array, 3.0 )
+        self.assertEqual( array.array( 'd', [3.0, 6.0, 3.0] ), py_array )
+
+    def test_deoptimized_after_store( self ):
+        def increment(values, n):
+            index = 0
+            while index < len(values):
+                values[index] = values[index] + 1
+                index = index + 1
+            return n * n # overflows: CPython re-executes the call
+        py_array = array.array( 'q', [1, 2] )
+        self.assertEqual( 2**80, rpy.run( increment, py_array, 2**40 ) )
+        self.assertEqual( array.array( 'q', [2, 3] ), py_array )
+
+    def test_ctypes_array_parameter( self ):
+        def total(values):
+            result = 0
+            for value in values:
+                result = result + value
+            values[0] = result
+            return result
+        py_array = (ctypes.c_int64 * 4)( 1, 2, 3, 4 )
+        self.assertEqual( 10, rpy.run( total, py_array ) )
+        self.assertEqual( [10, 2, 3, 4], list(py_array) )
+
+    def test_all_parameters_released( self ):
+        def fill(fixed, values):
+            fixed.append( 1.0 ) # a ctypes array can not be resized
+            values[0] = 2.0
+        py_fixed = (ctypes.c_double * 1)( 0.5 )
+        py_array = array.array( 'd', [0.0] )
+        self.assertRaises( ValueError, rpy.run, fill, py_fixed, py_array )
+        self.assertEqual( array.array( 'd', [2.0] ), py_array ) # still copied back
+
+    def test_return_list( self ):
+        def main(n):
+            values = [0]
+            index = 1
+            while index < n:
+                values.append( index )
+                index = index + 1
+            return values[1:]
+        values = rpy.run( main, 4 )
+        self.assertTrue( isinstance( values, memoryview ) )
+        self.assertEqual( [1, 2, 3], values.tolist() )
+        self.assertEqual( [], rpy.run( main, 1 ).tolist() )
+
+    def test_return_parameter( self ):
+        def fill(values, n):
+            index = 0
+            while index < n:
+                values.append( index * 1.0 )
+                index = index + 1
+            return values
+        py_array = array.array( 'd', [0.5] )
+        values = rpy.run( fill, py_array, 2 )
+        self.assertEqual( array.array( 'd', [0.5, 0.0, 1.0] ), py_array )
+        self.assertEqual( [0.5, 0.0, 1.0], values.tolist() )
+        self.assertTrue( values.obj is py_array )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import ctypes
+import gc
+import rpy
+import unittest
+import llvm.core as lcore
+from rpy import nativestruct
+from rpy.rtypes import ConstantTypeRegistry
+
+class Particle:
+    def __init__( self, mass, charge ):
+        self.mass = mass
+        self.charge = charge
+        self.alive = True
+
+def make_particle( mass ):
+    return Particle( mass, 3 )
+
+class Sample(ctypes.Structure):
+    _fields_ = [('flags', ctypes.c_uint8),
+                ('count', ctypes.c_int32),
+                ('total', ctypes.c_double),
+                ('ratio', ctypes.c_float)]
+
+class PackedSample(ctypes.Structure):
+    _pack_ = 1
+    _fields_ = [('flags', ctypes.c_uint8),
+                ('total', ctypes.c_double)]
+
+def accumulate( sample, value ):
+    sample.count = sample.count + 1
+    sample.total = sample.total + value
+    sample.ratio = sample.total / sample.count
+    if sample.flags > 127:
+        sample.flags = 0
+    return sample
+
+class TestStructCType(unittest.TestCase):
+    def test_layout( self ):
+        struct_ctype = nativestruct.make_struct_ctype( 'Sample', [
+            ('flag', lcore.Type.int(1)),
+            ('value', lcore.Type.double()),
+            ('name', lcore.Type.struct( [lcore.Type.pointer( lcore.Type.int(8) ),
+                                         lcore.Type.int(64)] ))] )
+        self.assertEqual( 0, struct_ctype.flag.offset )
+        self.assertEqual( 8, struct_ctype.value.offset )
+        self.assertEqual( 16, struct_ctype.name.offset )
+        self.assertEqual( 32, ctypes.sizeof( struct_ctype ) )
+
+class TestStructType(unittest.TestCase):
+    def test_fields( self ):
+        r_type = ConstantTypeRegistry().from_python_type( Sample, None )
+        self.assertEqual( ['flags', 'count', 'total', 'ratio'],
+                          [name for name, ctype in r_type.class_type.fields] )
+        self.assertEqual( set(['flags']), r_type.class_type.unsigned_fields )
+
+    def test_unsupported_layout( self ):
+        self.assertRaises( ValueError, ConstantTypeRegistry().from_python_type,
+                           PackedSample, None )
+
+class TestStructParameter(unittest.TestCase):
+    def test_in_place( self ):
+        sample = Sample( 200, 1, 2.0, 0.0 )
+        result = rpy.run( accumulate, sample, 4.0 )
+        self.assertTrue( result is sample )
+        self.assertEqual( (0, 2, 6.0, 3.0),
+                          (sample.flags, sample.count, sample.total, sample.ratio) )
+
+    def test_deoptimized_after_store( self ):
+        def count_square(sample, n):
+            sample.count = sample.count + 1
+            return n * n # overflows: CPython re-executes the call
+        sample = Sample( 0, 1, 0.0, 0.0 )
+        self.assertEqual( 2**80, rpy.run( count_square, sample, 2**40 ) )
+        self.assertEqual( 2, sample.count )
+
+    def test_handle_copy( self ):
+        sample = Sample( 0, 1, 0.0, 0.0 )
+        handle = nativestruct.StructHandle( sample )
+        Sample.from_address( handle.address ).count = 5
+        handle.release( False )
+        self.assertEqual( 1, sample.count )
+        handle.release( True )
+        self.assertEqual( 5, sample.count )
+
+class TestReturnedInstance(unittest.TestCase):
+    def test_view( self ):
+        compiled_func = rpy.compile( make_particle, (float,) )
+        particle = compiled_func( 1.5 )
+        self.assertTrue( isinstance( particle, ctypes.Structure ) )
+        self.assertEqual( 'Particle', type(particle).__name__ )
+        self.assertEqual( (1.5, 3, True),
+                          (particle.mass, particle.charge, particle.alive) )
+        # The chunks holding the instance are detached from the arena
+        self.assertEqual( 0, compiled_func.get_allocation_statistics().chunk_count )
+        other = compiled_func( 2.5 )
+        self.assertEqual( (1.5, 2.5), (particle.mass, other.mass) )
+        del particle, other
+        gc.collect()
+
+
+if __name__ == '__main__':
+    unittest.main()
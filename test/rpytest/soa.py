@@ -0,0 +1,56 @@
+import rpy
+import unittest
+from rpy import soa
+
+class Point:
+    def __init__( self, xparam, yparam ):
+        self.x = xparam
+        self.y = yparam
+
+def sum_x( points, n ):
+    total = 0
+    index = 0
+    while index < n:
+        total = total + points[index].x
+        index = index + 1
+    return total
+
+class TestPythonSoA(unittest.TestCase):
+    def test_attribute_columns( self ):
+        points = soa( Point, 3 )
+        self.assertEqual( 3, len(points) )
+        points[1].x = 5
+        points[-1].y = 7
+        self.assertEqual( [0, 5, 0], [p.x for p in points] )
+        self.assertEqual( [0, 0, 7], points.get_column( 'y' ) )
+        self.assertRaises( IndexError, lambda: points[3] )
+
+class TestCompiledSoA(unittest.TestCase):
+    def test_soa_attributes( self ):
+        def main(n):
+            points = soa( Point, n )
+            index = 0
+            while index < n:
+                points[index].x = index
+                points[index].y = 2 * index
+                index = index + 1
+            return sum_x( points, len(points) ) + points[-1].y
+        self.assertEqual( 10 + 8, rpy.run( main, 5 ) )
+
+    def test_module_attribute( self ):
+        def main(n):
+            points = rpy.soa( Point, n )
+            points[0].x = 3
+            return points[0].x + points[1].x
+        self.assertEqual( 3, rpy.run( main, 2 ) )
+
+    def test_index_error( self ):
+        def main(n):
+            points = soa( Point, n )
+            points[0].x = 1
+            return points[n].x
+        self.assertRaises( IndexError, rpy.run, main, 2 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import io
+import operator
+import os
+import rpy
+import tempfile
+import unittest
+
+class TestStream(unittest.TestCase):
+    def setUp( self ):
+        self.data = b''.join( b'record %d\n' % index for index in range(1000) )
+        self.file = tempfile.TemporaryFile()
+        self.file.write( self.data )
+        self.file.seek( 0 )
+        self.rawfile = io.FileIO( self.file.fileno(), 'rb', closefd=False )
+
+    def tearDown( self ):
+        self.rawfile.close()
+        self.file.close()
+
+    def test_compiled_kernel( self ):
+        def count_lines(data):
+            count = 0
+            start = data.find( 10 )
+            while start >= 0:
+                count = count + 1
+                start = data.find( 10, start + 1 )
+            return count
+        self.assertEqual( 1000, rpy.stream( count_lines, self.rawfile, chunk_size=4096,
+                                            reducer=operator.add ) )
+
+    def test_deoptimized_kernel( self ):
+        def scaled_line_length(data):
+            return data.find( 10 ) * 2**62 # overflows: CPython re-executes the call
+        kernel = rpy.compile( scaled_line_length, (bytes,) )
+        self.assertEqual( [8 * 2**62, 0], rpy.stream( kernel, io.BytesIO( b'record 1\n\n' ),
+                                                      chunk_size=9 ) )
+        self.assertEqual( 1, kernel.deoptimization_count )
+
+    def test_chunks( self ):
+        chunks = rpy.stream( bytes, self.rawfile, chunk_size=1000 )
+        self.assertEqual( [1000] * 10 + [len(self.data) - 10000], [ len(chunk) for chunk in chunks ] )
+        self.assertEqual( self.data, b''.join( chunks ) )
+
+    def test_delimiter( self ):
+        chunks = rpy.stream( bytes, self.rawfile, chunk_size=100, delimiter=b'\n' )
+        self.assertTrue( all( chunk.endswith( b'\n' ) for chunk in chunks ) )
+        self.assertEqual( self.data, b''.join( chunks ) )
+        self.rawfile.seek( 0 )
+        self.assertRaises( ValueError, rpy.stream, bytes, self.rawfile, chunk_size=5,
+                           delimiter=b'\n' )
+
+    def test_reducer( self ):
+        self.assertEqual( len(self.data),
+                          rpy.stream( len, self.rawfile, chunk_size=512, reducer=operator.add ) )
+        self.assertEqual( 7, rpy.stream( len, io.BytesIO( b'' ), reducer=operator.add,
+                                         initial=7 ) )
+        self.assertRaises( TypeError, rpy.stream, len, io.BytesIO( b'' ), reducer=operator.add )
+
+    def test_kernel_error( self ):
+        class FailingKernel(object): # not compiled, called as is
+            def __call__( self, chunk ):
+                raise KeyError( 'failed' )
+        self.assertRaises( KeyError, rpy.stream, FailingKernel(), self.rawfile, chunk_size=100 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import rpy
+import unittest
+from rpy.structlayout import StructField, order_fields, get_padding_size
+
+FLAG = StructField( 'flag', 1, 1, 1 )
+X = StructField( 'x', 8, 8, 1 )
+COUNT = StructField( 'count', 4, 4, 5 )
+Y = StructField( 'y', 8, 8, 10 )
+
+class Particle:
+    rpy_layout = rpy.LAYOUT_HOT_FIRST
+    def __init__( self, mass, speed ):
+        self.mass = mass
+        self.alive = True
+        self.speed = speed
+
+class TestStructLayout(unittest.TestCase):
+    def test_declared( self ):
+        fields = [FLAG, X, COUNT, Y]
+        self.assertEqual( fields, order_fields( fields, rpy.LAYOUT_DECLARED ) )
+        self.assertEqual( 7 + 4, get_padding_size( fields ) )
+
+    def test_packed( self ):
+        fields = order_fields( [FLAG, X, COUNT, Y], rpy.LAYOUT_PACKED )
+        self.assertEqual( [X, Y, COUNT, FLAG], fields )
+        self.assertEqual( 3, get_padding_size( fields ) ) # tail padding only
+
+    def test_hot_first( self ):
+        fields = order_fields( [FLAG, X, COUNT, Y], rpy.LAYOUT_HOT_FIRST )
+        self.assertEqual( [Y, COUNT, X, FLAG], fields )
+
+    def test_compiled_hot_first( self ):
+        def main(mass, speed):
+            p = Particle( mass, speed )
+            return p.speed * p.speed + p.mass
+        self.assertEqual( 11, rpy.run( main, 2, 3 ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
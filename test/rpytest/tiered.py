@@ -0,0 +1,43 @@
+import rpy
+import unittest
+import warnings
+
+class TestTiered(unittest.TestCase):
+    def test_cold_function_runs_in_python( self ):
+        @rpy.jit( threshold=3 )
+        def main_cold(x, y):
+            return x + y
+        self.assertEqual( 3, main_cold( 1, 2 ) )
+        self.assertEqual( 1, main_cold.get_call_count( (int, int) ) )
+        self.assertTrue( not main_cold.is_compiled( (int, int) ) )
+
+    def test_hot_function_is_compiled( self ):
+        @rpy.jit( threshold=3 )
+        def main_hot(x, y):
+            return x * y
+        for x in range(0, 3):
+            self.assertEqual( x * 7, main_hot( x, 7 ) )
+        main_hot.wait_for_compilation()
+        self.assertTrue( main_hot.is_compiled( (int, int) ) )
+        self.assertEqual( 42, main_hot( 6, 7 ) )
+        self.assertEqual( 3, main_hot.get_call_count( (int, int) ) )
+
+    def test_compilation_error( self ):
+        @rpy.jit( threshold=1 )
+        def main_error(x):
+            if x < 0:
+                return rpy_undefined_global # not supported by the compiler
+            return x
+        with warnings.catch_warnings( record=True ) as caught:
+            warnings.simplefilter( 'always' )
+            self.assertEqual( 2, main_error( 2 ) )
+            main_error.wait_for_compilation()
+        self.assertEqual( 1, len([ warning for warning in caught
+                                   if 'rpy.jit' in str(warning.message) ]) )
+        self.assertTrue( main_error.get_compilation_error( (int,) ) is not None )
+        self.assertTrue( not main_error.is_compiled( (int,) ) )
+        self.assertEqual( 5, main_error( 5 ) ) # still executed by CPython
+
+
+if __name__ == '__main__':
+    unittest.main()
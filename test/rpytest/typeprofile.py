@@ -0,0 +1,70 @@
+import array
+import rpy
+import unittest
+import os
+import tempfile
+from rpy.nativelist import ListSignature
+
+PROFILER = rpy.TypeProfiler()
+
+@PROFILER.profile
+def sub2i( x, y ):
+    return x - y
+
+@PROFILER.profile
+def first_item( values ):
+    return values[0]
+
+class TestTypeProfile(unittest.TestCase):
+    def setUp( self ):
+        PROFILER.reset()
+
+    def test_record_signatures( self ):
+        self.assertEqual( 1, sub2i( 3, 2 ) )
+        sub2i( 5, 2 )
+        sub2i( True, False )
+        self.assertEqual( [((int, int), 2), ((bool, bool), 1)],
+                          PROFILER.get_signature_counts( sub2i.__wrapped__ ) )
+
+    def test_disabled( self ):
+        PROFILER.enabled = False
+        try:
+            sub2i( 3, 2 )
+        finally:
+            PROFILER.enabled = True
+        self.assertEqual( [], PROFILER.get_signature_counts( sub2i.__wrapped__ ) )
+
+    def test_manifest( self ):
+        sub2i( 3, 2 )
+        sub2i( 4, 2 )
+        fd, path = tempfile.mkstemp( suffix='.json' )
+        os.close( fd )
+        try:
+            PROFILER.save_manifest( path )
+            signatures = rpy.load_manifest( path )
+            self.assertEqual( [((int, int), 2)],
+                              signatures[__name__ + '.sub2i'] )
+            futures = rpy.precompile_manifest( path )
+            self.assertEqual( 1, len(futures) )
+            self.assertEqual( 3, futures[0].result()( 5, 2 ) )
+        finally:
+            os.remove( path )
+
+    def test_array_argument( self ):
+        first_item( array.array( 'd', [2.5] ) )
+        first_item( array.array( 'd', [1.5] ) )
+        first_item( bytearray( b'a' ) )
+        expected = [((ListSignature( float ),), 2), ((bytes,), 1)]
+        self.assertEqual( expected, PROFILER.get_signature_counts( first_item.__wrapped__ ) )
+        fd, path = tempfile.mkstemp( suffix='.json' )
+        os.close( fd )
+        try:
+            PROFILER.save_manifest( path )
+            signatures = rpy.load_manifest( path )
+            self.assertEqual( expected, signatures[__name__ + '.first_item'] )
+        finally:
+            os.remove( path )
+
+
+if __name__ == '__main__':
+    unittest.main()